@@ -8,10 +8,14 @@ from django.contrib.admin.filters import (
     RelatedOnlyFieldListFilter,
     SimpleListFilter,
 )
-from django.contrib.admin.models import ADDITION
-from django.contrib.contenttypes.models import ContentType
+from django.contrib.admin.models import ADDITION, CHANGE, DELETION
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import QuerySet
+from django.urls import reverse
 
-from commons.models import DetailedLog
+from commons import audit
+from commons.models import DetailedLog, DetailedLogArchive
+from commons.pagination import EstimatedCountPaginator
 
 
 class SimpleDropdownFilter(SimpleListFilter):
@@ -34,61 +38,103 @@ class RelatedOnlyDropdownFilter(RelatedOnlyFieldListFilter):
     template = "admin/dropdown_filter.html"
 
 
+class EstimatedCountChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        if self.model_admin.show_estimated_full_count:
+            self.full_result_count = self.paginator.count_of(self.root_queryset)
+            self.show_full_result_count = True
+            self.show_admin_actions = bool(self.full_result_count)
+
+
+class EstimatedCountAdminMixin:
+    """
+    Changelist counts for large tables: unfiltered lists show the PostgreSQL planner estimate,
+    filtered ones an exact count cached per user and query for ``count_cache_timeout`` seconds
+    (``ADMIN_COUNT_CACHE_TIMEOUT`` by default). With ``many_count_threshold`` set, counting stops
+    there and the list shows ``N+``.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # the total is counted by EstimatedCountChangeList instead
+    show_estimated_full_count = True
+    count_cache_timeout = None
+    many_count_threshold = None
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(
+            queryset,
+            per_page,
+            orphans,
+            allow_empty_first_page,
+            cache_prefix=f"{self.opts.label_lower}:{request.user.pk}",
+            timeout=self.count_cache_timeout,
+            many_threshold=self.many_count_threshold,
+        )
+
+
 class DetailedLogAdminMixin:
     save_on_top = True
 
     def _get_field_values(self, obj):
+        if audit.compact_mode():
+            return {field.attname: getattr(obj, field.attname) for field in obj._meta.concrete_fields}
         return {field.name: getattr(obj, field.name) for field in obj._meta.fields}
 
+    def _get_compact_change(self, obj):
+        old_values = getattr(obj, "_audit_old_values", {})
+        ignore = {field.attname for field in obj._meta.concrete_fields if getattr(field, "auto_now", False)}
+        before, after = audit.diff_values(old_values, self._get_field_values(obj), ignore=ignore)
+        model_fields = {field.name for field in obj._meta.concrete_fields}
+        for field, value in getattr(obj, "_audit_changed_values", {}).items():
+            if field not in model_fields:
+                after[field] = list(value.values_list("pk", flat=True)) if isinstance(value, QuerySet) else value
+        return before, after
+
     def _create_detailed_log(self, request, obj, action_flag, message, old_values=None, changed_values=None):
-        return DetailedLog.objects.create(
-            user_id=request.user.pk,
-            content_type_id=ContentType.objects.get_for_model(obj, for_concrete_model=False).id,
-            object_id=obj.pk,
-            object_repr=str(obj)[:200],
-            action_flag=action_flag,
-            change_message=message or "",
-            old_values=old_values or {},
-            changed_values=changed_values or {},
-        )
+        return audit.record(request.user.pk, obj, action_flag, message, old_values, changed_values)
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            obj._audit_old_values = self._get_field_values(obj)
+        return obj
 
     def save_model(self, request, obj, form, change):
         if change:
-            try:
-                old_obj = obj.__class__.objects.get(pk=obj.pk)
-                self.custom_old_values = self._get_field_values(old_obj)
-                self.form_changed_values = {f: form.cleaned_data[f] for f in form.changed_data}
-            except obj.__class__.DoesNotExist:
-                self.custom_old_values = {}
-                self.form_changed_values = {}
+            old_values = getattr(obj, "_audit_old_values", None)
+            if old_values is None:
+                old_obj = obj.__class__.objects.filter(pk=obj.pk).first()
+                old_values = self._get_field_values(old_obj) if old_obj else {}
+            obj._audit_old_values = old_values
+            obj._audit_changed_values = {f: form.cleaned_data[f] for f in form.changed_data} if old_values else {}
         else:
-            self.custom_old_values = {}
-            self.form_changed_values = self._get_field_values(obj)
+            obj._audit_old_values = {}
+            obj._audit_changed_values = self._get_field_values(obj)
         super().save_model(request, obj, form, change)
 
+    def _get_snapshot_values(self, obj):
+        values = self._get_field_values(obj)
+        return audit.compact_values(values) if audit.compact_mode() else values
+
     def log_addition(self, request, object, message):
-        new_values = self._get_field_values(object)
+        new_values = self._get_snapshot_values(object)
         return self._create_detailed_log(request, object, ADDITION, message, old_values={}, changed_values=new_values)
 
     def log_change(self, request, object, message):
-        from django.contrib.admin.models import CHANGE
-
-        # self.custom_new_values = {f.name: getattr(object, f.name) for f in object._meta.fields}
-        # self.custom_changed_values = []
-        # for k in self.custom_new_values:
-        #     if self.custom_old_values[k] != self.custom_new_values[k]:
-        #         self.custom_changed_values.append({k: self.custom_new_values[k]})
-        # self.custom_changed_values.append({"form": self.form_changed_values})
-        # self.custom_changed_values = [{k: v} for k, v in .items()]
-
-        old_values = getattr(self, "custom_old_values", {})
-        changed_values = getattr(self, "form_changed_values", {})
+        if audit.compact_mode():
+            old_values, changed_values = self._get_compact_change(object)
+        else:
+            old_values = getattr(object, "_audit_old_values", {})
+            changed_values = getattr(object, "_audit_changed_values", {})
         return self._create_detailed_log(request, object, CHANGE, message, old_values, changed_values)
 
     def log_deletion(self, request, object, object_repr):
         import warnings
 
-        from django.contrib.admin.models import DELETION
         from django.utils.deprecation import RemovedInDjango60Warning
 
         """
@@ -103,7 +149,7 @@ class DetailedLogAdminMixin:
             stacklevel=2,
         )
 
-        old_values = self._get_field_values(object)
+        old_values = self._get_snapshot_values(object)
         return self._create_detailed_log(request, object, DELETION, "", old_values, {})
 
     def log_deletions(self, request, queryset):
@@ -113,13 +159,12 @@ class DetailedLogAdminMixin:
         Log that objects will be deleted. Note that this method must be called
         before the deletion.
 
-        The default implementation creates admin LogEntry objects.
+        Entries are buffered by ``commons.audit`` and inserted in batches.
         """
-        from django.contrib.admin.models import DELETION
         from django.utils.deprecation import RemovedInDjango60Warning
 
         # RemovedInDjango60Warning.
-        if type(self).log_deletion != ModelAdmin.log_deletion:
+        if type(self).log_deletion not in (ModelAdmin.log_deletion, DetailedLogAdminMixin.log_deletion):
             warnings.warn(
                 "The usage of log_deletion() is deprecated. Implement log_deletions() instead.",
                 RemovedInDjango60Warning,
@@ -127,20 +172,59 @@ class DetailedLogAdminMixin:
             )
             return [self.log_deletion(request, obj, str(obj)) for obj in queryset]
 
-        return [
-            self._create_detailed_log(request, obj, DELETION, "", old_values=self._get_field_values(obj), changed_values={})
-            for obj in queryset
-        ]
+        return audit.record_many(
+            [
+                audit.build_entry(request.user.pk, obj, DELETION, old_values=self._get_snapshot_values(obj), changed_values={})
+                for obj in queryset
+            ]
+        )
 
 
 @admin.register(DetailedLog)
-class DetailedLogAdmin(DALFModelAdmin):
+class DetailedLogAdmin(EstimatedCountAdminMixin, DALFModelAdmin):
     list_display = ("action_time", "user", "content_type", "object_repr", "action_flag", "change_message")
     list_filter = ("action_time", ("user", DALFRelatedFieldAjax), "action_flag")
     search_fields = ("object_repr", "change_message")
     autocomplete_fields = ("user",)
     date_hierarchy = "action_time"
+    change_list_template = "admin/commons/detailedlog/change_list.html"
+    many_count_threshold = 10000
+    readonly_fields = [
+        "action_time",
+        "user",
+        "content_type",
+        "object_id",
+        "object_repr",
+        "action_flag",
+        "change_message",
+        "old_values",
+        "changed_values",
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["archive_url"] = reverse("admin:commons_detailedlogarchive_changelist")
+        return super().changelist_view(request, extra_context)
+
+
+@admin.register(DetailedLogArchive)
+class DetailedLogArchiveAdmin(DALFModelAdmin):
+    list_display = ("action_time", "period", "user", "content_type", "object_repr", "action_flag", "change_message")
+    list_filter = ("period", ("user", DALFRelatedFieldAjax), "action_flag")
+    search_fields = ("object_repr", "change_message", "=object_id")
+    autocomplete_fields = ("user",)
     readonly_fields = [
+        "period",
+        "original_id",
         "action_time",
         "user",
         "content_type",
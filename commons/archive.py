@@ -0,0 +1,67 @@
+import gzip
+import json
+from pathlib import Path
+
+from django.contrib.admin.models import LogEntry
+from django.db import transaction
+from django.utils import timezone
+from jdatetime import datetime as jdatetime
+
+from commons.models import DetailedLog, DetailedLogArchive, LogEncoder
+
+ARCHIVE_FIELDS = [
+    "action_time",
+    "user_id",
+    "content_type_id",
+    "object_id",
+    "object_repr",
+    "action_flag",
+    "change_message",
+    "old_values",
+    "changed_values",
+]
+
+
+def jalali_period(value):
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    return jdatetime.fromgregorian(datetime=value).strftime("%Y-%m")
+
+
+def _export(export_dir, archives):
+    """Appends the archived rows to one gzip JSON-lines file per Jalali month."""
+    by_period = {}
+    for archive in archives:
+        by_period.setdefault(archive.period, []).append(archive)
+    for period, rows in by_period.items():
+        path = Path(export_dir) / f"detailed_log_{period}.jsonl.gz"
+        with gzip.open(path, "at", encoding="utf-8") as file:
+            for row in rows:
+                data = {"id": row.original_id, "period": period}
+                data.update({field: getattr(row, field) for field in ARCHIVE_FIELDS})
+                file.write(json.dumps(data, cls=LogEncoder, ensure_ascii=False) + "\n")
+
+
+def archive_detailed_logs(before, batch_size=2000, export_dir=None):
+    """
+    Moves detailed log entries older than ``before`` into DetailedLogArchive, batch by
+    batch, optionally also writing them to compressed monthly files. Returns the number moved.
+    """
+    moved = 0
+    while True:
+        with transaction.atomic():
+            batch = list(DetailedLog.objects.filter(action_time__lt=before).order_by("pk")[:batch_size])
+            if not batch:
+                return moved
+            archives = [
+                DetailedLogArchive(
+                    period=jalali_period(entry.action_time),
+                    original_id=entry.pk,
+                    **{field: getattr(entry, field) for field in ARCHIVE_FIELDS},
+                )
+                for entry in batch
+            ]
+            DetailedLogArchive.objects.bulk_create(archives, ignore_conflicts=True)
+            LogEntry.objects.filter(pk__in=[entry.pk for entry in batch]).delete()
+            if export_dir:
+                _export(export_dir, archives)
+        moved += len(batch)
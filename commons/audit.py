@@ -0,0 +1,126 @@
+import logging
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, router, transaction
+from django.utils import timezone
+
+from commons.models import DetailedLog
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+def _flush_size():
+    return getattr(settings, "AUDIT_FLUSH_SIZE", 500)
+
+
+def compact_mode():
+    return getattr(settings, "AUDIT_LOG_MODE", "compact") == "compact"
+
+
+def compact_values(values):
+    return {key: value for key, value in values.items() if value not in (None, "")}
+
+
+def diff_values(old_values, new_values, ignore=()):
+    """``(before, after)`` dicts holding only the keys whose value changed."""
+    keys = [key for key, value in new_values.items() if key in old_values and key not in ignore and old_values[key] != value]
+    return {key: old_values[key] for key in keys}, {key: new_values[key] for key in keys}
+
+
+def _buffer():
+    if not hasattr(_state, "entries"):
+        _state.entries = []
+        _state.depth = 0
+    return _state.entries
+
+
+def build_entry(user_id, obj, action_flag, message="", old_values=None, changed_values=None):
+    return DetailedLog(
+        action_time=timezone.now(),
+        user_id=user_id,
+        content_type_id=ContentType.objects.get_for_model(obj, for_concrete_model=False).id,
+        object_id=str(obj.pk),
+        object_repr=str(obj)[:200],
+        action_flag=action_flag,
+        change_message=message or "",
+        old_values=old_values or {},
+        changed_values=changed_values or {},
+    )
+
+
+def record(user_id, obj, action_flag, message="", old_values=None, changed_values=None):
+    return record_many([build_entry(user_id, obj, action_flag, message, old_values, changed_values)])[0]
+
+
+def record_many(entries):
+    """
+    Writes DetailedLog entries. Inside ``buffered_audit()`` they are queued once their
+    transaction commits and inserted in batches; otherwise they are inserted right away.
+    """
+    _buffer()
+    if not _state.depth:
+        bulk_insert(entries)
+    elif connection.in_atomic_block:
+        transaction.on_commit(partial(_enqueue, entries))
+    else:
+        _enqueue(entries)
+    return entries
+
+
+def _enqueue(entries):
+    buffer = _buffer()
+    buffer.extend(entries)
+    if len(buffer) >= _flush_size() or not _state.depth:
+        flush()
+
+
+def flush():
+    entries = _buffer()
+    if not entries:
+        return
+    _state.entries = []
+    bulk_insert(entries)
+
+
+def bulk_insert(entries, batch_size=None):
+    """
+    ``bulk_create`` does not support multi-table inheritance, so the LogEntry parents are
+    bulk inserted first and the DetailedLog rows are then inserted with their pointers.
+    """
+    batch_size = batch_size or _flush_size()
+    parent_fields = [field for field in LogEntry._meta.concrete_fields if not field.primary_key]
+    child_fields = DetailedLog._meta.local_concrete_fields
+    using = router.db_for_write(DetailedLog)
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start : start + batch_size]
+            parents = LogEntry.objects.using(using).bulk_create(
+                [LogEntry(**{field.attname: getattr(entry, field.attname) for field in parent_fields}) for entry in batch]
+            )
+            for entry, parent in zip(batch, parents, strict=True):
+                entry.id = entry.logentry_ptr_id = parent.pk
+                entry._state.adding = False
+                entry._state.db = using
+            DetailedLog._base_manager._insert(batch, fields=child_fields, using=using)
+
+
+@contextmanager
+def buffered_audit():
+    _buffer()
+    _state.depth += 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+        if not _state.depth:
+            try:
+                flush()
+            except Exception:
+                logger.exception("Could not flush audit log entries")
@@ -0,0 +1,234 @@
+import csv
+import hashlib
+import itertools
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Count, Max
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from openpyxl import Workbook
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+EXPORT_SPECS = {}
+
+
+class Column:
+    """
+    One exported column. ``field`` is a ``values()`` path (``user__first_name``); computed columns
+    pass ``value``, a callable on the row dict, together with the ``fields`` it reads. Non-empty
+    values are mapped through ``choices``, ``date_format`` or ``formatter``; empty ones become ``default``.
+    """
+
+    def __init__(self, header, field=None, *, choices=None, date_format=None, formatter=None, value=None, fields=(), default=""):
+        self.header = header
+        self.field = field
+        self.choices = dict(choices) if choices is not None else None
+        self.date_format = date_format
+        self.formatter = formatter
+        self.value = value
+        self.fields = [field] if field else list(fields)
+        self.default = default
+
+    def render(self, row):
+        value = self.value(row) if self.value else row[self.field]
+        if value is None or (isinstance(value, str) and not value):
+            return self.default
+        if self.choices is not None:
+            return self.choices.get(value, value)
+        if self.date_format:
+            return value.strftime(self.date_format)
+        if self.formatter:
+            return self.formatter(value)
+        return value
+
+
+def name_column(header, relation, **options):
+    """A column with the full name of the ``relation`` user (empty when there is none)."""
+    first_name, last_name = f"{relation}__first_name", f"{relation}__last_name"
+
+    def full_name(row):
+        return None if row[first_name] is None else f"{row[first_name]} {row[last_name]}"
+
+    return Column(header, value=full_name, fields=[first_name, last_name], **options)
+
+
+class ExportSpec:
+    """A named, declarative export of ``model``: its columns, ordering and sheet name."""
+
+    def __init__(self, name, model, columns, order_by=("pk",), sheet_name="data", chunk_size=EXPORT_CHUNK_SIZE):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.order_by = list(order_by)
+        self.sheet_name = sheet_name
+        self.chunk_size = chunk_size
+
+    @property
+    def headers(self):
+        return [column.header for column in self.columns]
+
+    @property
+    def fields(self):
+        return list(dict.fromkeys(field for column in self.columns for field in column.fields))
+
+    @property
+    def relations(self):
+        """The related models the columns read from, as lookup prefixes (``user``, ``supporting_user``)."""
+        return list(dict.fromkeys(field.rsplit("__", 1)[0] for field in self.fields if "__" in field))
+
+    def rows(self, queryset):
+        """Streams the rendered rows of ``queryset`` with one ``values()`` query iterated in chunks."""
+        for row in queryset.order_by(*self.order_by).values(*self.fields).iterator(chunk_size=self.chunk_size):
+            yield [column.render(row) for column in self.columns]
+
+    def data_version(self, queryset):
+        """
+        Row count plus the latest ``_updated_at`` of the exported rows and of every related row they
+        read from, fetched with one aggregate query. Any insert, delete or edit changes it.
+        """
+        aggregates = {"rows": Count("pk"), "updated": Max("_updated_at")}
+        for index, relation in enumerate(self.relations):
+            if hasattr(self._related_model(relation), "_updated_at"):
+                aggregates[f"updated_{index}"] = Max(f"{relation}___updated_at")
+        version = queryset.order_by().aggregate(**aggregates)
+        return ":".join(str(version[key]) for key in sorted(version))
+
+    def _related_model(self, relation):
+        model = self.model
+        for name in relation.split("__"):
+            model = model._meta.get_field(name).related_model
+        return model
+
+    def write(self, queryset, output, file_format):
+        if file_format == "xlsx":
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet(self.sheet_name)
+            sheet.append(self.headers)
+            for row in self.rows(queryset):
+                sheet.append(row)
+            workbook.save(output)
+        elif file_format == "csv":
+            with open(output, "w", encoding="utf-8-sig", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(self.headers)
+                writer.writerows(self.rows(queryset))
+        elif file_format == "parquet":
+            # needs pyarrow (or fastparquet) installed
+            pd.DataFrame(list(self.rows(queryset)), columns=self.headers).to_parquet(output, index=False)
+        else:
+            raise ValueError(f"Unsupported export format: {file_format}")
+
+
+def register_export(spec):
+    EXPORT_SPECS[spec.name] = spec
+    return spec
+
+
+def _query_key(queryset):
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return "empty"
+    return hashlib.sha256(f"{sql}{params}".encode()).hexdigest()[:16]
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _cache_path(spec, queryset, file_format, cache_dir=None):
+    """(directory, query prefix, path) of the cached ``file_format`` export of ``queryset``."""
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {file_format}")
+    directory = Path(cache_dir or settings.EXPORT_CACHE_DIR) / spec.name
+    prefix = _query_key(queryset)
+    version = hashlib.sha256(spec.data_version(queryset).encode()).hexdigest()[:16]
+    return directory, prefix, directory / f"{prefix}-{version}.{file_format}"
+
+
+def _temporary_file(directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    handle, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(handle)
+    return temporary_path
+
+
+def _publish(temporary_path, path, prefix):
+    """Moves a finished export into place and removes the stale versions of the same query."""
+    os.replace(temporary_path, path)
+    for stale in path.parent.glob(f"{prefix}-*{path.suffix}"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+
+
+def export_file(spec, queryset, file_format="xlsx", cache_dir=None):
+    """
+    The path of the ``file_format`` export of ``queryset``. Files are cached under
+    ``EXPORT_CACHE_DIR`` keyed by the query and its data version, so a repeated download of
+    unchanged data only costs the version query; stale versions of the same query are removed.
+    """
+    directory, prefix, path = _cache_path(spec, queryset, file_format, cache_dir)
+    if not path.exists():
+        _write_cache(spec, queryset, file_format, directory, prefix, path)
+    return path
+
+
+def _write_cache(spec, queryset, file_format, directory, prefix, path):
+    temporary_path = _temporary_file(directory)
+    try:
+        spec.write(queryset, temporary_path, file_format)
+        _publish(temporary_path, path, prefix)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def _streamed_csv(spec, queryset, directory, prefix, path):
+    """CSV lines of ``queryset`` as they are read, written to the cache file on the way."""
+    writer = csv.writer(_Echo())
+    temporary_path = _temporary_file(directory)
+    try:
+        with open(temporary_path, "w", encoding="utf-8-sig", newline="") as file:
+            yield "\ufeff"  # BOM, so Excel opens the Persian text as UTF-8
+            for row in itertools.chain([spec.headers], spec.rows(queryset)):
+                line = writer.writerow(row)
+                file.write(line)
+                yield line
+        _publish(temporary_path, path, prefix)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def export_response(spec, queryset, filename, file_format="xlsx"):
+    """
+    A download of ``queryset`` streamed from its cached export file. A CSV that is not cached
+    yet is streamed row by row while its cache file is written; other formats are built first.
+    """
+    directory, prefix, path = _cache_path(spec, queryset, file_format)
+    if file_format == "csv" and not path.exists():
+        response = StreamingHttpResponse(
+            _streamed_csv(spec, queryset, directory, prefix, path), content_type=EXPORT_FORMATS["csv"]
+        )
+        response["Content-Disposition"] = content_disposition_header(True, f"{filename}.csv")
+        return response
+    if not path.exists():
+        _write_cache(spec, queryset, file_format, directory, prefix, path)
+    return FileResponse(
+        open(path, "rb"),
+        as_attachment=True,
+        filename=f"{filename}.{file_format}",
+        content_type=EXPORT_FORMATS[file_format],
+    )
@@ -1,4 +1,6 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from jdatetime import datetime as jdatetime
 
 
 class BigNumberInput(forms.NumberInput):
@@ -14,3 +16,50 @@ class FinancialNumberFormMixin(forms.ModelForm):
         for _, field in self.fields.items():
             if isinstance(field.widget, forms.NumberInput):
                 field.widget = BigNumberInput(attrs=field.widget.attrs)
+
+
+class JalaliInitialFormMixin(forms.BaseForm):
+    """
+    Drops the microseconds of Jalali datetime initials, as Django already does for stdlib
+    datetimes, so an untouched Jalali datetime field no longer reports a change on every save.
+    """
+
+    def get_initial_for_field(self, field, field_name):
+        value = super().get_initial_for_field(field, field_name)
+        if isinstance(value, jdatetime) and not field.widget.supports_microseconds:
+            value = value.replace(microsecond=0)
+        return value
+
+
+class _LoadedObjectChoiceField(forms.ModelChoiceField):
+    """The hidden primary key field of a formset row, resolved from the objects the formset already loaded."""
+
+    def __init__(self, formset, *args, **kwargs):
+        self.formset = formset
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value not in self.empty_values:
+            try:
+                obj = self.formset._existing_object(self.formset.model._meta.pk.to_python(value))
+            except ValidationError:
+                obj = None
+            if obj is not None:
+                return obj
+        return super().to_python(value)
+
+
+class PreloadedInlineFormSet(forms.BaseInlineFormSet):
+    """
+    Inline formset whose rows find their object in the formset's own queryset, instead of one
+    ``SELECT`` per submitted row to validate the hidden id.
+    """
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        pk_name = self.model._meta.pk.name
+        field = form.fields.get(pk_name)
+        if type(field) is forms.ModelChoiceField:
+            form.fields[pk_name] = _LoadedObjectChoiceField(
+                self, field.queryset, initial=field.initial, required=False, widget=field.widget
+            )
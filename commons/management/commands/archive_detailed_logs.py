@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from commons.archive import archive_detailed_logs
+
+
+class Command(BaseCommand):
+    help = "Move old detailed log entries into the monthly (Jalali) archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "AUDIT_ARCHIVE_AFTER_DAYS", 180),
+            help="Archive entries older than this many days",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--export-dir", help="Also write the archived entries to gzip JSON-lines files in this directory")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["days"])
+        moved = archive_detailed_logs(before, batch_size=options["batch_size"], export_dir=options["export_dir"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} log entries older than {options['days']} days"))
@@ -23,6 +23,7 @@ class Command(BaseCommand):
             "change_coursetransaction",
             "view_coursetransaction",
             "add_user",
+            "view_importjob",
         ]
         reg_permissions = [Permission.objects.get(codename=permission) for permission in reg_permission_code]
         sup_permission_code = [
@@ -2,6 +2,8 @@ import re
 
 from django.shortcuts import redirect
 
+from commons.audit import buffered_audit
+
 
 class AddTrailingSlashMiddleware:
     def __init__(self, get_response):
@@ -19,3 +21,14 @@ class AddTrailingSlashMiddleware:
         if should_redirect:
             return redirect(path + "/", permanent=True)
         return self.get_response(request)
+
+
+class AuditBufferMiddleware:
+    """Collects the audit entries of a request and inserts them in one batch at the end."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffered_audit():
+            return self.get_response(request)
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:01
+
+import commons.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commons', '0002_alter_detailedlog_options_and_more'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetailedLogArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(db_index=True, max_length=7)),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('action_time', models.DateTimeField(db_index=True)),
+                ('object_id', models.TextField(blank=True, null=True)),
+                ('object_repr', models.CharField(max_length=200)),
+                ('action_flag', models.PositiveSmallIntegerField()),
+                ('change_message', models.TextField(blank=True)),
+                ('old_values', models.JSONField(decoder=commons.models.LogDecoder, default=dict, encoder=commons.models.LogEncoder)),
+                ('changed_values', models.JSONField(decoder=commons.models.LogDecoder, default=dict, encoder=commons.models.LogEncoder)),
+                ('content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Archived Log Entry',
+                'verbose_name_plural': 'Archived Log Entries',
+                'ordering': ['-action_time'],
+                'indexes': [models.Index(fields=['content_type', 'object_id'], name='commons_det_content_77e9e2_idx')],
+            },
+        ),
+    ]
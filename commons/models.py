@@ -25,6 +25,45 @@ class TimeStampedModel(models.Model):
         return self._updated_at
 
 
+class TrackedFieldsMixin:
+    """
+    Remembers the values of ``tracked_fields`` (attnames) as they were loaded
+    from the database, so save hooks can diff against them without a re-fetch.
+    """
+
+    tracked_fields = []
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.reset_loaded_values()
+        return instance
+
+    def reset_loaded_values(self):
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {field: getattr(self, field) for field in self.tracked_fields if field not in deferred}
+
+    def get_loaded_value(self, field, default=None):
+        return getattr(self, "_loaded_values", {}).get(field, default)
+
+    @property
+    def has_loaded_values(self):
+        """Whether every tracked field was loaded (none of them deferred)."""
+        loaded = getattr(self, "_loaded_values", None)
+        return bool(loaded) and len(loaded) == len(self.tracked_fields)
+
+    def load_stored_values(self):
+        """
+        Snapshots the tracked fields from the stored row when they did not come with the instance
+        (built with an explicit pk, returned by ``bulk_create``, or loaded with ``only()``).
+        """
+        if self.pk is None or self.has_loaded_values:
+            return
+        stored = type(self)._base_manager.filter(pk=self.pk).values(*self.tracked_fields).first()
+        if stored is not None:
+            self._loaded_values = stored
+
+
 class LogDecoder(JSONDecoder):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs, object_hook=self.dict_to_object)
@@ -35,7 +74,13 @@ class LogDecoder(JSONDecoder):
 
         obj_type = d.pop("__type__")
 
-        if obj_type == "datetime":
+        if obj_type == "jdatetime":
+            return jdatetime.fromisoformat(d.pop("date"))
+
+        elif obj_type == "jdate":
+            return jdate.fromisoformat(d.pop("date"))
+
+        elif obj_type == "datetime":
             date_str = d.pop("date")
             try:
                 return datetime.fromisoformat(date_str)
@@ -61,12 +106,22 @@ class LogDecoder(JSONDecoder):
 
 class LogEncoder(JSONEncoder):
     def default(self, o):
-        if isinstance(o, datetime | jdatetime):
+        if isinstance(o, jdatetime):
+            return {
+                "__type__": "jdatetime",
+                "date": o.isoformat(),
+            }
+        elif isinstance(o, jdate):
+            return {
+                "__type__": "jdate",
+                "date": o.isoformat(),
+            }
+        elif isinstance(o, datetime):
             return {
                 "__type__": "datetime",
                 "date": o.isoformat(),
             }
-        elif isinstance(o, date | jdate):
+        elif isinstance(o, date):
             return {
                 "__type__": "date",
                 "date": o.isoformat(),
@@ -88,3 +143,30 @@ class DetailedLog(LogEntry):
     class Meta:
         verbose_name = "Detailed Log Entry"
         verbose_name_plural = "Detailed Log Entries"
+
+
+class DetailedLogArchive(models.Model):
+    """Detailed log entries moved out of the hot table, partitioned by Jalali month (``period``, e.g. ``1404-05``)."""
+
+    period = models.CharField(max_length=7, db_index=True)
+    original_id = models.BigIntegerField(unique=True)
+    action_time = models.DateTimeField(db_index=True)
+    user = models.ForeignKey("users.User", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    content_type = models.ForeignKey(
+        "contenttypes.ContentType", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    object_id = models.TextField(null=True, blank=True)
+    object_repr = models.CharField(max_length=200)
+    action_flag = models.PositiveSmallIntegerField()
+    change_message = models.TextField(blank=True)
+    old_values = models.JSONField(encoder=LogEncoder, decoder=LogDecoder, default=dict)
+    changed_values = models.JSONField(encoder=LogEncoder, decoder=LogDecoder, default=dict)
+
+    class Meta:
+        verbose_name = "Archived Log Entry"
+        verbose_name_plural = "Archived Log Entries"
+        ordering = ["-action_time"]
+        indexes = [models.Index(fields=["content_type", "object_id"])]
+
+    def __str__(self):
+        return f"{self.period} - {self.object_repr}"
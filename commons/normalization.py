@@ -0,0 +1,114 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+DIGIT_TABLE = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+PERSIAN_CHARACTER_TABLE = str.maketrans({"ك": "ک", "ي": "ی", "ؤ": "و", "إ": "ا"})
+NON_DIGIT = re.compile(r"\D")
+SCALAR_CACHE_SIZE = 65536
+
+
+def convert_to_english_digit(text: str) -> str:
+    if not text:
+        return None
+    return NON_DIGIT.sub("", text.translate(DIGIT_TABLE))
+
+
+def arabic_to_persian_characters(text: str) -> str:
+    if text is None or not isinstance(text, str):
+        return text
+    return text.translate(PERSIAN_CHARACTER_TABLE)
+
+
+def normalize_phone(phone: str) -> str | None:
+    if not phone:
+        return None
+    return _normalize_phone_text(str(phone))
+
+
+def normalize_national_id(national_id: str) -> str | None:
+    if not national_id:
+        return None
+    return _normalize_national_id_text(str(national_id))
+
+
+@lru_cache(maxsize=SCALAR_CACHE_SIZE)
+def _normalize_phone_text(text):
+    phone = convert_to_english_digit(text.strip())
+    if not phone:
+        return None
+    if len(phone) == 11 and phone.startswith("09"):
+        return "+98" + phone[1:]
+    elif len(phone) == 10 and phone.startswith("9"):
+        return "+98" + phone
+    elif len(phone) == 14 and phone.startswith("0098"):
+        return "+" + phone[2:]
+    elif len(phone) == 12 and phone.startswith("98"):
+        return "+" + phone
+    elif len(phone) > 15 or len(phone) < 10:
+        return None
+    return phone
+
+
+@lru_cache(maxsize=SCALAR_CACHE_SIZE)
+def _normalize_national_id_text(text):
+    cleaned_id = convert_to_english_digit(text.strip()) or ""
+    if len(cleaned_id) == 8:
+        return "00" + cleaned_id
+    elif len(cleaned_id) == 10:
+        return cleaned_id
+    return None
+
+
+def _digits(series):
+    """Digits-only text of every truthy value; falsy values (None, NaN, "", 0) become ""."""
+    truthy = series.map(bool, na_action="ignore").eq(True)
+    text = series.where(truthy, "").astype(str).str.strip()
+    return text.str.translate(DIGIT_TABLE).str.replace(NON_DIGIT, "", regex=True)
+
+
+def _as_result(values, index):
+    return pd.Series(values, index=index, dtype=object).where(lambda result: result.notna(), None)
+
+
+def normalize_phones(values):
+    """``normalize_phone`` over a whole pandas Series (vectorized) or any iterable (cached scalar path)."""
+    if not isinstance(values, pd.Series):
+        return [normalize_phone(value) for value in values]
+    digits = _digits(values)
+    length = digits.str.len()
+    result = np.select(
+        [
+            (length == 11) & digits.str.startswith("09"),
+            (length == 10) & digits.str.startswith("9"),
+            (length == 14) & digits.str.startswith("0098"),
+            (length == 12) & digits.str.startswith("98"),
+            (length > 15) | (length < 10),
+        ],
+        ["+98" + digits.str[1:], "+98" + digits, "+" + digits.str[2:], "+" + digits, None],
+        default=digits,
+    )
+    return _as_result(result, values.index)
+
+
+def normalize_national_ids(values):
+    """``normalize_national_id`` over a whole pandas Series (vectorized) or any iterable."""
+    if not isinstance(values, pd.Series):
+        return [normalize_national_id(value) for value in values]
+    digits = _digits(values)
+    length = digits.str.len()
+    result = np.select([length == 8, length == 10], ["00" + digits, digits], default=None)
+    return _as_result(result, values.index)
+
+
+def normalize_names(values):
+    """``arabic_to_persian_characters`` over a whole pandas Series or any iterable; non-text values pass through."""
+    if not isinstance(values, pd.Series):
+        return [arabic_to_persian_characters(value) for value in values]
+    try:
+        translated = values.str.translate(PERSIAN_CHARACTER_TABLE)
+    except AttributeError:  # not a text column
+        return values
+    return translated.where(translated.notna(), values)
@@ -0,0 +1,115 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def _cache_timeout():
+    return getattr(settings, "ADMIN_COUNT_CACHE_TIMEOUT", 60)
+
+
+def _estimate_min_rows():
+    return getattr(settings, "ADMIN_COUNT_ESTIMATE_MIN_ROWS", 10000)
+
+
+class EstimatedCount(int):
+    """A planner estimate of a row count; it is shown as ``~N``."""
+
+    def __str__(self):
+        return f"~{int(self)}"
+
+
+class ManyCount(int):
+    """A count that stopped at its threshold; it is shown as ``N+``."""
+
+    def __str__(self):
+        return f"{int(self)}+"
+
+
+def is_unfiltered(queryset):
+    query = queryset.query
+    return not (query.where or query.distinct or query.combinator or query.group_by or query.is_sliced)
+
+
+def planner_estimate(queryset):
+    """
+    The PostgreSQL planner's row estimate (``pg_class.reltuples``) of an unfiltered ``queryset``, or
+    None on other databases, for filtered querysets and for tables too small for the estimate to be
+    worth its inaccuracy (or never analyzed).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql" or not is_unfiltered(queryset):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [connection.ops.quote_name(queryset.model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < _estimate_min_rows():
+        return None
+    return EstimatedCount(row[0])
+
+
+def _for_counting(queryset):
+    """``queryset`` without what does not change its count, so list and total share cache entries."""
+    return queryset.order_by().select_related(None)
+
+
+def count_cache_key(queryset, prefix=""):
+    queryset = _for_counting(queryset)
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return None
+    digest = hashlib.sha256(f"{queryset.db}{sql}{params}".encode()).hexdigest()[:24]
+    return f"admin-count:{prefix}:{digest}"
+
+
+def bounded_count(queryset, threshold=None):
+    """The exact count of ``queryset``; above ``threshold`` counting stops and a ``ManyCount`` is returned."""
+    queryset = _for_counting(queryset)
+    if threshold is None:
+        return queryset.count()
+    count = queryset[: threshold + 1].count()
+    return ManyCount(threshold) if count > threshold else count
+
+
+def fast_count(queryset, cache_prefix="", timeout=None, many_threshold=None):
+    """
+    A row count of ``queryset`` whose cost does not grow with the table: the planner estimate
+    when the queryset is unfiltered, otherwise the (bounded) count cached for ``timeout`` seconds
+    under ``cache_prefix`` and the query itself.
+    """
+    estimate = planner_estimate(queryset)
+    if estimate is not None:
+        return estimate
+    key = count_cache_key(queryset, cache_prefix)
+    if key is None:
+        return 0
+    count = cache.get(key)
+    if count is None:
+        count = bounded_count(queryset, many_threshold)
+        cache.set(key, count, _cache_timeout() if timeout is None else timeout)
+    return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """A Paginator whose ``count`` comes from ``fast_count``."""
+
+    def __init__(self, object_list, per_page, *args, cache_prefix="", timeout=None, many_threshold=None, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        self.cache_prefix = cache_prefix
+        self.timeout = timeout
+        self.many_threshold = many_threshold
+
+    def count_of(self, queryset):
+        return fast_count(queryset, self.cache_prefix, self.timeout, self.many_threshold)
+
+    @cached_property
+    def count(self):
+        return self.count_of(self.object_list)
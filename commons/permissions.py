@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.utils.functional import cached_property
+
+
+class PermissionResolver:
+    """
+    Loads the user's group names and managed/supported course ids once and answers
+    every permission check of a request from memory.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.user_id = user.pk
+
+    @property
+    def is_superuser(self):
+        return bool(self.user.is_superuser)
+
+    @cached_property
+    def group_names(self):
+        if not self.user_id:
+            return frozenset()
+        return frozenset(self.user.groups.values_list("name", flat=True))
+
+    @cached_property
+    def managed_course_ids(self):
+        if not self.user_id:
+            return frozenset()
+        through = type(self.user).managed_courses.through
+        return frozenset(through.objects.filter(user_id=self.user_id).values_list("course_id", flat=True))
+
+    @cached_property
+    def supported_course_ids(self):
+        if not self.user_id:
+            return frozenset()
+        through = type(self.user).supported_courses.through
+        return frozenset(through.objects.filter(user_id=self.user_id).values_list("course_id", flat=True))
+
+    def in_group(self, name):
+        return name in self.group_names
+
+    @property
+    def is_managing(self):
+        return self.is_superuser or self.in_group(settings.MANAGING_GROUP_NAME)
+
+    def manages_course(self, course):
+        if self.is_superuser:
+            return True
+        course_id = getattr(course, "pk", course)
+        return course_id is not None and course_id in self.managed_course_ids
+
+    def supports_course(self, course):
+        course_id = getattr(course, "pk", course)
+        return course_id is not None and course_id in self.supported_course_ids
+
+
+def get_permission_resolver(request):
+    """The resolver cached on ``request``, rebuilt if the request's user changes."""
+    resolver = getattr(request, "_permission_resolver", None)
+    if resolver is None or resolver.user_id != request.user.pk:
+        resolver = PermissionResolver(request.user)
+        request._permission_resolver = resolver
+    return resolver
@@ -0,0 +1,101 @@
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_recalculators = {}
+_state = threading.local()
+
+
+def _pending():
+    if not hasattr(_state, "pending"):
+        _state.pending = defaultdict(set)
+        _state.suspended = 0
+        _state.batch = None
+    return _state.pending
+
+
+class _CommitBatch:
+    """Rows marked inside one transaction; recomputed once when it commits, dropped if it rolls back."""
+
+    def __init__(self):
+        self.pending = defaultdict(set)
+
+    def flush(self):
+        if _state.batch is self:
+            _state.batch = None
+        _flush(self.pending)
+
+
+def _commit_batch():
+    """The batch of the current transaction, registering its on-commit flush the first time."""
+    batch = _state.batch
+    hooks = transaction.get_connection().run_on_commit
+    # A rolled back transaction (or savepoint) discards its hooks, and the batch with them.
+    if batch is None or not any(func == batch.flush for _, func, _ in hooks):
+        batch = _state.batch = _CommitBatch()
+        transaction.on_commit(batch.flush)
+    return batch
+
+
+def register_recalculator(model, func):
+    """``func(ids)`` recomputes the derived fields of ``model`` rows with the given primary keys."""
+    _recalculators[model._meta.label] = func
+
+
+def mark_dirty(model, *ids):
+    """
+    Records rows whose derived fields must be recomputed. Inside an atomic block the
+    work runs once on commit, however many times the same row was marked.
+    """
+    ids = {pk for pk in ids if pk is not None}
+    if not ids:
+        return
+    pending = _pending()
+    if _state.suspended:
+        pending[model._meta.label].update(ids)
+    elif transaction.get_connection().in_atomic_block:
+        _commit_batch().pending[model._meta.label].update(ids)
+    else:
+        _flush({model._meta.label: ids})
+
+
+def _flush(pending):
+    while pending:
+        label, ids = pending.popitem()
+        func = _recalculators.get(label)
+        if func is None:
+            logger.warning("No recalculator registered for %s", label)
+            continue
+        func(sorted(ids))
+
+
+def flush_recalculations():
+    """Recomputes the rows marked while recalculation was deferred."""
+    _flush(_pending())
+
+
+@contextmanager
+def deferred_recalculation(flush=True):
+    """
+    Suspends recalculation for bulk scripts; everything marked inside is recomputed
+    once on exit, or left pending for an explicit ``flush_recalculations()``. An error
+    escaping the outermost block clears the pending rows instead of leaving them to a
+    later, unrelated flush.
+    """
+    pending = _pending()
+    _state.suspended += 1
+    try:
+        yield
+    except BaseException:
+        if _state.suspended == 1:
+            pending.clear()
+        raise
+    finally:
+        _state.suspended -= 1
+    if flush and not _state.suspended:
+        flush_recalculations()
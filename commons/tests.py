@@ -1 +1,220 @@
-# Create your tests here.
+import gzip
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+import pandas as pd
+from django.contrib.admin.models import CHANGE, DELETION, LogEntry
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from commons import audit
+from commons.admin import DetailedLogAdmin
+from commons.archive import jalali_period
+from commons.models import DetailedLog, DetailedLogArchive
+from commons.normalization import (
+    arabic_to_persian_characters,
+    normalize_names,
+    normalize_national_id,
+    normalize_national_ids,
+    normalize_phone,
+    normalize_phones,
+)
+from commons.pagination import ManyCount, fast_count
+from commons.utils import get_or_update_user, get_or_update_users
+from financials.models import Commodity
+from users.models import User
+
+
+class AuditBufferTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin")
+        self.commodities = Commodity.objects.bulk_create([Commodity(name=f"commodity {i}") for i in range(30)])
+
+    def test_bulk_insert_keeps_parent_and_child_in_sync(self):
+        entries = [audit.build_entry(self.admin.pk, obj, DELETION, old_values={"name": obj.name}) for obj in self.commodities]
+        with self.assertNumQueries(2):
+            audit.bulk_insert(entries)
+        self.assertEqual(LogEntry.objects.count(), 30)
+        log = DetailedLog.objects.get(object_id=str(self.commodities[0].pk))
+        self.assertEqual(log.old_values, {"name": "commodity 0"})
+        self.assertEqual(log.pk, entries[0].pk)
+
+    def test_buffered_entries_wait_for_commit(self):
+        with audit.buffered_audit():
+            with self.captureOnCommitCallbacks(execute=True):
+                audit.record(self.admin.pk, self.commodities[0], DELETION)
+                self.assertFalse(DetailedLog.objects.exists())
+            self.assertFalse(DetailedLog.objects.exists())
+        self.assertEqual(DetailedLog.objects.count(), 1)
+
+    def test_admin_bulk_delete_is_one_batch(self):
+        self.client.force_login(self.admin)
+        url = reverse("admin:financials_commodity_changelist")
+        data = {"action": "delete_selected", "post": "yes", "_selected_action": [obj.pk for obj in self.commodities]}
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Commodity.objects.exists())
+        self.assertEqual(DetailedLog.objects.filter(action_flag=DELETION).count(), 30)
+        inserts = [query for query in queries if query["sql"].startswith('INSERT INTO "commons_detailedlog"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_admin_change_logs_only_changed_fields(self):
+        self.client.force_login(self.admin)
+        commodity = self.commodities[0]
+        url = reverse("admin:financials_commodity_change", args=[commodity.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"name": "renamed", "description": ""})
+        self.assertEqual(response.status_code, 302)
+        log = DetailedLog.objects.get(action_flag=CHANGE)
+        self.assertEqual(log.old_values, {"name": "commodity 0"})
+        self.assertEqual(log.changed_values, {"name": "renamed"})
+
+
+class EstimatedCountAdminTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username="admin")
+        self.client.force_login(self.admin)
+        commodities = Commodity.objects.bulk_create([Commodity(name=f"commodity {i}") for i in range(30)])
+        audit.bulk_insert([audit.build_entry(self.admin.pk, obj, CHANGE if obj.pk % 3 else DELETION) for obj in commodities])
+        self.url = reverse("admin:commons_detailedlog_changelist")
+
+    def _counts(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.context["cl"], [query for query in queries if "COUNT(" in query["sql"]]
+
+    def test_filtered_counts_are_cached(self):
+        cl, counts = self._counts(f"{self.url}?action_flag={DELETION}")
+        self.assertEqual((cl.result_count, cl.full_result_count), (10, 30))
+        self.assertEqual(len(counts), 2)
+        cl, counts = self._counts(f"{self.url}?action_flag={DELETION}")
+        self.assertEqual((cl.result_count, cl.full_result_count), (10, 30))
+        self.assertEqual(counts, [])
+
+    def test_unfiltered_list_counts_once(self):
+        cl, counts = self._counts(self.url)
+        self.assertEqual((cl.result_count, cl.full_result_count), (30, 30))
+        self.assertEqual(len(counts), 1)
+
+    def test_counts_above_threshold_show_many(self):
+        DetailedLogAdmin.many_count_threshold, threshold = 20, DetailedLogAdmin.many_count_threshold
+        try:
+            response = self.client.get(self.url)
+        finally:
+            DetailedLogAdmin.many_count_threshold = threshold
+        self.assertContains(response, "20+")
+        cl = response.context["cl"]
+        self.assertIsInstance(cl.result_count, ManyCount)
+        self.assertEqual(str(cl.result_count), "20+")
+        self.assertEqual(fast_count(DetailedLog.objects.filter(action_flag=DELETION), many_threshold=20), 10)
+
+
+class DetailedLogArchiveTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin")
+        self.commodity = Commodity.objects.create(name="commodity")
+
+    def test_archive_moves_old_entries(self):
+        entries = [audit.build_entry(self.admin.pk, self.commodity, CHANGE, changed_values={"name": i}) for i in range(5)]
+        for entry in entries[:3]:
+            entry.action_time = timezone.now() - timedelta(days=400)
+        audit.bulk_insert(entries)
+
+        with tempfile.TemporaryDirectory() as export_dir:
+            call_command(
+                "archive_detailed_logs", "--days", "180", "--batch-size", "2", "--export-dir", export_dir, stdout=StringIO()
+            )
+            files = list(Path(export_dir).glob("detailed_log_*.jsonl.gz"))
+            with gzip.open(files[0], "rt", encoding="utf-8") as file:
+                self.assertEqual(len(file.readlines()), 3)
+
+        self.assertEqual(DetailedLog.objects.count(), 2)
+        self.assertEqual(LogEntry.objects.count(), 2)
+        archived = DetailedLogArchive.objects.order_by("original_id")
+        self.assertEqual([row.changed_values for row in archived], [{"name": 0}, {"name": 1}, {"name": 2}])
+        self.assertEqual(archived[0].period, jalali_period(entries[0].action_time))
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("admin:commons_detailedlogarchive_changelist"), {"q": "commodity"})
+        self.assertContains(response, "3 Archived Log Entries")
+        response = self.client.get(reverse("admin:commons_detailedlog_changelist"))
+        self.assertContains(response, reverse("admin:commons_detailedlogarchive_changelist"))
+
+
+class GetOrUpdateUsersTest(TestCase):
+    def setUp(self):
+        self.by_phone = User.objects.create(username="+989120000001", first_name="old", phone_number="+989120000001")
+        self.namesake = User.objects.create(username="namesake", first_name="سارا", last_name="کریمی", city="Tehran")
+
+    def test_batch_matches_fills_and_creates(self):
+        records = [
+            {"first_name": "علی", "last_name": "رضایی", "phone_number": "09120000001", "email": "ali@example.com"},
+            {"first_name": "سارا", "last_name": "كريمي", "phone_number": "09120000002", "city": "Shiraz"},
+            {"first_name": "نیما", "last_name": "", "phone_number": "09120000003", "profession": "dev"},
+            {"first_name": "نیما", "last_name": "", "phone_number": "09120000003", "email": "nima@example.com"},
+            {"first_name": "بی", "last_name": "تلفن"},
+        ]
+        with self.assertNumQueries(7):
+            users = get_or_update_users(records)
+
+        self.assertEqual([user.pk for user in users[:2]], [self.by_phone.pk, self.namesake.pk])
+        self.assertIs(users[2], users[3])
+        self.by_phone.refresh_from_db()
+        self.assertEqual((self.by_phone.first_name, self.by_phone.email), ("علی", "ali@example.com"))
+        self.namesake.refresh_from_db()
+        self.assertEqual((str(self.namesake.phone_number), self.namesake.city), ("+989120000002", "Tehran"))
+        nima = User.objects.get(username="+989120000003")
+        self.assertEqual((nima.profession, nima.email), ("dev", "nima@example.com"))
+        self.assertTrue(nima.crm_user)
+        self.assertTrue(User.objects.get(pk=users[4].pk).username.startswith("from_register_"))
+
+    def test_single_user_wrapper(self):
+        user = get_or_update_user("علی", "رضایی", phone_number="+989120000001", age=30)
+        self.assertEqual(user.pk, self.by_phone.pk)
+        self.assertEqual(User.objects.get(pk=user.pk).age, 30)
+        with self.assertNumQueries(1):
+            get_or_update_user("علی", "رضایی", phone_number="+989120000001")
+
+
+class NormalizationTest(SimpleTestCase):
+    values = [
+        "09121234567",
+        "۰۹۱۲۱۲۳۴۵۶۷",
+        "٠٩١٢١٢٣٤٥٦٧",
+        " 0912-123 4567 ",
+        "9121234567",
+        "+989121234567",
+        "00989121234567",
+        "+1 415 555 1234",
+        "12345678",
+        "123",
+        "",
+        "abc",
+        None,
+        float("nan"),
+        0,
+        9121234567.0,
+    ]
+
+    def test_batch_matches_scalar(self):
+        series = pd.Series(self.values, dtype=object)
+        self.assertEqual(list(normalize_phones(series)), [normalize_phone(value) for value in self.values])
+        self.assertEqual(list(normalize_national_ids(series)), [normalize_national_id(value) for value in self.values])
+        self.assertEqual(normalize_phones(self.values), [normalize_phone(value) for value in self.values])
+        self.assertEqual(normalize_phone("۰۹۱۲۱۲۳۴۵۶۷"), "+989121234567")
+        self.assertEqual(normalize_national_id("12345678"), "0012345678")
+
+    def test_names(self):
+        names = ["علي كريمي", "إيمان", None, 5]
+        self.assertEqual(list(normalize_names(pd.Series(names, dtype=object))), ["علی کریمی", "ایمان", None, 5])
+        self.assertEqual(normalize_names(names), [arabic_to_persian_characters(name) for name in names])
@@ -3,87 +3,19 @@ import re
 from django.utils import timezone
 from jdatetime import datetime as jdatetime
 
-
-def convert_to_english_digit(text: str) -> str:
-    if not text:
-        return None
-    persian_arabic_to_english = {
-        "۰": "0",
-        "۱": "1",
-        "۲": "2",
-        "۳": "3",
-        "۴": "4",
-        "۵": "5",
-        "۶": "6",
-        "۷": "7",
-        "۸": "8",
-        "۹": "9",
-        "٠": "0",
-        "١": "1",
-        "٢": "2",
-        "٣": "3",
-        "٤": "4",
-        "٥": "5",
-        "٦": "6",
-        "٧": "7",
-        "٨": "8",
-        "٩": "9",
-    }
-
-    for persian_digit, english_digit in persian_arabic_to_english.items():
-        text = text.replace(persian_digit, english_digit)
-
-    return "".join(re.findall(r"\d", text))
-
-
-def arabic_to_persian_characters(text: str) -> str:
-    if text is None or not isinstance(text, str):
-        return text
-    arabic_to_persian = {
-        "ك": "ک",
-        "ي": "ی",
-        "ؤ": "و",
-        "إ": "ا",
-    }
-    for arabic_char, persian_char in arabic_to_persian.items():
-        text = text.replace(arabic_char, persian_char)
-    return text
-
-
-def normalize_phone(phone: str) -> str | None:
-    if not phone:
-        return None
-
-    phone = convert_to_english_digit(str(phone).strip())
-
-    if len(phone) == 11 and phone.startswith("09"):
-        return "+98" + phone[1:]
-    elif len(phone) == 10 and phone.startswith("9"):
-        return "+98" + phone
-    elif len(phone) == 13 and phone.startswith("+98"):
-        return phone
-    elif len(phone) == 14 and phone.startswith("0098"):
-        return "+" + phone[2:]
-    elif len(phone) == 12 and phone.startswith("98"):
-        return "+" + phone
-    elif len(phone) > 15 or len(phone) < 10:
-        return None
-
-    return phone
+from commons.normalization import (  # noqa: F401
+    arabic_to_persian_characters,
+    convert_to_english_digit,
+    normalize_national_id,
+    normalize_phone,
+)
 
 
-def normalize_national_id(national_id: str) -> str | None:
-    if not national_id:
-        return None
-
-    cleaned_id = convert_to_english_digit(str(national_id).strip())
-
-    if len(cleaned_id) == 8:
-        return "00" + cleaned_id
-    elif len(cleaned_id) == 10:
-        return cleaned_id
-
-    return None
+def split_phone_numbers(text: str) -> list[str]:
+    """Normalized phones from a free-text list such as ``User.more_phone_numbers``; invalid entries are dropped."""
+    if not text:
+        return []
+    return [phone for phone in map(normalize_phone, re.split(r"[\s,;،]+", text)) if phone]
 
 
 def get_status_from_text(status: str) -> tuple[int, int]:
@@ -107,77 +39,24 @@ def get_status_from_text(status: str) -> tuple[int, int]:
 
 
 def merge_user_data(source_user, target_user) -> None:
-    from courses.models import Registration
-
-    for reg in Registration.objects.filter(user=source_user):
-        if not Registration.objects.filter(user=target_user, course=reg.course).exists():
-            reg.user = target_user
-            reg.save()
-    merge_fields = [
-        "telegram_id",
-        "profession",
-        "email",
-        "national_id",
-        "english_first_name",
-        "english_last_name",
-        "referer_name",
-    ]
-
-    for field in merge_fields:
-        source_value = getattr(source_user, field)
-        target_value = getattr(target_user, field)
-
-        if source_value and not target_value:
-            setattr(target_user, field, source_value)
-
-    if target_user.gender is None and source_user.gender is not None:
-        target_user.gender = source_user.gender
-
-    if target_user.age in [None, 0] and source_user.age not in [None, 0]:
-        target_user.age = source_user.age
-
-    if source_user.more_phone_numbers:
-        target_user.more_phone_numbers = (target_user.more_phone_numbers + "\n" + source_user.more_phone_numbers).strip()
-
-    source_user.description = (
-        f"{source_user.first_name} {source_user.last_name} has been merged into {target_user.id}\n{source_user.username}"
-    )
-    source_user.first_name = "merged_user"
-    source_user.last_name = f"{source_user.id}"
-    source_user.username = f"merged_user_{source_user.id}"
-    source_user.is_active = False
-    source_user.main_user = target_user
-
-    source_user.save()
-    target_user.save()
-
-
-def find_and_merge_duplicate_users() -> None:
-    from users.models import User
+    from users.merge import merge_users
 
-    users = User.objects.values_list("first_name", "last_name", "id", "phone_number")
-    user_dic = {}
+    merge_users([(source_user.pk, target_user.pk)])
+    source_user.refresh_from_db()
+    target_user.refresh_from_db()
 
-    for first_name, last_name, user_id, phone_number in users:
-        if last_name:
-            name_key = f"{first_name}{last_name}".replace(" ", "").lower()
 
-            if name_key not in user_dic:
-                user_dic[name_key] = []
-
-            user_dic[name_key].append({"id": user_id, "phone": str(phone_number) if phone_number else None})
-
-    for _, user_list in user_dic.items():
-        if len(user_list) > 1:
-            users_with_phone = [u for u in user_list if u["phone"]]
-            users_without_phone = [u for u in user_list if not u["phone"]]
-
-            if users_with_phone and users_without_phone:
-                target_user = User.objects.get(id=users_with_phone[0]["id"])
+def find_and_merge_duplicate_users() -> None:
+    """Merges users without a phone into a same-named user that has one."""
+    from users.dedup import find_duplicate_users, merge_user_pairs
 
-                for user_data in users_without_phone:
-                    source_user = User.objects.get(id=user_data["id"])
-                    merge_user_data(source_user, target_user)
+    pairs = []
+    for cluster, _ in find_duplicate_users(keys=("name",), max_block_size=None):
+        users_with_phone = [user for user in cluster if user["phone_number"]]
+        if users_with_phone:
+            pairs += [(user["id"], users_with_phone[0]["id"]) for user in cluster if not user["phone_number"]]
+    for start in range(0, len(pairs), 1000):
+        merge_user_pairs(pairs[start : start + 1000])
 
 
 def get_jdatetime_now_with_timezone():
@@ -196,6 +75,26 @@ def create_needed_permission_groups():
             Group.objects.create(name=permission.codename, permissions=[permission])
 
 
+USER_RECORD_FIELDS = [
+    "first_name",
+    "last_name",
+    "phone_number",
+    "profession",
+    "education",
+    "email",
+    "telegram_id",
+    "age",
+    "more_phone_numbers",
+    "birth_date",
+    "national_id",
+    "english_first_name",
+    "english_last_name",
+    "referrer_name",
+    "country",
+    "city",
+]
+
+
 def get_or_update_user(
     first_name,
     last_name,
@@ -214,67 +113,129 @@ def get_or_update_user(
     country=None,
     city=None,
 ):
-    from users.models import User
+    record = {field: value for field, value in locals().items() if field in USER_RECORD_FIELDS}
+    return get_or_update_users([record])[0]
 
-    phone_number = normalize_phone(phone_number)
+
+def _record_username(record, phone_number):
     if phone_number:
-        username = phone_number
-    else:
-        import hashlib
-
-        name_hash = hashlib.sha256(f"{first_name}{last_name}".encode()).hexdigest()[:10]
-        username = f"from_register_{name_hash}"
-    user = None
-    existing_users = None
-    try:
-        user = User.objects.get(username=username)
-    except User.DoesNotExist:
-        existing_users = User.objects.filter(first_name=first_name, last_name=last_name).first()
-
-    if user or (existing_users and not existing_users.phone_number):
+        return phone_number
+    import hashlib
+
+    name_hash = hashlib.sha256(f"{record['first_name']}{record['last_name']}".encode()).hexdigest()[:10]
+    return f"from_register_{name_hash}"
+
+
+def _fill_user(user, record, phone_number, first_name, last_name):
+    """Applies ``record`` to an existing user: names and phone are replaced, other fields only fill blanks."""
+    get = record.get
+    values = {
+        "first_name": first_name,
+        "last_name": last_name,
+        "phone_number": phone_number,
+        "profession": user.profession or get("profession") or "",
+        "education": make_none_empty_str(user.education or get("education")),
+        "email": user.email or get("email") or "",
+        "telegram_id": user.telegram_id or get("telegram_id") or "",
+        "age": make_none_empty_str(user.age or get("age")),
+        "more_phone_numbers": user.more_phone_numbers or get("more_phone_numbers") or "",
+        "birth_date": user.birth_date or get("birth_date"),
+        "national_id": user.national_id or get("national_id") or "",
+        "english_first_name": user.english_first_name or get("english_first_name") or "",
+        "english_last_name": user.english_last_name or get("english_last_name") or "",
+        "referer_name": get("referrer_name") or "",
+        "country": user.country or get("country") or "",
+        "city": user.city or get("city") or "",
+        "description": user.description or "",
+    }
+    changed = set()
+    for field, value in values.items():
+        if getattr(user, field) != value:
+            setattr(user, field, value)
+            changed.add(field)
+    return changed
+
+
+def get_or_update_users(records):
+    """
+    Resolves many people at once with the same rules as ``get_or_update_user``: match on the phone
+    (or name hash) username, otherwise on a phone-less user with the same name, and fill only the
+    empty fields of matches. Existing users are fetched with two queries, new users are inserted
+    with one bulk_create and changed users are saved with one bulk_update of the changed fields.
+    Returns the users in the order of ``records``.
+    """
+    from django.db import transaction
+    from django.db.models import Q
+
+    from users.models import CrmUser, User
+
+    prepared = []
+    for record in records:
+        phone_number = normalize_phone(record.get("phone_number"))
+        first_name = arabic_to_persian_characters(record.get("first_name")) or ""
+        last_name = arabic_to_persian_characters(record.get("last_name")) or ""
+        prepared.append((record, phone_number, _record_username(record, phone_number), first_name, last_name))
+
+    by_username = User.objects.in_bulk({username for _, _, username, _, _ in prepared}, field_name="username")
+    names = {(first_name, last_name) for _, _, username, first_name, last_name in prepared if username not in by_username}
+    by_name = {}
+    if names:
+        name_filter = Q()
+        for first_name, last_name in names:
+            name_filter |= Q(first_name=first_name, last_name=last_name)
+        for user in User.objects.filter(name_filter).order_by("-_created_at"):
+            by_name.setdefault((user.first_name, user.last_name), user)
+
+    users, new_users, changed_users, changed_fields = [], [], {}, set()
+    for record, phone_number, username, first_name, last_name in prepared:
+        user = by_username.get(username)
         if user is None:
-            user = existing_users
-        user.first_name = first_name
-        user.last_name = last_name
-        user.phone_number = phone_number
-        user.profession = user.profession or profession or ""
-        user.education = make_none_empty_str(user.education or education)
-        user.email = user.email or email
-        user.telegram_id = user.telegram_id or telegram_id
-        user.age = make_none_empty_str(user.age or age)
-        user.more_phone_numbers = user.more_phone_numbers or more_phone_numbers or ""
-        user.birth_date = user.birth_date or birth_date
-        user.national_id = user.national_id or national_id or ""
-        user.english_first_name = user.english_first_name or english_first_name or ""
-        user.english_last_name = user.english_last_name or english_last_name or ""
-        user.referer_name = referrer_name or ""
-        user.country = user.country or country or ""
-        user.city = user.city or city or ""
-        user.description = user.description or ""
-        user.save()
-    else:
-        user = User.objects.create(
-            username=username,
-            first_name=first_name,
-            last_name=last_name,
-            phone_number=phone_number,
-            profession=profession,
-            education=make_none_empty_str(education),
-            telegram_id=telegram_id or "",
-            email=email or "",
-            national_id=national_id or "",
-            english_first_name=english_first_name or "",
-            english_last_name=english_last_name or "",
-            referer_name=referrer_name or "",
-            country=country or "",
-            city=city or "",
-            age=make_none_empty_str(age),
-            more_phone_numbers=more_phone_numbers or "",
-            birth_date=birth_date,
-            description="",
-        )
-
-    return user
+            existing = by_name.get((first_name, last_name))
+            if existing is not None and not existing.phone_number:
+                user = existing
+        if user is not None:
+            changed = _fill_user(user, record, phone_number, first_name, last_name)
+            if changed and user.pk is not None:
+                changed_users[user.pk] = user
+                changed_fields |= changed
+        else:
+            user = User(
+                username=username,
+                first_name=first_name,
+                last_name=last_name,
+                phone_number=phone_number,
+                profession=record.get("profession") or "",
+                education=make_none_empty_str(record.get("education")),
+                telegram_id=record.get("telegram_id") or "",
+                email=record.get("email") or "",
+                national_id=record.get("national_id") or "",
+                english_first_name=record.get("english_first_name") or "",
+                english_last_name=record.get("english_last_name") or "",
+                referer_name=record.get("referrer_name") or "",
+                country=record.get("country") or "",
+                city=record.get("city") or "",
+                age=make_none_empty_str(record.get("age")),
+                more_phone_numbers=record.get("more_phone_numbers") or "",
+                birth_date=record.get("birth_date"),
+                description="",
+            )
+            new_users.append(user)
+            by_username[username] = user
+            by_name[(first_name, last_name)] = user
+        users.append(user)
+
+    if not (new_users or changed_users):
+        return users
+    with transaction.atomic():
+        if new_users:
+            User.objects.bulk_create(new_users, batch_size=500)
+            CrmUser.objects.bulk_create([CrmUser(user=user) for user in new_users], batch_size=500)
+        if changed_users:
+            now = get_jdatetime_now_with_timezone()
+            for user in changed_users.values():
+                user._updated_at = now
+            User.objects.bulk_update(changed_users.values(), [*sorted(changed_fields), "_updated_at"], batch_size=500)
+    return users
 
 
 def make_none_empty_str(text):
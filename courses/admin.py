@@ -4,33 +4,39 @@ from dalf.admin import DALFModelAdmin, DALFRelatedFieldAjax
 from django import forms
 from django.contrib import admin, messages
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import path, reverse
-from django.utils import timezone
 from django.utils.html import format_html
 from django_jalali.admin.filters import JDateFieldListFilter
-from jdatetime import datetime as jdatetime
 
-from commons.admin import DetailedLogAdminMixin, DropdownFilter
+from commons.admin import DetailedLogAdminMixin, DropdownFilter, EstimatedCountAdminMixin
+from commons.exports import export_response
 from commons.forms import FinancialNumberFormMixin
+from commons.permissions import get_permission_resolver
 from commons.utils import (
-    convert_to_english_digit,
     get_jdatetime_now_with_timezone,
     get_or_update_user,
-    make_none_empty_str,
     normalize_phone,
 )
 from financials.admin import CourseTransactionInline
 from financials.models import INCOME_CATEGORY_REGISTRATION, CourseTransaction, FinancialAccount
 from users.models import User
 
+from .exports import REGISTRATION_EXPORT
+from .importers import parse_registration_excel, parse_sazito_csv
 from .models import (
+    IMPORT_JOB_SOURCE_EXCEL,
+    IMPORT_JOB_SOURCE_SAZITO,
+    IMPORT_JOB_STATUS_DONE,
+    IMPORT_JOB_STATUS_FAILED,
     Attendance,
     Course,
+    CourseAccess,
     CourseSession,
     CourseTeam,
     CourseType,
+    ImportJob,
     Registration,
 )
 from .permissions import CoursePermissionMixin, requires_course_managing_permission
@@ -54,14 +60,22 @@ class CourseTeamInline(admin.TabularInline):
     autocomplete_fields = ["user"]
     readonly_fields = []
 
+    def _is_managing_superuser(self, request, obj):
+        # superusers only edit the team of courses they manage themselves
+        return (
+            request.user.is_superuser
+            and isinstance(obj, Course)
+            and obj.pk in get_permission_resolver(request).managed_course_ids
+        )
+
     def get_readonly_fields(self, request, obj=None):
         readonly_fields = super().get_readonly_fields(request, obj)
-        if request.user.is_superuser and obj and isinstance(obj, Course) and obj.managing_users.filter(pk=request.user.pk).exists():
+        if self._is_managing_superuser(request, obj):
             return readonly_fields
         return self.fields
 
     def has_delete_permission(self, request, obj=None):
-        if request.user.is_superuser and obj and isinstance(obj, Course) and obj.managing_users.filter(pk=request.user.pk).exists():
+        if self._is_managing_superuser(request, obj):
             return super().has_delete_permission(request, obj)
         return False
 
@@ -172,7 +186,10 @@ class CourseAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelAdmin):
                 extra_context["show_export_registrations"] = True
                 export_url = reverse("admin:courses_course_export_registrations", args=[object_id])
                 extra_context["export_button"] = format_html(
-                    '<a class="button" href="{}" style="display:inline-block;">Export Registrations</a>', export_url
+                    '<a class="button" href="{}" style="display:inline-block;">Export Registrations</a> '
+                    '<a class="button" href="{}?format=csv" style="display:inline-block;">CSV</a>',
+                    export_url,
+                    export_url,
                 )
                 register_url = reverse("admin:courses_course_fast_register", args=[object_id])
                 extra_context["fast_register_button"] = format_html(
@@ -374,7 +391,7 @@ class RegistrationAdminForm(FinancialNumberFormMixin, forms.ModelForm):
 
 
 @admin.register(Registration)
-class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelAdmin):
+class RegistrationAdmin(EstimatedCountAdminMixin, DetailedLogAdminMixin, CoursePermissionMixin, DALFModelAdmin):
     form = RegistrationAdminForm
     list_display = [
         "user",
@@ -500,10 +517,10 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
 
     def get_fieldsets(self, request, obj=None):
         fieldsets = super().get_fieldsets(request, obj)
-        user = request.user
-        if user.is_superuser:
+        resolver = get_permission_resolver(request)
+        if resolver.is_superuser:
             return fieldsets
-        if obj and obj.course.managing_users.filter(pk=user.pk).exists():
+        if obj and resolver.manages_course(obj.course_id):
             return fieldsets
         filtered_fieldsets = []
         for name, options in fieldsets:
@@ -537,15 +554,13 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
         user = request.user
         if user.is_superuser:
             return qs
-        return qs.filter(
-            Q(course__managing_users=user) | Q(course__supporting_users=user) | Q(supporting_user=user) | Q(user=user)
-        ).distinct()
+        return qs.filter(Q(course_id__in=CourseAccess.course_ids_for(user)) | Q(supporting_user=user) | Q(user=user))
 
     def _has_registration_permission(self, request, obj=None):
         user = request.user
         if user.is_superuser or obj is None:
             return True
-        if obj.course.managing_users.filter(pk=user.pk).exists() or obj.supporting_user == user or obj.user == user:
+        if get_permission_resolver(request).manages_course(obj.course_id) or user.pk in (obj.supporting_user_id, obj.user_id):
             return True
         return False
 
@@ -565,140 +580,9 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
 
     @staticmethod
     def add_and_register_users(users_data, course, update_user=False, make_transaction=False):
-        from tqdm import tqdm
-
-        from commons.utils import get_status_from_text, normalize_national_id
-        from courses.models import Registration
-        from financials.models import INCOME_CATEGORY_REGISTRATION, CourseTransaction
-        from users.models import User
-
-        users_dic = {
-            user[1]: user for user in User.objects.all().values_list("id", "username", "first_name", "last_name", "phone_number")
-        }
-        users_dup_check = {f"{u[2]}{u[3]}".replace(" ", ""): u for u in users_dic.values() if u[3] not in [None, ""]}
-
-        registration_dic = {r[0]: r[1] for r in Registration.objects.filter(course=course).values_list("user_id", "id")}
-        course_transaction_dic = dict.fromkeys(
-            CourseTransaction.objects.filter(course=course).values_list("registration_id", flat=True), True
-        )
-        bad_name = 0
-        made_users = 0
-        made_registration = 0
-        logs = []
-
-        for data in tqdm(users_data):
-            phone = data["phone"]
-            username = data["username"]
-            first_name = data.get("first_name", "")
-            last_name = data.get("last_name", "")
-            telegram_id = data.get("telegram_id", "") or ""
-            email = data.get("email", "") or ""
-            education = User.get_education_from_text(data.get("education", None))
-            profession = data.get("profession", "") or ""
-            age = data.get("age", None)
-            gender = User.get_gender_from_text(data.get("gender", ""))
-            national_id = normalize_national_id(data.get("national_id", "")) or ""
-            english_first_name = data.get("english_first_name", "") or ""
-            english_last_name = data.get("english_last_name", "") or ""
-            referer_name = data.get("referer_name", "") or ""
-            tuition = data.get("tuition", 0) or 0
-            status, payment_status = get_status_from_text(data.get("status", None))
-            registration_date = data.get("registration_date", None)
-            discount = data.get("discount", 0) or 0
-            initial_price = data.get("initial_price", 0) or 0
-            paid_amount = data.get("paid_amount", 0) or 0
-
-            if username in users_dic:
-                user = users_dic[username]
-                if user[2] != first_name or user[3] != last_name:
-                    bad_name += 1
-                    logs.append(
-                        [
-                            "bad name",
-                            str(phone),
-                            str(user[2]),
-                            str(user[3]),
-                            str(first_name),
-                            str(last_name),
-                        ]
-                    )
-                    if update_user:
-                        User.objects.filter(username=username).update(first_name=first_name, last_name=last_name)
-
-            elif users_dup_check.get(f"{first_name}{last_name}".replace(" ", ""), None) is not None:
-                user = users_dup_check[f"{first_name}{last_name}".replace(" ", "")]
-                u = User.objects.get(id=user[0])
-                if user[4] is None:
-                    u.phone_number = phone
-                    u.username = username
-                    users_dic[username] = [u.id, username, first_name, last_name, phone]
-                    user = users_dic[username]
-                u.telegram_id = make_none_empty_str(u.telegram_id) or telegram_id
-                u.email = make_none_empty_str(u.email) or email
-                u.profession = make_none_empty_str(u.profession) or profession
-                u.education = make_none_empty_str(u.education) or education
-                u.age = make_none_empty_str(u.age) or age
-                u.gender = u.gender if u.gender is not None else gender
-                u.national_id = make_none_empty_str(u.national_id) or national_id
-                u.english_first_name = make_none_empty_str(u.english_first_name) or english_first_name
-                u.english_last_name = make_none_empty_str(u.english_last_name) or english_last_name
-                u.referer_name = make_none_empty_str(u.referer_name) or referer_name
-                u.save()
-            else:
-                user = User.objects.create(
-                    username=username,
-                    phone_number=phone,
-                    first_name=first_name,
-                    last_name=last_name,
-                    telegram_id=telegram_id,
-                    email=email,
-                    profession=profession,
-                    education=education,
-                    age=age,
-                    gender=gender,
-                    national_id=national_id,
-                    english_first_name=english_first_name,
-                    english_last_name=english_last_name,
-                    referer_name=referer_name,
-                )
-                made_users += 1
-                user = [user.id, user.username, user.first_name, user.last_name, user.phone_number]
-                users_dup_check[f"{first_name}{last_name}".replace(" ", "")] = user
-                users_dic[username] = user
+        from .importers import RegistrationImporter
 
-            if registration_dic.get(user[0], None) is None:
-                try:
-                    reg = Registration.objects.create(
-                        user_id=user[0],
-                        course=course,
-                        status=status,
-                        payment_status=payment_status,
-                        tuition=tuition,
-                        initial_price=initial_price,
-                        discount=discount,
-                        registration_date=registration_date,
-                    )
-                    registration_dic[user[0]] = reg.id
-                    made_registration += 1
-                except Exception as e:
-                    logs.append(["Error", str(phone), str(user[2]), str(user[3]), first_name, str(e)])
-            if make_transaction and course_transaction_dic.get(registration_dic[user[0]], None) is None and paid_amount > 0:
-                course_transaction = CourseTransaction.objects.create(
-                    registration_id=registration_dic[user[0]],
-                    user_account_id=user[0],
-                    course=course,
-                    amount=paid_amount,
-                    transaction_type=1,
-                    transaction_category=INCOME_CATEGORY_REGISTRATION,
-                    financial_account=data["financial_account"],
-                    transaction_date=registration_date,
-                    entry_user=data["entry_user"],
-                    tracking_code=data.get("tracking_code", ""),
-                )
-                course_transaction.transaction = course_transaction.create_transaction()
-                course_transaction.save()
-                course_transaction_dic[registration_dic[user[0]]] = True
-        return logs, made_users, made_registration, bad_name
+        return RegistrationImporter(course, update_user=update_user, make_transaction=make_transaction).run(users_data)
 
     def upload_excel(self, request):
         if request.method == "POST":
@@ -728,93 +612,15 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
                 update_name = form.cleaned_data.get("update_name")
                 currency_to_toman_multiplier = form.cleaned_data.get("currency_to_toman_multiplier", 1000000)
                 try:
-                    import hashlib
-
-                    from tqdm import tqdm
-
-                    from commons.utils import normalize_phone
-
-                    df = df.where(pd.notnull(df), None)
-                    df = df.dropna(how="all", subset=["نام", "نام خانوادگی", "fix phone"])
-                    good_phone = []
-                    bad_phone = []
-                    for phone in df["fix phone"]:
-                        if len(str(phone).strip()) == 11 and str(phone).startswith("09"):
-                            good_phone.append("+989" + phone[2:])
-                        else:
-                            bad_phone.append(phone)
-                    good_phone = list(set(good_phone))
-                    bad_phone = list(set(bad_phone))
-
-                    no_phone = 0
-                    logs = []
-                    users_data = []
-                    for index, row in tqdm(df.iterrows(), total=df.shape[0]):
-                        phone = normalize_phone(row["fix phone"])
-                        first_name = row.get("نام", "")
-                        if first_name:
-                            first_name = first_name.strip()
-                        last_name = row.get("نام خانوادگی", "")
-                        if last_name:
-                            last_name = last_name.strip()
-                        telegram_id = row.get("تلگرام", None) or row.get("آی‌دی تلگرام", None)
-
-                        if phone == "":
-                            phone = None
-                        if phone is None and first_name is None and last_name is None:
-                            continue
-                        last_name = last_name or ""
-                        if phone is None:
-                            name_hash = hashlib.sha256(f"{first_name}{last_name}".encode()).hexdigest()[:10]
-                            username = f"from_upload_{name_hash}"
-                            no_phone += 1
-                            logs.append(["No Phone", str(index), str(first_name), str(last_name), str(phone)])
-                        else:
-                            username = phone
-
-                        users_data.append(
-                            {
-                                "username": username,
-                                "phone": phone,
-                                "first_name": first_name,
-                                "last_name": last_name,
-                                "telegram_id": telegram_id or "",
-                                "email": row.get("ایمیل", "") or "",
-                                "education": row.get("تحصیلات", ""),
-                                "profession": row.get("حرفه", "") or "",
-                                "national_id": row.get("کد ملی", "") or "",
-                                "age": row.get("سن", None),
-                                "gender": row.get("جنسیت", None),
-                                "english_first_name": row.get("Name", "") or "",
-                                "english_last_name": row.get("Surname", "") or "",
-                                "referer_name": row.get("معرف", None) or "",
-                                "status": row.get("وضعیت", None),
-                                "tuition": float(row.get("مبلغ نهایی", 0) or 0) * currency_to_toman_multiplier,
-                                "registration_date": get_jdatetime_now_with_timezone(),
-                            }
-                        )
-                    new_logs, made_users, made_registration, bad_name = self.add_and_register_users(
-                        users_data, selected_course, update_name
-                    )
-                    logs = logs + new_logs
-                    self.message_user(
-                        request,
-                        "Registrations imported"
-                        + " ".join(
-                            [
-                                "Done",
-                                str(bad_name),
-                                "bad name",
-                                str(no_phone),
-                                "no_phone",
-                                str(made_registration),
-                                "made registrations",
-                                str(made_users),
-                                "made users",
-                            ]
-                        )
-                        + "\n".join([" ".join(log) for log in logs]),
-                        messages.SUCCESS,
+                    users_data, logs, no_phone = parse_registration_excel(df, currency_to_toman_multiplier)
+                    job = ImportJob.enqueue(
+                        selected_course,
+                        IMPORT_JOB_SOURCE_EXCEL,
+                        users_data,
+                        logs,
+                        no_phone,
+                        created_by=request.user,
+                        update_user=update_name,
                     )
                 except Exception as e:
                     import logging
@@ -822,7 +628,9 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
                     logger = logging.getLogger(__name__)
                     logger.exception("Error importing registrations from Excel")
                     self.message_user(request, f"Error importing registrations: {e}", messages.ERROR)
-                return redirect("..")
+                    return redirect("..")
+                self.message_user(request, f"Import job #{job.pk} queued with {job.total_rows} rows.", messages.SUCCESS)
+                return redirect("admin:courses_importjob_change", job.pk)
         else:
             form = RegistrationExcelUploadForm()
         context = {
@@ -835,49 +643,12 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
     def export_registrations(self, request, course_id):
         try:
             course = Course.objects.get(id=course_id)
-            registrations = (
-                Registration.objects.filter(course=course)
-                .select_related("user", "supporting_user")
-                .order_by("-registration_date")
+            response = export_response(
+                REGISTRATION_EXPORT,
+                Registration.objects.filter(course=course),
+                f"{course.course_name}_registrations",
+                request.GET.get("format", "xlsx"),
             )
-            data = []
-            for reg in registrations:
-                data.append(
-                    {
-                        "first name": reg.user.first_name,
-                        "last name": reg.user.last_name,
-                        "phone": getattr(reg.user, "phone_number", ""),
-                        "email": reg.user.email,
-                        "status": reg.status_display,
-                        "registration date": reg.registration_date.strftime("%Y/%m/%d %H:%M") if reg.registration_date else "",
-                        "قیمت اولیه": reg.initial_price,
-                        "تخفیف": reg.discount,
-                        "tax": reg.vat,
-                        "شهریه": reg.tuition,
-                        "وضعیت پرداخت": reg.get_payment_status_display,
-                        "نوع پرداخت": reg.get_payment_type_display,
-                        "تاریخ پرداخت بعدی": reg.next_payment_date.strftime("%Y/%m/%d") if reg.next_payment_date else "",
-                        "پشتیبان": f"{reg.supporting_user.first_name} {reg.supporting_user.last_name}"
-                        if reg.supporting_user
-                        else "",
-                        "توضیحات": reg.description or "",
-                        "توضیحات پرداخت": reg.payment_description or "",
-                    }
-                )
-            df = pd.DataFrame(data)
-            response = HttpResponse(content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            response["Content-Disposition"] = f'attachment; filename="{course.course_name}_registrations.xlsx"'
-
-            from io import BytesIO
-
-            excel_buffer = BytesIO()
-
-            with pd.ExcelWriter(excel_buffer, engine="openpyxl") as writer:
-                df.to_excel(writer, index=False, sheet_name="registration")
-
-            excel_buffer.seek(0)
-            response.write(excel_buffer.getvalue())
-
             messages.success(request, f"فایل اکسل ثبت نام های دوره {course.course_name} با موفقیت ایجاد شد.")
             return response
 
@@ -915,93 +686,16 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
                 update_name = form.cleaned_data.get("update_name")
                 make_transaction = form.cleaned_data.get("make_transaction", True)
                 try:
-                    import hashlib
-                    from datetime import datetime
-
-                    from commons.utils import normalize_phone
-
-                    bad_name = 0
-                    logs = []
-                    data = []
-                    no_phone = 0
-                    df = df.where(pd.notnull(df), None)
-                    df = df.dropna(how="all", subset=["first name", "last name", "Mobile Number"])
-                    for index, row in df.iterrows():
-                        phone = normalize_phone(row["Mobile Number"])
-                        first_name = (row["first name"] or "").strip()
-                        last_name = (row["last name"] or "").strip()
-                        if phone is None or str(phone).strip() == "":
-                            continue
-                        details = {}
-                        if row["Product Details"] is not None:
-                            details = {
-                                item.split(":", 1)[0].strip(): item.split(":", 1)[1].strip()
-                                for item in row["Product Details"].split(",")
-                                if ":" in item
-                            }
-
-                        if phone == "":
-                            phone = None
-                        if phone is None and first_name is None and last_name is None:
-                            continue
-                        last_name = last_name or ""
-                        if phone is None:
-                            name_hash = hashlib.sha256(f"{first_name}{last_name}".encode()).hexdigest()[:10]
-                            username = f"from_upload_{name_hash}"
-                            no_phone += 1
-                            logs.append(["No Phone", str(first_name), str(last_name), str(phone)])
-                        else:
-                            username = phone
-                        reg_date = datetime.strptime(str(row["Created at (gregorian)"]), "%m/%d/%Y %H:%M")
-                        reg_date = timezone.make_aware(reg_date, timezone=timezone.get_current_timezone())
-                        reg_date = jdatetime.fromgregorian(datetime=reg_date)
-                        data.append(
-                            {
-                                "index": index,
-                                "phone": phone,
-                                "username": username,
-                                "first_name": first_name,
-                                "last_name": last_name,
-                                "email": row["Email"],
-                                "paid_amount": row["Final Total"],
-                                "tuition": int(row["Net Total"]) - int(row["Discount Amount"]),
-                                "initial_price": row["Net Total"],
-                                "discount": row["Discount Amount"],
-                                "education": details.get("تحصیلات", ""),
-                                "profession": details.get("حرفه تخصصی", ""),
-                                "telegram_id": details.get("آی\u200cدی تلگرام جهت عضو شدن در گروه دوره", ""),
-                                "age": convert_to_english_digit(details.get("سن", None)),
-                                "referer_name": details.get("معرف", ""),
-                                "registration_date": reg_date,
-                                "tracking_code": row["Payment Reference Code"],
-                                "financial_account": FinancialAccount.objects.get(name="پی‌پینگ"),
-                                "entry_user": request.user,
-                                "status": "حاضر در دوره - عدم سررسید",
-                            }
-                        )
-
-                    new_logs, made_users, made_registration, bad_name = self.add_and_register_users(
-                        data, selected_course, update_name, make_transaction
-                    )
-                    logs = logs + new_logs
-                    self.message_user(
-                        request,
-                        "Registrations imported"
-                        + " ".join(
-                            [
-                                "Done",
-                                str(bad_name),
-                                "bad name",
-                                str(no_phone),
-                                "no_phone",
-                                str(made_registration),
-                                "made registrations",
-                                str(made_users),
-                                "made users",
-                            ]
-                        )
-                        + "\n".join([" ".join(log) for log in logs]),
-                        messages.SUCCESS,
+                    users_data, logs, no_phone = parse_sazito_csv(df, FinancialAccount.objects.get(name="پی‌پینگ"), request.user)
+                    job = ImportJob.enqueue(
+                        selected_course,
+                        IMPORT_JOB_SOURCE_SAZITO,
+                        users_data,
+                        logs,
+                        no_phone,
+                        created_by=request.user,
+                        update_user=update_name,
+                        make_transaction=make_transaction,
                     )
                 except Exception as e:
                     import logging
@@ -1009,7 +703,9 @@ class RegistrationAdmin(DetailedLogAdminMixin, CoursePermissionMixin, DALFModelA
                     logger = logging.getLogger(__name__)
                     logger.exception("Error importing registrations from Excel")
                     self.message_user(request, f"Error importing registrations: {e}", messages.ERROR)
-                return redirect("..")
+                    return redirect("..")
+                self.message_user(request, f"Import job #{job.pk} queued with {job.total_rows} rows.", messages.SUCCESS)
+                return redirect("admin:courses_importjob_change", job.pk)
         else:
             form = RegistrationSazitoUploadForm()
         context = {
@@ -1054,3 +750,112 @@ class CourseTypeAdmin(DetailedLogAdminMixin, DALFModelAdmin):
     search_fields = ["name", "name_fa", "description"]
     list_filter = ["category"]
     readonly_fields = ["_created_at", "_updated_at"]
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(DALFModelAdmin):
+    list_display = [
+        "id",
+        "course",
+        "source",
+        "status",
+        "phase",
+        "processed_rows",
+        "total_rows",
+        "rows_per_second",
+        "created_by",
+        "_created_at",
+    ]
+    list_filter = ["status", "source", ("course", DALFRelatedFieldAjax)]
+    readonly_fields = [
+        "course",
+        "source",
+        "status",
+        "update_user",
+        "make_transaction",
+        "total_rows",
+        "phase",
+        "processed_rows",
+        "rows_per_second",
+        "made_users",
+        "made_registration",
+        "bad_name",
+        "no_phone",
+        "summary",
+        "error",
+        "created_by",
+        "started_at",
+        "finished_at",
+        "_created_at",
+        "_updated_at",
+    ]
+    fieldsets = (
+        ("Job", {"fields": (("course", "source", "status"), ("update_user", "make_transaction"), "created_by")}),
+        (
+            "Progress",
+            {
+                "fields": (
+                    ("phase", "processed_rows", "total_rows", "rows_per_second"),
+                    ("made_users", "made_registration", "bad_name", "no_phone"),
+                    ("started_at", "finished_at"),
+                )
+            },
+        ),
+        ("Result", {"fields": ("summary", "error")}),
+        ("Timestamps", {"fields": ("_created_at", "_updated_at")}),
+    )
+    change_form_template = "admin/courses/importjob/change_form.html"
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related("course", "created_by").defer("rows")
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(created_by=request.user)
+
+    @admin.display(description="rows/s")
+    def rows_per_second(self, obj):
+        return obj.rows_per_second
+
+    @admin.display(description="Summary")
+    def summary(self, obj):
+        if obj.status != IMPORT_JOB_STATUS_DONE:
+            return "-"
+        return format_html("<pre>{}</pre>", obj.summary)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "<int:job_id>/progress/",
+                self.admin_site.admin_view(self.progress_view),
+                name="courses_importjob_progress",
+            ),
+        ]
+        return custom_urls + urls
+
+    def progress_view(self, request, job_id):
+        job = self.get_queryset(request).filter(pk=job_id).first()
+        if job is None:
+            return JsonResponse({"error": "not found"}, status=404)
+        return JsonResponse(
+            {
+                "status": job.status,
+                "status_display": job.get_status_display(),
+                "phase_display": job.get_phase_display(),
+                "processed_rows": job.processed_rows,
+                "total_rows": job.total_rows,
+                "rows_per_second": job.rows_per_second,
+                "finished": job.status in [IMPORT_JOB_STATUS_DONE, IMPORT_JOB_STATUS_FAILED],
+            }
+        )
+
+    def change_view(self, request, object_id, form_url="", extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["progress_url"] = reverse("admin:courses_importjob_progress", args=[object_id])
+        return super().change_view(request, object_id, form_url, extra_context=extra_context)
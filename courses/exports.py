@@ -0,0 +1,30 @@
+from commons.exports import Column, ExportSpec, name_column, register_export
+
+from .models import PAYMENT_STATUS_CHOICES, PAYMENT_TYPE_CHOICES, STATUS_CHOICES, Registration
+
+REGISTRATION_EXPORT = register_export(
+    ExportSpec(
+        "course_registrations",
+        Registration,
+        [
+            Column("first name", "user__first_name"),
+            Column("last name", "user__last_name"),
+            Column("phone", "user__phone_number", formatter=str),
+            Column("email", "user__email"),
+            Column("status", "status", choices=STATUS_CHOICES),
+            Column("registration date", "registration_date", date_format="%Y/%m/%d %H:%M"),
+            Column("قیمت اولیه", "initial_price"),
+            Column("تخفیف", "discount"),
+            Column("tax", "vat"),
+            Column("شهریه", "tuition"),
+            Column("وضعیت پرداخت", "payment_status", choices=PAYMENT_STATUS_CHOICES),
+            Column("نوع پرداخت", "payment_type", choices=PAYMENT_TYPE_CHOICES),
+            Column("تاریخ پرداخت بعدی", "next_payment_date", date_format="%Y/%m/%d"),
+            name_column("پشتیبان", "supporting_user"),
+            Column("توضیحات", "description"),
+            Column("توضیحات پرداخت", "payment_description"),
+        ],
+        order_by=["-registration_date", "pk"],
+        sheet_name="registration",
+    )
+)
@@ -0,0 +1,474 @@
+import hashlib
+from datetime import datetime
+
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+from jdatetime import datetime as jdatetime
+
+from commons.normalization import normalize_phones
+from commons.utils import (
+    arabic_to_persian_characters,
+    convert_to_english_digit,
+    get_jdatetime_now_with_timezone,
+    get_status_from_text,
+    make_none_empty_str,
+    normalize_national_id,
+)
+from financials.balances import apply_transactions
+from financials.models import INCOME_CATEGORY_REGISTRATION, CourseTransaction, Transaction
+from users.models import CrmUser, User
+
+from .models import Registration
+
+IMPORT_BATCH_SIZE = 500
+
+USER_FILL_FIELDS = [
+    "first_name",
+    "last_name",
+    "phone_number",
+    "username",
+    "telegram_id",
+    "email",
+    "profession",
+    "education",
+    "age",
+    "gender",
+    "national_id",
+    "english_first_name",
+    "english_last_name",
+    "referer_name",
+    "_updated_at",
+]
+
+
+class _UserRow:
+    """In-memory stand-in for a user row while an import is being planned."""
+
+    __slots__ = ("first_name", "id", "instance", "last_name", "phone_number", "username")
+
+    def __init__(self, user_id, username, first_name, last_name, phone_number, instance=None):
+        self.id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.phone_number = phone_number
+        self.instance = instance
+
+    @property
+    def key(self):
+        if self.id is not None:
+            return self.id
+        return ("new", id(self.instance))
+
+
+def _name_key(first_name, last_name):
+    return f"{first_name}{last_name}".replace(" ", "")
+
+
+class RegistrationImporter:
+    """
+    Imports parsed registration rows for one course.
+
+    The rows are matched against existing users and registrations entirely in
+    memory (``plan``) and the result is written with a handful of bulk queries
+    inside a single atomic block (``write``). Per-row signals are bypassed, so
+    derived fields such as ``net_amount`` and ``paid_amount`` are computed here.
+    """
+
+    def __init__(self, course, update_user=False, make_transaction=False):
+        self.course = course
+        self.update_user = update_user
+        self.make_transaction = make_transaction
+
+        self.logs = []
+        self.bad_name = 0
+        self.made_users = 0
+        self.made_registration = 0
+
+        self._new_users = []
+        self._loaded_users = {}
+        self._dirty_users = {}
+        self._renamed_users = {}
+        self._new_registrations = []
+        self._new_course_transactions = []
+
+    def run(self, users_data):
+        self.plan(users_data)
+        self.write()
+        return self.logs, self.made_users, self.made_registration, self.bad_name
+
+    def plan(self, users_data, progress=None):
+        users_dic = {
+            row[1]: _UserRow(*row)
+            for row in User.objects.order_by().values_list("id", "username", "first_name", "last_name", "phone_number")
+        }
+        users_dup_check = {
+            _name_key(row.first_name, row.last_name): row for row in users_dic.values() if row.last_name not in [None, ""]
+        }
+        self._loaded_users = self._load_name_matches(users_data, users_dic, users_dup_check)
+
+        registration_dic = dict(Registration.objects.filter(course=self.course).values_list("user_id", "id"))
+        course_transaction_dic = dict.fromkeys(
+            CourseTransaction.objects.filter(course=self.course).values_list("registration_id", flat=True), True
+        )
+
+        for index, data in enumerate(users_data, start=1):
+            user = self._plan_user(data, users_dic, users_dup_check)
+            self._plan_registration(data, user, registration_dic, course_transaction_dic)
+            if progress is not None:
+                progress(index)
+
+    def _load_name_matches(self, users_data, users_dic, users_dup_check):
+        user_ids = set()
+        for data in users_data:
+            if data["username"] in users_dic:
+                continue
+            row = users_dup_check.get(_name_key(data.get("first_name", ""), data.get("last_name", "")))
+            if row is not None:
+                user_ids.add(row.id)
+        return User.objects.in_bulk(user_ids)
+
+    def _plan_user(self, data, users_dic, users_dup_check):
+        phone = data["phone"]
+        username = data["username"]
+        first_name = data.get("first_name", "")
+        last_name = data.get("last_name", "")
+        telegram_id = data.get("telegram_id", "") or ""
+        email = data.get("email", "") or ""
+        education = User.get_education_from_text(data.get("education", None))
+        profession = data.get("profession", "") or ""
+        age = data.get("age", None)
+        gender = User.get_gender_from_text(data.get("gender", ""))
+        national_id = normalize_national_id(data.get("national_id", "")) or ""
+        english_first_name = data.get("english_first_name", "") or ""
+        english_last_name = data.get("english_last_name", "") or ""
+        referer_name = data.get("referer_name", "") or ""
+
+        if username in users_dic:
+            user = users_dic[username]
+            if user.first_name != first_name or user.last_name != last_name:
+                self.bad_name += 1
+                self.logs.append(
+                    [
+                        "bad name",
+                        str(phone),
+                        str(user.first_name),
+                        str(user.last_name),
+                        str(first_name),
+                        str(last_name),
+                    ]
+                )
+                if self.update_user:
+                    self._rename_user(user, first_name, last_name)
+            return user
+
+        name_key = _name_key(first_name, last_name)
+        if users_dup_check.get(name_key, None) is not None:
+            user = users_dup_check[name_key]
+            u = user.instance if user.instance is not None else self._loaded_users[user.id]
+            if user.phone_number is None:
+                u.phone_number = phone
+                u.username = username
+                users_dic[username] = _UserRow(user.id, username, first_name, last_name, phone, instance=user.instance)
+                user = users_dic[username]
+            u.telegram_id = make_none_empty_str(u.telegram_id) or telegram_id
+            u.email = make_none_empty_str(u.email) or email
+            u.profession = make_none_empty_str(u.profession) or profession
+            u.education = make_none_empty_str(u.education) or education
+            u.age = make_none_empty_str(u.age) or age
+            u.gender = u.gender if u.gender is not None else gender
+            u.national_id = make_none_empty_str(u.national_id) or national_id
+            u.english_first_name = make_none_empty_str(u.english_first_name) or english_first_name
+            u.english_last_name = make_none_empty_str(u.english_last_name) or english_last_name
+            u.referer_name = make_none_empty_str(u.referer_name) or referer_name
+            if user.instance is None:
+                self._dirty_users[u.pk] = u
+            return user
+
+        instance = User(
+            username=username,
+            phone_number=phone,
+            first_name=arabic_to_persian_characters(first_name) or "",
+            last_name=arabic_to_persian_characters(last_name) or "",
+            telegram_id=telegram_id,
+            email=email,
+            profession=profession,
+            education=education,
+            age=age,
+            gender=gender,
+            national_id=national_id,
+            english_first_name=english_first_name,
+            english_last_name=english_last_name,
+            referer_name=referer_name,
+        )
+        self._new_users.append(instance)
+        self.made_users += 1
+        user = _UserRow(None, instance.username, instance.first_name, instance.last_name, instance.phone_number, instance)
+        users_dup_check[name_key] = user
+        users_dic[username] = user
+        return user
+
+    def _rename_user(self, user, first_name, last_name):
+        if user.instance is not None:
+            user.instance.first_name = first_name
+            user.instance.last_name = last_name
+        elif user.id in self._loaded_users:
+            self._loaded_users[user.id].first_name = first_name
+            self._loaded_users[user.id].last_name = last_name
+            self._dirty_users[user.id] = self._loaded_users[user.id]
+        else:
+            self._renamed_users[user.id] = User(pk=user.id, first_name=first_name, last_name=last_name)
+
+    def _plan_registration(self, data, user, registration_dic, course_transaction_dic):
+        status, payment_status = get_status_from_text(data.get("status", None))
+        paid_amount = data.get("paid_amount", 0) or 0
+
+        if registration_dic.get(user.key, None) is None:
+            registration = Registration(
+                course=self.course,
+                status=status,
+                payment_status=payment_status,
+                tuition=data.get("tuition", 0) or 0,
+                initial_price=data.get("initial_price", 0) or 0,
+                discount=data.get("discount", 0) or 0,
+                registration_date=data.get("registration_date", None),
+            )
+            self._new_registrations.append((user, registration, data, len(self.logs)))
+            registration_dic[user.key] = registration
+            self.made_registration += 1
+
+        registration = registration_dic[user.key]
+        registration_key = registration if isinstance(registration, int) else ("new", id(registration))
+        if self.make_transaction and course_transaction_dic.get(registration_key, None) is None and paid_amount > 0:
+            course_transaction = CourseTransaction(
+                user_account_id=user.id,
+                course=self.course,
+                amount=paid_amount,
+                transaction_type=1,
+                transaction_category=INCOME_CATEGORY_REGISTRATION,
+                financial_account=data["financial_account"],
+                transaction_date=data.get("registration_date", None),
+                entry_user=data["entry_user"],
+                tracking_code=data.get("tracking_code", ""),
+            )
+            course_transaction.update_net_amount()
+            self._new_course_transactions.append((user, registration, course_transaction))
+            course_transaction_dic[registration_key] = True
+
+    @transaction.atomic
+    def write(self):
+        self._write_users()
+        failed = self._write_registrations()
+        self._write_course_transactions(failed)
+
+    def _write_users(self):
+        now = get_jdatetime_now_with_timezone()
+        for user in self._renamed_users.values():
+            user._updated_at = now
+        User.objects.bulk_update(
+            self._renamed_users.values(), ["first_name", "last_name", "_updated_at"], batch_size=IMPORT_BATCH_SIZE
+        )
+
+        for user in self._dirty_users.values():
+            user.first_name = arabic_to_persian_characters(user.first_name) or ""
+            user.last_name = arabic_to_persian_characters(user.last_name) or ""
+            user._updated_at = now
+        User.objects.bulk_update(self._dirty_users.values(), USER_FILL_FIELDS, batch_size=IMPORT_BATCH_SIZE)
+
+        User.objects.bulk_create(self._new_users, batch_size=IMPORT_BATCH_SIZE)
+        CrmUser.objects.bulk_create([CrmUser(user=user) for user in self._new_users], batch_size=IMPORT_BATCH_SIZE)
+
+    def _write_registrations(self):
+        paid_amounts = {}
+        for _, registration, course_transaction in self._new_course_transactions:
+            if not isinstance(registration, int):
+                paid_amounts[id(registration)] = paid_amounts.get(id(registration), 0) + course_transaction.amount
+        for user, registration, _, _ in self._new_registrations:
+            registration.user_id = user.id if user.id is not None else user.instance.pk
+            registration.paid_amount = paid_amounts.get(id(registration), 0)
+
+        registrations = [registration for _, registration, _, _ in self._new_registrations]
+        try:
+            with transaction.atomic():
+                Registration.objects.bulk_create(registrations, batch_size=IMPORT_BATCH_SIZE)
+            return set()
+        except Exception:
+            return self._write_registrations_one_by_one()
+
+    def _write_registrations_one_by_one(self):
+        failed = set()
+        errors = []
+        for user, registration, data, log_position in self._new_registrations:
+            registration.pk = None
+            try:
+                with transaction.atomic():
+                    registration.save(force_insert=True)
+            except Exception as e:
+                failed.add(id(registration))
+                self.made_registration -= 1
+                errors.append(
+                    (
+                        log_position,
+                        [
+                            "Error",
+                            str(data["phone"]),
+                            str(user.first_name),
+                            str(user.last_name),
+                            data.get("first_name", ""),
+                            str(e),
+                        ],
+                    )
+                )
+        for log_position, log in reversed(errors):
+            self.logs.insert(log_position, log)
+        return failed
+
+    def _write_course_transactions(self, failed_registrations):
+        course_transactions = []
+        existing_paid_amounts = {}
+        for user, registration, course_transaction in self._new_course_transactions:
+            if not isinstance(registration, int) and id(registration) in failed_registrations:
+                continue
+            course_transaction.user_account_id = user.id if user.id is not None else user.instance.pk
+            if isinstance(registration, int):
+                course_transaction.registration_id = registration
+                existing_paid_amounts[registration] = existing_paid_amounts.get(registration, 0) + course_transaction.amount
+            else:
+                course_transaction.registration_id = registration.pk
+            course_transactions.append(course_transaction)
+        if not course_transactions:
+            return
+
+        CourseTransaction.objects.bulk_create(course_transactions, batch_size=IMPORT_BATCH_SIZE)
+        transactions = [course_transaction.build_transaction() for course_transaction in course_transactions]
+        Transaction.objects.bulk_create(transactions, batch_size=IMPORT_BATCH_SIZE)
+        apply_transactions(transactions)
+        for course_transaction, ledger_transaction in zip(course_transactions, transactions, strict=True):
+            course_transaction.transaction = ledger_transaction
+        CourseTransaction.objects.bulk_update(course_transactions, ["transaction"], batch_size=IMPORT_BATCH_SIZE)
+
+        registrations = list(Registration.objects.filter(pk__in=existing_paid_amounts).only("id", "paid_amount"))
+        for registration in registrations:
+            registration.paid_amount += existing_paid_amounts[registration.pk]
+        Registration.objects.bulk_update(registrations, ["paid_amount"], batch_size=IMPORT_BATCH_SIZE)
+
+
+def parse_registration_excel(df, currency_to_toman_multiplier):
+    """Turn an uploaded registration sheet into importer rows, ``(users_data, logs, no_phone)``."""
+    df = df.where(pd.notnull(df), None)
+    df = df.dropna(how="all", subset=["نام", "نام خانوادگی", "fix phone"])
+
+    no_phone = 0
+    logs = []
+    users_data = []
+    phones = normalize_phones(df["fix phone"])
+    for index, row in df.iterrows():
+        phone = phones[index]
+        first_name = row.get("نام", "")
+        if first_name:
+            first_name = first_name.strip()
+        last_name = row.get("نام خانوادگی", "")
+        if last_name:
+            last_name = last_name.strip()
+        telegram_id = row.get("تلگرام", None) or row.get("آی‌دی تلگرام", None)
+
+        if phone == "":
+            phone = None
+        if phone is None and first_name is None and last_name is None:
+            continue
+        last_name = last_name or ""
+        if phone is None:
+            name_hash = hashlib.sha256(f"{first_name}{last_name}".encode()).hexdigest()[:10]
+            username = f"from_upload_{name_hash}"
+            no_phone += 1
+            logs.append(["No Phone", str(index), str(first_name), str(last_name), str(phone)])
+        else:
+            username = phone
+
+        users_data.append(
+            {
+                "username": username,
+                "phone": phone,
+                "first_name": first_name,
+                "last_name": last_name,
+                "telegram_id": telegram_id or "",
+                "email": row.get("ایمیل", "") or "",
+                "education": row.get("تحصیلات", ""),
+                "profession": row.get("حرفه", "") or "",
+                "national_id": row.get("کد ملی", "") or "",
+                "age": row.get("سن", None),
+                "gender": row.get("جنسیت", None),
+                "english_first_name": row.get("Name", "") or "",
+                "english_last_name": row.get("Surname", "") or "",
+                "referer_name": row.get("معرف", None) or "",
+                "status": row.get("وضعیت", None),
+                "tuition": float(row.get("مبلغ نهایی", 0) or 0) * currency_to_toman_multiplier,
+                "registration_date": get_jdatetime_now_with_timezone(),
+            }
+        )
+    return users_data, logs, no_phone
+
+
+def parse_sazito_csv(df, financial_account, entry_user):
+    """Turn a Sazito order export into importer rows, ``(users_data, logs, no_phone)``."""
+    logs = []
+    data = []
+    no_phone = 0
+    df = df.where(pd.notnull(df), None)
+    df = df.dropna(how="all", subset=["first name", "last name", "Mobile Number"])
+    phones = normalize_phones(df["Mobile Number"])
+    for index, row in df.iterrows():
+        phone = phones[index]
+        first_name = (row["first name"] or "").strip()
+        last_name = (row["last name"] or "").strip()
+        if phone is None or str(phone).strip() == "":
+            continue
+        details = {}
+        if row["Product Details"] is not None:
+            details = {
+                item.split(":", 1)[0].strip(): item.split(":", 1)[1].strip()
+                for item in row["Product Details"].split(",")
+                if ":" in item
+            }
+
+        if phone == "":
+            phone = None
+        if phone is None and first_name is None and last_name is None:
+            continue
+        last_name = last_name or ""
+        if phone is None:
+            name_hash = hashlib.sha256(f"{first_name}{last_name}".encode()).hexdigest()[:10]
+            username = f"from_upload_{name_hash}"
+            no_phone += 1
+            logs.append(["No Phone", str(first_name), str(last_name), str(phone)])
+        else:
+            username = phone
+        reg_date = datetime.strptime(str(row["Created at (gregorian)"]), "%m/%d/%Y %H:%M")
+        reg_date = timezone.make_aware(reg_date, timezone=timezone.get_current_timezone())
+        reg_date = jdatetime.fromgregorian(datetime=reg_date)
+        data.append(
+            {
+                "index": index,
+                "phone": phone,
+                "username": username,
+                "first_name": first_name,
+                "last_name": last_name,
+                "email": row["Email"],
+                "paid_amount": row["Final Total"],
+                "tuition": int(row["Net Total"]) - int(row["Discount Amount"]),
+                "initial_price": row["Net Total"],
+                "discount": row["Discount Amount"],
+                "education": details.get("تحصیلات", ""),
+                "profession": details.get("حرفه تخصصی", ""),
+                "telegram_id": details.get("آی\u200cدی تلگرام جهت عضو شدن در گروه دوره", ""),
+                "age": convert_to_english_digit(details.get("سن", None)),
+                "referer_name": details.get("معرف", ""),
+                "registration_date": reg_date,
+                "tracking_code": row["Payment Reference Code"],
+                "financial_account": financial_account,
+                "entry_user": entry_user,
+                "status": "حاضر در دوره - عدم سررسید",
+            }
+        )
+    return data, logs, no_phone
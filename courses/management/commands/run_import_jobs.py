@@ -0,0 +1,28 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from courses.models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process queued registration import jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Process the queue once and exit")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to sleep when the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            job = ImportJob.claim_next()
+            if job is not None:
+                logger.info("Running import job %s (%s rows)", job.pk, job.total_rows)
+                job.run()
+                logger.info("Import job %s finished: %s", job.pk, job.get_status_display())
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
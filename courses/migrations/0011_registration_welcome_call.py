@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0010_registration_paid_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registration',
+            name='welcome_call',
+            field=models.BooleanField(default=False, help_text='تماس پیش\u200cواز'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:48
+
+import commons.models
+import django.db.models.deletion
+import django_jalali.db.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0011_registration_welcome_call'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('_created_at', django_jalali.db.models.jDateTimeField(auto_now_add=True)),
+                ('_updated_at', django_jalali.db.models.jDateTimeField(auto_now=True)),
+                ('source', models.IntegerField(choices=[(1, 'Excel'), (2, 'Sazito')])),
+                ('status', models.IntegerField(choices=[(1, 'در صف'), (2, 'در حال اجرا'), (3, 'انجام شد'), (4, 'خطا')], db_index=True, default=1)),
+                ('update_user', models.BooleanField(default=False)),
+                ('make_transaction', models.BooleanField(default=False)),
+                ('rows', models.JSONField(blank=True, decoder=commons.models.LogDecoder, default=list, encoder=commons.models.LogEncoder)),
+                ('total_rows', models.PositiveIntegerField(default=0)),
+                ('processed_rows', models.PositiveIntegerField(default=0)),
+                ('made_users', models.PositiveIntegerField(default=0)),
+                ('made_registration', models.PositiveIntegerField(default=0)),
+                ('bad_name', models.PositiveIntegerField(default=0)),
+                ('no_phone', models.PositiveIntegerField(default=0)),
+                ('logs', models.JSONField(blank=True, default=list)),
+                ('error', models.TextField(blank=True, default='')),
+                ('started_at', django_jalali.db.models.jDateTimeField(blank=True, null=True)),
+                ('finished_at', django_jalali.db.models.jDateTimeField(blank=True, null=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='courses.course')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-_created_at'],
+            },
+        ),
+    ]
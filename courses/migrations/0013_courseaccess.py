@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_course_access(apps, schema_editor):
+    Course = apps.get_model("courses", "Course")
+    CourseAccess = apps.get_model("courses", "CourseAccess")
+    accesses = []
+    for role, through in ((1, Course.managing_users.through), (2, Course.supporting_users.through)):
+        accesses.extend(
+            CourseAccess(user_id=user_id, course_id=course_id, role=role)
+            for course_id, user_id in through.objects.values_list("course_id", "user_id")
+        )
+    CourseAccess.objects.bulk_create(accesses, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0012_importjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.IntegerField(choices=[(1, 'مدیریت'), (2, 'پشتیبانی')])),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accesses', to='courses.course')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_accesses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'course', 'role'), name='unique_course_access')],
+            },
+        ),
+        migrations.RunPython(backfill_course_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("courses", "0013_courseaccess"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="phase",
+            field=models.IntegerField(choices=[(1, "بررسی سطرها"), (2, "ذخیره در پایگاه داده")], default=1),
+        ),
+    ]
@@ -1,8 +1,11 @@
-from django.db import models
+import logging
+
+from django.db import models, transaction
 from django_jalali.db import models as jmodels
 
-from commons.models import TimeStampedModel
+from commons.models import LogDecoder, LogEncoder, TimeStampedModel
 from commons.utils import get_jdatetime_now_with_timezone
+from financials.aggregates import signed_sum, sum_subquery
 from users.models import User
 
 STATUS_CHOICES = [
@@ -85,6 +88,33 @@ class Course(TimeStampedModel):
         return self.course_name
 
 
+COURSE_ACCESS_ROLE_MANAGING = 1
+COURSE_ACCESS_ROLE_SUPPORTING = 2
+
+COURSE_ACCESS_ROLE_CHOICES = [
+    (COURSE_ACCESS_ROLE_MANAGING, "مدیریت"),
+    (COURSE_ACCESS_ROLE_SUPPORTING, "پشتیبانی"),
+]
+
+
+class CourseAccess(models.Model):
+    """Denormalized copy of ``Course.managing_users``/``supporting_users``, kept in sync by signals."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="course_accesses")
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="accesses")
+    role = models.IntegerField(choices=COURSE_ACCESS_ROLE_CHOICES)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["user", "course", "role"], name="unique_course_access")]
+
+    def __str__(self):
+        return f"{self.user_id}-{self.course_id}-{self.get_role_display()}"
+
+    @classmethod
+    def course_ids_for(cls, user):
+        return cls.objects.filter(user=user).values("course_id")
+
+
 class CourseSession(TimeStampedModel):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="sessions")
     session_name = models.CharField(max_length=100)
@@ -100,6 +130,16 @@ class CourseSession(TimeStampedModel):
         return f"{self.session_name} ({self.course.course_name})"
 
 
+class RegistrationQuerySet(models.QuerySet):
+    def with_paid_amount(self):
+        """Annotates ``paid_amount_total``, the signed sum of the course transactions, in the same query."""
+        from financials.models import CourseTransaction
+
+        return self.annotate(
+            paid_amount_total=sum_subquery(CourseTransaction.objects.all(), signed_sum("amount"), "registration"),
+        )
+
+
 class Registration(TimeStampedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="registrations")
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="registrations")
@@ -128,6 +168,8 @@ class Registration(TimeStampedModel):
     joined_group = models.BooleanField(default=False, help_text="عضویت در گروه دوره")
     welcome_call = models.BooleanField(default=False, help_text="تماس پیش‌واز")
 
+    objects = RegistrationQuerySet.as_manager()
+
     class Meta:
         ordering = ["-registration_date"]
         unique_together = ["user", "course"]
@@ -137,9 +179,7 @@ class Registration(TimeStampedModel):
         return dict(STATUS_CHOICES)[self.status]
 
     def _paid_amount(self):
-        return (self.transactions.filter(transaction_type=1).aggregate(total=models.Sum("amount"))["total"] or 0) - (
-            self.transactions.filter(transaction_type=2).aggregate(total=models.Sum("amount"))["total"] or 0
-        )
+        return self.transactions.signed_total("amount")
 
     def __str__(self):
         return f"{self.user} - {self.course} ({self.status_display})"
@@ -149,6 +189,14 @@ class Registration(TimeStampedModel):
         if commit:
             self.save(update_fields=["paid_amount"])
 
+    @classmethod
+    def recalculate_paid_amounts(cls, ids):
+        registrations = list(cls.objects.filter(pk__in=ids).with_paid_amount().only("id", "paid_amount"))
+        changed = [registration for registration in registrations if registration.paid_amount != registration.paid_amount_total]
+        for registration in changed:
+            registration.paid_amount = registration.paid_amount_total
+        cls.objects.bulk_update(changed, ["paid_amount"])
+
 
 class Attendance(TimeStampedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="attendances")
@@ -185,3 +233,176 @@ class CourseTeam(TimeStampedModel):
 
     def __str__(self):
         return f"{self.user.full_name or self.user.phone_number} - {self.course.course_name})"
+
+
+IMPORT_JOB_STATUS_PENDING = 1
+IMPORT_JOB_STATUS_RUNNING = 2
+IMPORT_JOB_STATUS_DONE = 3
+IMPORT_JOB_STATUS_FAILED = 4
+
+IMPORT_JOB_STATUS_CHOICES = [
+    (IMPORT_JOB_STATUS_PENDING, "در صف"),
+    (IMPORT_JOB_STATUS_RUNNING, "در حال اجرا"),
+    (IMPORT_JOB_STATUS_DONE, "انجام شد"),
+    (IMPORT_JOB_STATUS_FAILED, "خطا"),
+]
+
+IMPORT_JOB_PHASE_PLANNING = 1
+IMPORT_JOB_PHASE_WRITING = 2
+
+IMPORT_JOB_PHASE_CHOICES = [
+    (IMPORT_JOB_PHASE_PLANNING, "بررسی سطرها"),
+    (IMPORT_JOB_PHASE_WRITING, "ذخیره در پایگاه داده"),
+]
+
+IMPORT_JOB_SOURCE_EXCEL = 1
+IMPORT_JOB_SOURCE_SAZITO = 2
+
+IMPORT_JOB_SOURCE_CHOICES = [
+    (IMPORT_JOB_SOURCE_EXCEL, "Excel"),
+    (IMPORT_JOB_SOURCE_SAZITO, "Sazito"),
+]
+
+
+class ImportJob(TimeStampedModel):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="import_jobs")
+    source = models.IntegerField(choices=IMPORT_JOB_SOURCE_CHOICES)
+    status = models.IntegerField(choices=IMPORT_JOB_STATUS_CHOICES, default=IMPORT_JOB_STATUS_PENDING, db_index=True)
+    update_user = models.BooleanField(default=False)
+    make_transaction = models.BooleanField(default=False)
+    rows = models.JSONField(encoder=LogEncoder, decoder=LogDecoder, default=list, blank=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    phase = models.IntegerField(choices=IMPORT_JOB_PHASE_CHOICES, default=IMPORT_JOB_PHASE_PLANNING)
+    made_users = models.PositiveIntegerField(default=0)
+    made_registration = models.PositiveIntegerField(default=0)
+    bad_name = models.PositiveIntegerField(default=0)
+    no_phone = models.PositiveIntegerField(default=0)
+    logs = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="import_jobs")
+    started_at = jmodels.jDateTimeField(blank=True, null=True)
+    finished_at = jmodels.jDateTimeField(blank=True, null=True)
+
+    PROGRESS_EVERY = 200
+
+    class Meta:
+        ordering = ["-_created_at"]
+
+    def __str__(self):
+        return f"{self.get_source_display()} import #{self.pk} - {self.course}"
+
+    @classmethod
+    def enqueue(cls, course, source, rows, logs, no_phone, created_by=None, update_user=False, make_transaction=False):
+        return cls.objects.create(
+            course=course,
+            source=source,
+            rows=[{key: _to_python(value) for key, value in row.items()} for row in rows],
+            total_rows=len(rows),
+            logs=logs,
+            no_phone=no_phone,
+            created_by=created_by,
+            update_user=update_user,
+            make_transaction=make_transaction,
+        )
+
+    @classmethod
+    def claim_next(cls):
+        with transaction.atomic():
+            job = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status=IMPORT_JOB_STATUS_PENDING)
+                .order_by("_created_at")
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = IMPORT_JOB_STATUS_RUNNING
+            job.started_at = get_jdatetime_now_with_timezone()
+            job.save(update_fields=["status", "started_at", "_updated_at"])
+        return job
+
+    @property
+    def elapsed_seconds(self):
+        if self.started_at is None:
+            return 0
+        end = self.finished_at or get_jdatetime_now_with_timezone()
+        return max((end - self.started_at).total_seconds(), 0)
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed_seconds
+        if not elapsed:
+            return 0
+        return round(self.processed_rows / elapsed, 1)
+
+    @property
+    def summary(self):
+        return (
+            "Registrations imported"
+            + " ".join(
+                [
+                    "Done",
+                    str(self.bad_name),
+                    "bad name",
+                    str(self.no_phone),
+                    "no_phone",
+                    str(self.made_registration),
+                    "made registrations",
+                    str(self.made_users),
+                    "made users",
+                ]
+            )
+            + "\n".join([" ".join(log) for log in self.logs])
+        )
+
+    def _report_progress(self, processed_rows):
+        if processed_rows % self.PROGRESS_EVERY == 0 or processed_rows == self.total_rows:
+            self.processed_rows = processed_rows
+            ImportJob.objects.filter(pk=self.pk).update(processed_rows=processed_rows)
+
+    def _report_phase(self, phase):
+        # The bulk writes run in one transaction, so their progress cannot be seen before they
+        # commit; the phase tells a fully planned job apart from a finished one.
+        self.phase = phase
+        ImportJob.objects.filter(pk=self.pk).update(phase=phase)
+
+    def run(self):
+        from .importers import RegistrationImporter
+
+        try:
+            importer = RegistrationImporter(self.course, update_user=self.update_user, make_transaction=self.make_transaction)
+            importer.plan(self.rows, progress=self._report_progress)
+            self._report_phase(IMPORT_JOB_PHASE_WRITING)
+            importer.write()
+        except Exception as e:
+            logging.getLogger(__name__).exception("Error running import job %s", self.pk)
+            self.status = IMPORT_JOB_STATUS_FAILED
+            self.error = str(e)
+        else:
+            self.status = IMPORT_JOB_STATUS_DONE
+            self.processed_rows = self.total_rows
+            self.made_users = importer.made_users
+            self.made_registration = importer.made_registration
+            self.bad_name = importer.bad_name
+            self.logs = self.logs + importer.logs
+        self.finished_at = get_jdatetime_now_with_timezone()
+        self.save(
+            update_fields=[
+                "status",
+                "error",
+                "processed_rows",
+                "made_users",
+                "made_registration",
+                "bad_name",
+                "logs",
+                "finished_at",
+                "_updated_at",
+            ]
+        )
+
+
+def _to_python(value):
+    if hasattr(value, "item") and not isinstance(value, str | bytes):
+        return value.item()
+    return value
@@ -3,14 +3,16 @@ from functools import wraps
 from django.contrib import messages
 from django.shortcuts import redirect
 
+from commons.permissions import get_permission_resolver
+
 
 class CoursePermissionMixin:
     def has_course_manage_permission(self, request, course):
-        user = request.user
-        if user.is_superuser:
+        resolver = get_permission_resolver(request)
+        if resolver.is_superuser:
             return True
 
-        if course and course.managing_users.filter(pk=user.pk).exists():
+        if course and resolver.manages_course(course):
             return True
 
         return False
@@ -22,9 +24,11 @@ def requires_course_managing_permission(view_func):
         try:
             from .models import Course
 
-            course = Course.objects.get(id=course_id)
-            user = request.user
-            if not user.is_superuser and not course.managing_users.filter(pk=user.pk).exists():
+            # The course is only looked up to tell a missing course from a denied one; the
+            # decorated views load it themselves when they need it.
+            if not get_permission_resolver(request).manages_course(int(course_id)):
+                if not Course.objects.filter(id=course_id).exists():
+                    raise Course.DoesNotExist
                 messages.error(request, "شما اجازه دسترسی به این عملیات را ندارید.")
                 return redirect(".")
             return view_func(self, request, course_id, *args, **kwargs)
@@ -1,11 +1,41 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
 
-from .models import Registration
+from commons.recalc import register_recalculator
 
+from .models import COURSE_ACCESS_ROLE_MANAGING, COURSE_ACCESS_ROLE_SUPPORTING, Course, CourseAccess, Registration
 
-@receiver(pre_save, sender=Registration)
-def registration_pre_save(sender, instance, **kwargs):
-    if not instance.pk:
+register_recalculator(Registration, Registration.recalculate_paid_amounts)
+
+
+def _sync_course_access(role, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    owner = {"user": instance} if reverse else {"course": instance}
+    if action == "post_clear":
+        CourseAccess.objects.filter(role=role, **owner).delete()
+        return
+    if not pk_set:
         return
-    instance.update_paid_amount(commit=False)
+    if reverse:
+        pairs = [(instance.pk, course_id) for course_id in pk_set]
+    else:
+        pairs = [(user_id, instance.pk) for user_id in pk_set]
+    if action == "post_add":
+        CourseAccess.objects.bulk_create(
+            [CourseAccess(user_id=user_id, course_id=course_id, role=role) for user_id, course_id in pairs],
+            ignore_conflicts=True,
+        )
+    else:
+        other = "course_id__in" if reverse else "user_id__in"
+        CourseAccess.objects.filter(role=role, **owner, **{other: pk_set}).delete()
+
+
+@receiver(m2m_changed, sender=Course.managing_users.through)
+def course_managing_users_changed(sender, **kwargs):
+    _sync_course_access(COURSE_ACCESS_ROLE_MANAGING, **kwargs)
+
+
+@receiver(m2m_changed, sender=Course.supporting_users.through)
+def course_supporting_users_changed(sender, **kwargs):
+    _sync_course_access(COURSE_ACCESS_ROLE_SUPPORTING, **kwargs)
@@ -2,10 +2,20 @@
 Tests for course permissions.
 """
 
+from django.contrib.admin import AdminSite
 from django.contrib.auth import get_user_model
 from django.test import TestCase
-
-from courses.models import Course, CourseType
+from django.urls import reverse
+
+from commons.permissions import get_permission_resolver
+from courses.models import (
+    COURSE_ACCESS_ROLE_MANAGING,
+    COURSE_ACCESS_ROLE_SUPPORTING,
+    Course,
+    CourseAccess,
+    CourseType,
+    Registration,
+)
 from courses.permissions import CoursePermissionMixin
 
 User = get_user_model()
@@ -98,3 +108,106 @@ class CourseExportPermissionIntegrationTest(TestCase):
         admin = CourseAdmin(Course, None)
         self.assertTrue(hasattr(admin, "has_course_manage_permission"))
         self.assertTrue(hasattr(admin, "change_view"))
+
+
+class PermissionResolverTest(TestCase):
+    def setUp(self):
+        self.managing_user = User.objects.create_user(username="managing_user", is_staff=True)
+        self.course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        self.course = Course.objects.create(course_type=self.course_type, course_name="Test Course", number=1)
+        self.other_course = Course.objects.create(course_type=self.course_type, course_name="Other Course", number=2)
+        self.course.managing_users.add(self.managing_user)
+        self.registration = Registration.objects.create(user=User.objects.create(username="student"), course=self.course)
+
+    def test_checks_share_one_lookup_per_request(self):
+        from django.http import HttpRequest
+
+        from courses.admin import RegistrationAdmin
+
+        admin = RegistrationAdmin(Registration, AdminSite())
+        request = HttpRequest()
+        request.user = self.managing_user
+        with self.assertNumQueries(1):
+            for _ in range(5):
+                self.assertTrue(admin.has_course_manage_permission(request, self.course))
+                self.assertFalse(admin.has_course_manage_permission(request, self.other_course))
+                self.assertTrue(admin.has_change_permission(request, self.registration))
+                admin.get_fieldsets(request, self.registration)
+        with self.assertNumQueries(1):
+            self.assertFalse(get_permission_resolver(request).is_managing)
+
+        request.user = User.objects.create_user(username="regular_user")
+        self.assertFalse(admin.has_change_permission(request, self.registration))
+
+    def test_decorator_looks_up_the_course_only_when_denied(self):
+        from django.contrib.messages.storage.cookie import CookieStorage
+        from django.test import RequestFactory
+
+        from courses.permissions import requires_course_managing_permission
+
+        class MockAdmin:
+            @requires_course_managing_permission
+            def export_registrations(self, request, course_id):
+                return "success"
+
+        def make_request(user):
+            request = RequestFactory().get("/")
+            request.user = user
+            request._messages = CookieStorage(request)
+            return request
+
+        superuser = User.objects.create_superuser(username="superuser")
+        with self.assertNumQueries(0):
+            self.assertEqual(MockAdmin().export_registrations(make_request(superuser), self.course.pk), "success")
+        with self.assertNumQueries(1):
+            self.assertEqual(MockAdmin().export_registrations(make_request(self.managing_user), self.course.pk), "success")
+        with self.assertNumQueries(2):
+            response = MockAdmin().export_registrations(make_request(self.managing_user), self.other_course.pk)
+        self.assertEqual(response.url, ".")
+        response = MockAdmin().export_registrations(make_request(self.managing_user), 0)
+        self.assertEqual(response.url, reverse("admin:courses_course_changelist"))
+
+
+class CourseAccessTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username="staff", is_staff=True)
+        self.course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        self.course = Course.objects.create(course_type=self.course_type, course_name="Test Course", number=1)
+        self.other_course = Course.objects.create(course_type=self.course_type, course_name="Other Course", number=2)
+
+    def _roles(self):
+        return set(CourseAccess.objects.values_list("user_id", "course_id", "role"))
+
+    def test_access_follows_m2m_changes(self):
+        self.course.managing_users.add(self.staff)
+        self.staff.supported_courses.add(self.course, self.other_course)
+        self.assertEqual(
+            self._roles(),
+            {
+                (self.staff.pk, self.course.pk, COURSE_ACCESS_ROLE_MANAGING),
+                (self.staff.pk, self.course.pk, COURSE_ACCESS_ROLE_SUPPORTING),
+                (self.staff.pk, self.other_course.pk, COURSE_ACCESS_ROLE_SUPPORTING),
+            },
+        )
+        self.course.supporting_users.remove(self.staff)
+        self.staff.managed_courses.clear()
+        self.assertEqual(self._roles(), {(self.staff.pk, self.other_course.pk, COURSE_ACCESS_ROLE_SUPPORTING)})
+
+    def test_registration_queryset_without_distinct(self):
+        from django.http import HttpRequest
+
+        from courses.admin import RegistrationAdmin
+
+        self.course.managing_users.add(self.staff)
+        self.course.supporting_users.add(self.staff)
+        visible = Registration.objects.create(
+            user=User.objects.create(username="a"), course=self.course, supporting_user=self.staff
+        )
+        Registration.objects.create(user=User.objects.create(username="b"), course=self.other_course)
+        own = Registration.objects.create(user=self.staff, course=self.other_course)
+
+        request = HttpRequest()
+        request.user = self.staff
+        qs = RegistrationAdmin(Registration, AdminSite()).get_queryset(request)
+        self.assertFalse(qs.query.distinct)
+        self.assertEqual(sorted(qs.values_list("pk", flat=True)), sorted([visible.pk, own.pk]))
@@ -1 +1,275 @@
-# Create your tests here.
+import tempfile
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.core.management import call_command
+from django.db import transaction
+from django.http import FileResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from openpyxl import load_workbook
+
+from commons.exports import export_file, export_response
+from commons.recalc import deferred_recalculation, flush_recalculations
+from courses.admin import CourseTeamInline
+from courses.exports import REGISTRATION_EXPORT
+from courses.importers import RegistrationImporter
+from courses.models import (
+    IMPORT_JOB_PHASE_WRITING,
+    IMPORT_JOB_SOURCE_SAZITO,
+    IMPORT_JOB_STATUS_DONE,
+    Course,
+    CourseType,
+    ImportJob,
+    Registration,
+)
+from financials.models import CourseTransaction, FinancialAccount
+from users.merge import merge_users
+from users.models import CrmUser, User
+
+
+class RegistrationImporterTest(TestCase):
+    def setUp(self):
+        self.course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        self.course = Course.objects.create(course_type=self.course_type, course_name="Test Course", number=1)
+        self.account = FinancialAccount.objects.create(name="پی‌پینگ")
+        self.entry_user = User.objects.create(username="entry", first_name="Entry", last_name="User")
+        self.existing = User.objects.create(
+            username="+989121111111", phone_number="+989121111111", first_name="Ali", last_name="Rezaei"
+        )
+        self.no_phone = User.objects.create(username="from_register_x", first_name="Sara", last_name="Ahmadi")
+
+    def _row(self, phone, first_name, last_name, paid_amount=0):
+        return {
+            "phone": phone,
+            "username": phone,
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": "",
+            "paid_amount": paid_amount,
+            "tuition": 1000,
+            "initial_price": 1000,
+            "discount": 0,
+            "registration_date": self.course._created_at,
+            "tracking_code": f"T-{phone}",
+            "financial_account": self.account,
+            "entry_user": self.entry_user,
+            "status": "حاضر در دوره - عدم سررسید",
+        }
+
+    def test_import_counts_and_writes(self):
+        rows = [
+            self._row("+989121111111", "Ali", "Rezai", paid_amount=500),
+            self._row("+989122222222", "Sara", "Ahmadi", paid_amount=700),
+            self._row("+989123333333", "Nima", "Karimi", paid_amount=900),
+            self._row("+989123333333", "Nima", "Karimi", paid_amount=900),
+        ]
+
+        with self.assertNumQueries(23):
+            logs, made_users, made_registration, bad_name = RegistrationImporter(self.course, make_transaction=True).run(rows)
+
+        self.assertEqual((made_users, made_registration, bad_name), (1, 3, 1))
+        self.assertEqual(logs, [["bad name", "+989121111111", "Ali", "Rezaei", "Ali", "Rezai"]])
+
+        self.no_phone.refresh_from_db()
+        self.assertEqual(self.no_phone.username, "+989122222222")
+        self.assertEqual(str(self.no_phone.phone_number), "+989122222222")
+
+        new_user = User.objects.get(username="+989123333333")
+        self.assertTrue(CrmUser.objects.filter(user=new_user).exists())
+
+        registrations = Registration.objects.filter(course=self.course)
+        self.assertEqual(registrations.count(), 3)
+        self.assertEqual(registrations.get(user=new_user).paid_amount, 900)
+        self.assertEqual(registrations.get(user=new_user).status, 9)
+
+        course_transactions = CourseTransaction.objects.filter(course=self.course).select_related("transaction")
+        self.assertEqual(course_transactions.count(), 3)
+        for course_transaction in course_transactions:
+            self.assertEqual(course_transaction.net_amount, course_transaction.amount)
+            self.assertEqual(course_transaction.transaction.net_amount, course_transaction.amount)
+            self.assertEqual(course_transaction.transaction.description, f"CT #{course_transaction.id}")
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance(), 2100)
+
+    def test_reimport_is_idempotent(self):
+        rows = [self._row("+989124444444", "Reza", "Moradi", paid_amount=100)]
+        RegistrationImporter(self.course, make_transaction=True).run(rows)
+        logs, made_users, made_registration, bad_name = RegistrationImporter(self.course, make_transaction=True).run(rows)
+
+        self.assertEqual((logs, made_users, made_registration, bad_name), ([], 0, 0, 0))
+        self.assertEqual(CourseTransaction.objects.filter(course=self.course).count(), 1)
+
+    def test_worker_runs_queued_job(self):
+        rows = [self._row("+989125555555", "Maryam", "Javid", paid_amount=300)]
+        job = ImportJob.enqueue(
+            self.course, IMPORT_JOB_SOURCE_SAZITO, rows, [["No Phone", "x", "y", "None"]], 1, make_transaction=True
+        )
+        self.assertFalse(Registration.objects.filter(course=self.course).exists())
+
+        call_command("run_import_jobs", "--once")
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, IMPORT_JOB_STATUS_DONE)
+        self.assertEqual((job.processed_rows, job.made_users, job.made_registration), (1, 1, 1))
+        self.assertIn("Done 0 bad name 1 no_phone 1 made registrations 1 made users", job.summary)
+        registration = Registration.objects.get(course=self.course)
+        self.assertEqual(registration.registration_date, self.course._created_at)
+        self.assertEqual(registration.transactions.get().financial_account, self.account)
+
+    def test_progress_is_not_complete_before_the_writes(self):
+        rows = [self._row(f"+98912555000{index}", "Maryam", f"Javid{index}") for index in range(4)]
+        job = ImportJob.enqueue(self.course, IMPORT_JOB_SOURCE_SAZITO, rows, [], 0)
+        progress_at_write = []
+        write = RegistrationImporter.write
+
+        def tracked_write(importer):
+            stored = ImportJob.objects.get(pk=job.pk)
+            progress_at_write.append((stored.phase, stored.processed_rows))
+            return write(importer)
+
+        with mock.patch.object(RegistrationImporter, "write", tracked_write):
+            job.run()
+        self.assertEqual(progress_at_write, [(IMPORT_JOB_PHASE_WRITING, 4)])
+        self.assertEqual((job.processed_rows, job.status), (4, IMPORT_JOB_STATUS_DONE))
+
+
+class PaidAmountRecalculationTest(TestCase):
+    def setUp(self):
+        course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        self.course = Course.objects.create(course_type=course_type, course_name="Test Course", number=1)
+        self.account = FinancialAccount.objects.create(name="پی‌پینگ")
+        self.registration = Registration.objects.create(user=User.objects.create(username="user"), course=self.course)
+        self.other = Registration.objects.create(user=User.objects.create(username="other"), course=self.course)
+
+    def _transaction(self, amount, transaction_type=1):
+        return CourseTransaction.objects.create(
+            course=self.course,
+            registration=self.registration,
+            financial_account=self.account,
+            transaction_type=transaction_type,
+            amount=amount,
+        )
+
+    def test_recalculated_once_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(10):
+                self._transaction(100)
+            self._transaction(50, transaction_type=2)
+            self.registration.refresh_from_db()
+            self.assertEqual(self.registration.paid_amount, 0)
+        self.registration.refresh_from_db()
+        self.assertEqual(self.registration.paid_amount, 950)
+
+        moved = CourseTransaction.objects.filter(registration=self.registration, transaction_type=1).first()
+        moved.registration = self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.save()
+        self.registration.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.registration.paid_amount, self.other.paid_amount), (850, 100))
+
+    def test_one_flush_per_transaction_and_none_after_rollback(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            for _ in range(10):
+                self._transaction(100)
+        self.assertEqual(sum(callback.__qualname__ == "_CommitBatch.flush" for callback in callbacks), 1)
+
+        recalculated = []
+        with mock.patch.dict("commons.recalc._recalculators", {Registration._meta.label: recalculated.append}):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(ValueError), transaction.atomic():
+                    CourseTransaction.objects.create(
+                        course=self.course, registration=self.other, financial_account=self.account, amount=100
+                    )
+                    raise ValueError
+                self._transaction(100)
+        self.assertEqual(recalculated, [[self.registration.pk]])
+
+    def test_deferred_recalculation(self):
+        with deferred_recalculation(flush=False):
+            self._transaction(300)
+            self._transaction(200)
+        self.registration.refresh_from_db()
+        self.assertEqual(self.registration.paid_amount, 0)
+
+        with self.assertNumQueries(2):
+            flush_recalculations()
+        self.registration.refresh_from_db()
+        self.assertEqual(self.registration.paid_amount, 500)
+
+
+class RegistrationExportTest(TestCase):
+    def setUp(self):
+        course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        self.course = Course.objects.create(course_type=course_type, course_name="Test Course", number=1)
+        self.supporter = User.objects.create(username="support", first_name="Sara", last_name="Ahmadi")
+        for index in range(3):
+            user = User.objects.create(
+                username=f"user{index}", phone_number=f"+98912111111{index}", first_name="Ali", last_name=f"R{index}"
+            )
+            Registration.objects.create(user=user, course=self.course, tuition=1000, supporting_user=self.supporter)
+        self.registrations = Registration.objects.filter(course=self.course)
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(cache.cleanup)
+        self.cache_dir = cache.name
+
+    def test_csv_rows(self):
+        path = export_file(REGISTRATION_EXPORT, self.registrations, "csv", cache_dir=self.cache_dir)
+        lines = path.read_text(encoding="utf-8-sig").splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("first name,last name,phone"))
+        self.assertIn("Sara Ahmadi", lines[1])
+
+    def test_xlsx_has_labels(self):
+        path = export_file(REGISTRATION_EXPORT, self.registrations, "xlsx", cache_dir=self.cache_dir)
+        rows = list(load_workbook(path).active.values)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][4], "در انتظار ثبت‌نام")
+        self.assertEqual(rows[1][9], 1000)
+        self.assertEqual(rows[1][10], "تسویه")
+
+    def test_cached_until_data_changes(self):
+        with self.assertNumQueries(2):
+            path = export_file(REGISTRATION_EXPORT, self.registrations, "xlsx", cache_dir=self.cache_dir)
+        with self.assertNumQueries(1):
+            self.assertEqual(export_file(REGISTRATION_EXPORT, self.registrations, "xlsx", cache_dir=self.cache_dir), path)
+
+        self.supporter.last_name = "Karimi"
+        self.supporter.save()
+        changed = export_file(REGISTRATION_EXPORT, self.registrations, "xlsx", cache_dir=self.cache_dir)
+        self.assertNotEqual(changed, path)
+        self.assertFalse(path.exists())
+        self.assertEqual(list(load_workbook(changed).active.values)[1][13], "Sara Karimi")
+
+    def test_merge_invalidates_the_cache(self):
+        path = export_file(REGISTRATION_EXPORT, self.registrations, "csv", cache_dir=self.cache_dir)
+        source = self.registrations.order_by("pk").first().user
+        target = User.objects.create(username="target", phone_number="+989122222222", first_name="Reza", last_name="Karimi")
+        merge_users([(source.pk, target.pk)])
+        changed = export_file(REGISTRATION_EXPORT, self.registrations, "csv", cache_dir=self.cache_dir)
+        self.assertNotEqual(changed, path)
+        self.assertIn("Reza,Karimi", changed.read_text(encoding="utf-8-sig"))
+
+    def test_csv_miss_is_streamed_and_cached(self):
+        with override_settings(EXPORT_CACHE_DIR=self.cache_dir):
+            response = export_response(REGISTRATION_EXPORT, self.registrations, "registrations", "csv")
+            self.assertIsInstance(response, StreamingHttpResponse)
+            content = b"".join(response.streaming_content).decode("utf-8-sig")
+            path = export_file(REGISTRATION_EXPORT, self.registrations, "csv")
+            self.assertEqual(path.read_bytes().decode("utf-8-sig"), content)
+            self.assertIsInstance(export_response(REGISTRATION_EXPORT, self.registrations, "registrations", "csv"), FileResponse)
+
+
+class CourseTeamInlineTest(TestCase):
+    def test_superuser_edits_only_the_teams_of_managed_courses(self):
+        course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        managed = Course.objects.create(course_type=course_type, course_name="Managed", number=1)
+        other = Course.objects.create(course_type=course_type, course_name="Other", number=2)
+        admin_user = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        managed.managing_users.add(admin_user)
+        request = RequestFactory().get("/")
+        request.user = admin_user
+        inline = CourseTeamInline(Course, site)
+        self.assertEqual(list(inline.get_readonly_fields(request, managed)), [])
+        self.assertEqual(inline.get_readonly_fields(request, other), inline.fields)
+        self.assertFalse(inline.has_delete_permission(request, other))
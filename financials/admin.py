@@ -6,7 +6,7 @@ from django.http import HttpResponseRedirect
 from django.urls import path, reverse
 from django.utils.html import format_html
 
-from commons.admin import DetailedLogAdminMixin
+from commons.admin import DetailedLogAdminMixin, EstimatedCountAdminMixin
 from commons.forms import FinancialNumberFormMixin
 
 from .models import Commodity, CourseTransaction, Customer, FinancialAccount, Invoice, InvoiceItem, Transaction
@@ -14,7 +14,7 @@ from .models import Commodity, CourseTransaction, Customer, FinancialAccount, In
 
 @admin.register(FinancialAccount)
 class FinancialAccountAdmin(DetailedLogAdminMixin, DALFModelAdmin):
-    list_display = ("name", "description", "_created_at", "_updated_at")
+    list_display = ("name", "description", "current_balance", "_created_at", "_updated_at")
     search_fields = ("name", "description")
     readonly_fields = ("_created_at", "_updated_at", "balance")
     filter_horizontal = ("course",)
@@ -66,6 +66,7 @@ class InvoiceAdmin(DetailedLogAdminMixin, DALFModelAdmin):
         "date",
         "customer",
         "total_amount",
+        "balance_display",
         "is_paid",
         "course",
         "items_amount",
@@ -89,6 +90,13 @@ class InvoiceAdmin(DetailedLogAdminMixin, DALFModelAdmin):
         ("زمان‌بندی", {"fields": ("_created_at", "_updated_at")}),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_balance()
+
+    @admin.display(description="balance", ordering="computed_balance")
+    def balance_display(self, obj):
+        return f"{obj.balance:,}"
+
 
 class InvoiceItemAdminForm(FinancialNumberFormMixin, forms.ModelForm):
     class Meta:
@@ -161,7 +169,7 @@ class TransactionAdminForm(FinancialNumberFormMixin, forms.ModelForm):
 
 
 @admin.register(Transaction)
-class TransactionAdmin(DetailedLogAdminMixin, DALFModelAdmin):
+class TransactionAdmin(EstimatedCountAdminMixin, DetailedLogAdminMixin, DALFModelAdmin):
     form = TransactionAdminForm
     list_display = (
         "id",
@@ -398,7 +406,7 @@ class CourseTransactionAdminForm(FinancialNumberFormMixin, forms.ModelForm):
 
 
 @admin.register(CourseTransaction)
-class CourseTransactionAdmin(DetailedLogAdminMixin, DALFModelAdmin):
+class CourseTransactionAdmin(EstimatedCountAdminMixin, DetailedLogAdminMixin, DALFModelAdmin):
     form = CourseTransactionAdminForm
     list_display = (
         "id",
@@ -0,0 +1,41 @@
+from django.db import models
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+TRANSACTION_TYPE_DEPOSIT = 1
+TRANSACTION_TYPE_WITHDRAW = 2
+
+
+def signed_sum(field="amount", prefix=""):
+    """
+    Sum of ``field`` with deposits counted positive and withdrawals negative,
+    as a single conditional aggregate. ``prefix`` follows a relation, e.g. ``"transactions__"``.
+    """
+    return Coalesce(
+        Sum(
+            Case(
+                When(**{f"{prefix}transaction_type": TRANSACTION_TYPE_DEPOSIT}, then=F(f"{prefix}{field}")),
+                When(**{f"{prefix}transaction_type": TRANSACTION_TYPE_WITHDRAW}, then=-F(f"{prefix}{field}")),
+                default=Value(0),
+                output_field=models.BigIntegerField(),
+            )
+        ),
+        Value(0),
+        output_field=models.BigIntegerField(),
+    )
+
+
+def sum_subquery(queryset, aggregate, link_field):
+    """
+    Correlated subquery aggregating ``queryset`` rows whose ``link_field`` points to the outer row.
+    Unlike annotating over a join, it does not multiply rows when combined with other joins.
+    """
+    inner = (
+        queryset.filter(**{link_field: OuterRef("pk")}).order_by().values(link_field).annotate(total=aggregate).values("total")
+    )
+    return Coalesce(Subquery(inner, output_field=models.BigIntegerField()), Value(0), output_field=models.BigIntegerField())
+
+
+class SignedSumQuerySet(models.QuerySet):
+    def signed_total(self, field="amount"):
+        return self.aggregate(total=signed_sum(field))["total"]
@@ -0,0 +1,138 @@
+from collections import defaultdict
+from datetime import date, datetime
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from jdatetime import date as jdate
+from jdatetime import datetime as jdatetime
+
+from .aggregates import signed_sum
+from .models import AccountDailyBalance, FinancialAccount, Transaction
+
+
+def to_jalali_day(value):
+    if isinstance(value, jdatetime):
+        value = value.togregorian()
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return jdate.fromgregorian(date=value.date())
+    if isinstance(value, date):
+        return jdate.fromgregorian(date=value)
+    return value
+
+
+def signed_amount(transaction_type, net_amount):
+    if not net_amount:
+        return 0
+    return net_amount if transaction_type == 1 else -net_amount
+
+
+def transaction_change(instance, loaded=False):
+    """(account_id, day, signed amount) of a transaction, either as saved now or as it was loaded."""
+    if loaded:
+        get = instance.get_loaded_value
+        return get("account_id"), get("transaction_date"), signed_amount(get("transaction_type"), get("net_amount"))
+    return instance.account_id, instance.transaction_date, signed_amount(instance.transaction_type, instance.net_amount)
+
+
+@transaction.atomic
+def apply_balance_changes(changes):
+    """
+    Applies ``(account_id, transaction_date, amount)`` triples to the materialized
+    balances: one update per account and three small queries per touched day. The touched
+    accounts are locked first, so concurrent writers cannot build a day's snapshot from the
+    same stale previous balance.
+    """
+    per_account = defaultdict(lambda: defaultdict(int))
+    for account_id, transaction_date, amount in changes:
+        if account_id is None or not amount:
+            continue
+        per_account[account_id][to_jalali_day(transaction_date)] += amount
+    if not per_account:
+        return
+
+    # Locked in primary key order, so two writers touching the same accounts cannot deadlock.
+    list(FinancialAccount.objects.select_for_update().filter(pk__in=per_account).order_by("pk").values_list("pk", flat=True))
+    for account_id, days in per_account.items():
+        total = sum(days.values())
+        if total:
+            FinancialAccount.objects.filter(pk=account_id).update(current_balance=F("current_balance") + total)
+        snapshots = AccountDailyBalance.objects.filter(account_id=account_id)
+        for day in sorted(days):
+            amount = days[day]
+            if not amount:
+                continue
+            updated = snapshots.filter(date=day).update(net_change=F("net_change") + amount, balance=F("balance") + amount)
+            if not updated:
+                previous = snapshots.filter(date__lt=day).order_by("-date").values_list("balance", flat=True).first() or 0
+                AccountDailyBalance.objects.create(account_id=account_id, date=day, net_change=amount, balance=previous + amount)
+            snapshots.filter(date__gt=day).update(balance=F("balance") + amount)
+
+
+def apply_transactions(transactions):
+    """Adds freshly inserted transactions (e.g. from ``bulk_create``) to the balances."""
+    apply_balance_changes([transaction_change(instance) for instance in transactions])
+    for instance in transactions:
+        instance.reset_loaded_values()
+
+
+def apply_transaction_save(instance, created):
+    changes = [transaction_change(instance)]
+    if not created and instance.has_loaded_values:
+        account_id, transaction_date, amount = transaction_change(instance, loaded=True)
+        changes.append((account_id, transaction_date, -amount))
+    apply_balance_changes(changes)
+    instance.reset_loaded_values()
+
+
+def apply_transaction_delete(instance):
+    account_id, transaction_date, amount = transaction_change(instance, loaded=instance.has_loaded_values)
+    apply_balance_changes([(account_id, transaction_date, -amount)])
+
+
+def daily_net_changes(account_ids=None):
+    queryset = Transaction.objects.all()
+    if account_ids is not None:
+        queryset = queryset.filter(account_id__in=account_ids)
+    rows = (
+        queryset.annotate(day=TruncDate("transaction_date", tzinfo=timezone.get_current_timezone()))
+        .order_by()
+        .values("account_id", "day")
+        .annotate(net=signed_sum("net_amount"))
+    )
+    result = defaultdict(dict)
+    for row in rows:
+        result[row["account_id"]][jdate.fromgregorian(date=row["day"])] = row["net"] or 0
+    return result
+
+
+@transaction.atomic
+def rebuild_balances(account_ids=None):
+    """
+    Recomputes balances and daily snapshots from the transactions table.
+    Returns ``{account_id: (old_balance, new_balance)}`` for accounts that drifted.
+    """
+    accounts = FinancialAccount.objects.select_for_update()
+    if account_ids is not None:
+        accounts = accounts.filter(pk__in=account_ids)
+    accounts = list(accounts.only("id", "current_balance"))
+    ids = [account.id for account in accounts]
+    changes = daily_net_changes(ids)
+
+    AccountDailyBalance.objects.filter(account_id__in=ids).delete()
+    snapshots = []
+    drifted = {}
+    for account in accounts:
+        running = 0
+        for day, net in sorted(changes.get(account.id, {}).items()):
+            running += net
+            snapshots.append(AccountDailyBalance(account_id=account.id, date=day, net_change=net, balance=running))
+        if account.current_balance != running:
+            drifted[account.id] = (account.current_balance, running)
+            account.current_balance = running
+    AccountDailyBalance.objects.bulk_create(snapshots, batch_size=1000)
+    FinancialAccount.objects.bulk_update(accounts, ["current_balance"], batch_size=1000)
+    return drifted
@@ -0,0 +1,57 @@
+from django.db import transaction
+
+from commons.recalc import deferred_recalculation
+from commons.utils import get_jdatetime_now_with_timezone
+from courses.models import Registration
+
+from .models import Invoice, InvoiceItem
+
+INVOICE_BATCH_SIZE = 500
+
+
+@transaction.atomic
+def create_course_invoices(course, commodity, date=None, registrations=None, organization=1):
+    """
+    Creates one sale invoice per registration of ``course`` that has no invoice item yet,
+    with a single item priced from the registration. Every insert is a bulk insert and the
+    invoice totals are recalculated once at the end.
+    """
+    if registrations is None:
+        registrations = course.registrations.all()
+    registrations = list(registrations.filter(invoice_item__isnull=True).select_related("user"))
+    if not registrations:
+        return []
+    date = date or get_jdatetime_now_with_timezone().date()
+
+    with deferred_recalculation():
+        invoices = Invoice.objects.bulk_create(
+            [
+                Invoice(
+                    organization=organization,
+                    type=2,
+                    date=date,
+                    course=course,
+                    description=f"{registration.user.get_full_name()} - {registration.user.phone_number or ''}",
+                )
+                for registration in registrations
+            ],
+            batch_size=INVOICE_BATCH_SIZE,
+        )
+        items = InvoiceItem.objects.bulk_create(
+            [
+                InvoiceItem(
+                    invoice=invoice,
+                    commodity=commodity,
+                    description=str(course),
+                    unit_price=registration.initial_price,
+                    discount=registration.discount,
+                    vat=registration.vat,
+                )
+                for invoice, registration in zip(invoices, registrations, strict=True)
+            ],
+            batch_size=INVOICE_BATCH_SIZE,
+        )
+        for registration, item in zip(registrations, items, strict=True):
+            registration.invoice_item = item
+        Registration.objects.bulk_update(registrations, ["invoice_item"], batch_size=INVOICE_BATCH_SIZE)
+    return invoices
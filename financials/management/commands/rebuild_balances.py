@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from financials.balances import rebuild_balances
+
+
+class Command(BaseCommand):
+    help = "Recompute materialized account balances and daily snapshots from transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", type=int, action="append", dest="accounts", help="Only rebuild this account id")
+
+    def handle(self, *args, **options):
+        drifted = rebuild_balances(options["accounts"])
+        for account_id, (old, new) in drifted.items():
+            self.stdout.write(f"Account {account_id}: {old:,} -> {new:,}")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt balances, {len(drifted)} account(s) corrected"))
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from financials.models import FinancialAccount
+from financials.payping import PAYPING_TRANSACTION_TYPE_RECIEVE, PAYPING_TRANSACTION_TYPE_SEND, PaypingClient, sync_payping
+
+
+def _parse_date(value):
+    return timezone.make_aware(datetime.fromisoformat(value))
+
+
+class Command(BaseCommand):
+    help = "Fetch new PayPing report rows since the last sync and record them as transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", default="پی‌پینگ", help="Financial account name")
+        parser.add_argument("--send", action="store_true", help="Sync withdrawals instead of received payments")
+        parser.add_argument("--from", dest="from_date", type=_parse_date, help="Backfill from this date; the stored high-water mark is left alone")
+        parser.add_argument("--to", dest="to_date", type=_parse_date)
+        parser.add_argument("--fee", type=int)
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent page requests")
+
+    def handle(self, *args, **options):
+        try:
+            account = FinancialAccount.objects.get(name=options["account"])
+        except FinancialAccount.DoesNotExist as e:
+            raise CommandError(f"Financial account {options['account']!r} does not exist") from e
+        transaction_type = PAYPING_TRANSACTION_TYPE_SEND if options["send"] else PAYPING_TRANSACTION_TYPE_RECIEVE
+        client = PaypingClient(workers=options["workers"])
+        try:
+            created = sync_payping(
+                account,
+                transaction_type=transaction_type,
+                fee=options["fee"],
+                from_date=options["from_date"],
+                to_date=options["to_date"],
+                client=client,
+            )
+        finally:
+            client.close()
+        self.stdout.write(self.style.SUCCESS(f"Created {created} transactions for {account}"))
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:51
+
+import django.db.models.deletion
+import django_jalali.db.models
+import jdatetime
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_balances(apps, schema_editor):
+    FinancialAccount = apps.get_model("financials", "FinancialAccount")
+    AccountDailyBalance = apps.get_model("financials", "AccountDailyBalance")
+    Transaction = apps.get_model("financials", "Transaction")
+    signed = models.Case(
+        models.When(transaction_type=1, then=models.F("net_amount")),
+        default=-models.F("net_amount"),
+        output_field=models.BigIntegerField(),
+    )
+    rows = (
+        Transaction.objects.annotate(day=TruncDate("transaction_date", tzinfo=timezone.get_current_timezone()))
+        .order_by("account_id", "day")
+        .values("account_id", "day")
+        .annotate(net=models.Sum(signed))
+    )
+    running = {}
+    snapshots = []
+    for row in rows:
+        balance = running.get(row["account_id"], 0) + (row["net"] or 0)
+        running[row["account_id"]] = balance
+        day = jdatetime.date.fromgregorian(date=row["day"])
+        snapshots.append(AccountDailyBalance(account_id=row["account_id"], date=day, net_change=row["net"] or 0, balance=balance))
+    AccountDailyBalance.objects.bulk_create(snapshots, batch_size=1000)
+    for account_id, balance in running.items():
+        FinancialAccount.objects.filter(pk=account_id).update(current_balance=balance)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financials', '0017_alter_coursetransaction_transaction_date_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='financialaccount',
+            name='current_balance',
+            field=models.BigIntegerField(default=0, editable=False, help_text='مانده (به\u200cروزرسانی خودکار)'),
+        ),
+        migrations.CreateModel(
+            name='AccountDailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', django_jalali.db.models.jDateField()),
+                ('net_change', models.BigIntegerField(default=0)),
+                ('balance', models.BigIntegerField(default=0, help_text='مانده پایان روز')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='financials.financialaccount')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='unique_account_daily_balance')],
+            },
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
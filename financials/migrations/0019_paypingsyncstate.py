@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financials', '0018_account_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaypingSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.IntegerField(choices=[(6, 'دریافت'), (7, 'برداشت')], default=6)),
+                ('synced_until', models.DateTimeField(blank=True, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('last_fetched', models.PositiveIntegerField(default=0)),
+                ('last_created', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payping_sync_states', to='financials.financialaccount')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'transaction_type'), name='unique_payping_sync_state')],
+            },
+        ),
+    ]
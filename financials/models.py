@@ -2,10 +2,13 @@ from django.core.validators import MinValueValidator
 from django.db import models
 from django_jalali.db import models as jmodels
 
-from commons.models import TimeStampedModel
+from commons.models import TimeStampedModel, TrackedFieldsMixin
+from commons.recalc import mark_dirty
 from commons.utils import get_jdatetime_now_with_timezone
 from courses.models import Course
 
+from .aggregates import SignedSumQuerySet, signed_sum, sum_subquery
+
 ASSET_TYPE_CHOICES = [
     (1, "ریال"),
     (2, "صندوق درآمد ثابت"),
@@ -14,19 +17,49 @@ ASSET_TYPE_CHOICES = [
 ]
 
 
+class FinancialAccountQuerySet(models.QuerySet):
+    def with_balance(self):
+        """Annotates ``computed_balance`` straight from the transactions, e.g. for reconciliation."""
+        return self.annotate(
+            computed_balance=sum_subquery(Transaction.objects.all(), signed_sum("net_amount"), "account"),
+        )
+
+
 class FinancialAccount(TimeStampedModel):
     name = models.CharField(max_length=100, unique=True)
     course = models.ManyToManyField(Course, related_name="financial_accounts", blank=True)
     description = models.TextField(blank=True, default="")
     asset_type = models.IntegerField(choices=ASSET_TYPE_CHOICES, default=1, help_text="نوع دارایی")
+    current_balance = models.BigIntegerField(default=0, editable=False, help_text="مانده (به‌روزرسانی خودکار)")
+
+    objects = FinancialAccountQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
     def balance(self):
-        return (self.transactions.filter(transaction_type=1).aggregate(total=models.Sum("net_amount"))["total"] or 0) - (
-            self.transactions.filter(transaction_type=2).aggregate(total=models.Sum("net_amount"))["total"] or 0
-        )
+        return self.current_balance
+
+    def balance_at(self, day):
+        """Closing balance of the given Jalali date (or datetime), from the daily snapshots."""
+        from .balances import to_jalali_day
+
+        snapshot = self.daily_balances.filter(date__lte=to_jalali_day(day)).order_by("-date").values_list("balance", flat=True)
+        return snapshot.first() or 0
+
+
+class AccountDailyBalance(models.Model):
+    account = models.ForeignKey(FinancialAccount, on_delete=models.CASCADE, related_name="daily_balances")
+    date = jmodels.jDateField()
+    net_change = models.BigIntegerField(default=0)
+    balance = models.BigIntegerField(default=0, help_text="مانده پایان روز")
+
+    class Meta:
+        ordering = ["-date"]
+        constraints = [models.UniqueConstraint(fields=["account", "date"], name="unique_account_daily_balance")]
+
+    def __str__(self):
+        return f"{self.account_id}-{self.date}-{self.balance}"
 
 
 class Commodity(TimeStampedModel):
@@ -62,6 +95,14 @@ class Customer(TimeStampedModel):
 INVOICE_TYPE_CHOICES = [(1, "خرید"), (2, "فروش")]
 
 
+class InvoiceQuerySet(models.QuerySet):
+    def with_balance(self):
+        return self.annotate(
+            paid_total=sum_subquery(Transaction.objects.all(), models.Sum("amount"), "invoice"),
+            computed_balance=models.F("paid_total") - models.F("total_amount"),
+        )
+
+
 class Invoice(TimeStampedModel):
     organization = models.IntegerField(choices=[(1, "Neshaa"), (2, "azno")], default=1)
     type = models.IntegerField(choices=INVOICE_TYPE_CHOICES)
@@ -75,6 +116,8 @@ class Invoice(TimeStampedModel):
     is_paid = models.BooleanField(default=False)
     description = models.TextField(blank=True, default="")
 
+    objects = InvoiceQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if self.pk:
             self.update_items_amount()
@@ -89,15 +132,44 @@ class Invoice(TimeStampedModel):
     def update_total_amount(self):
         self.total_amount = self.items_amount - self.discount + self.vat
 
+    @classmethod
+    def recalculate_totals(cls, ids):
+        invoices = list(
+            cls.objects.filter(pk__in=ids)
+            .annotate(items_total=sum_subquery(InvoiceItem.objects.all(), models.Sum("total_price"), "invoice"))
+            .only("id", "items_amount", "discount", "vat", "total_amount")
+        )
+        changed = []
+        for invoice in invoices:
+            old = (invoice.items_amount, invoice.total_amount)
+            invoice.items_amount = invoice.items_total
+            invoice.update_total_amount()
+            if (invoice.items_amount, invoice.total_amount) != old:
+                changed.append(invoice)
+        cls.objects.bulk_update(changed, ["items_amount", "total_amount"])
+
     @property
     def balance(self):
-        from django.db.models import Sum
-
-        total = self.transactions.aggregate(total=Sum("amount")).get("total") or 0
+        total = getattr(self, "paid_total", None)
+        if total is None:
+            total = self.transactions.aggregate(total=models.Sum("amount")).get("total") or 0
         return total - self.total_amount
 
 
-class InvoiceItem(TimeStampedModel):
+class InvoiceItemQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        """Fills ``total_price`` and updates every touched invoice once, on commit."""
+        objs = list(objs)
+        for item in objs:
+            item.update_total_price()
+        result = super().bulk_create(objs, *args, **kwargs)
+        mark_dirty(Invoice, *{item.invoice_id for item in objs})
+        return result
+
+
+class InvoiceItem(TrackedFieldsMixin, TimeStampedModel):
+    tracked_fields = ["invoice_id"]
+
     invoice = models.ForeignKey(Invoice, related_name="items", on_delete=models.CASCADE)
     commodity = models.ForeignKey(Commodity, on_delete=models.CASCADE)
     description = models.CharField(max_length=200, blank=True, default="")
@@ -107,19 +179,17 @@ class InvoiceItem(TimeStampedModel):
     vat = models.PositiveIntegerField(default=0)
     total_price = models.PositiveBigIntegerField(blank=True, default=0)
 
+    objects = InvoiceItemQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
-        self.total_price = max((self.unit_price * self.quantity) - self.discount + self.vat, 0)
+        self.update_total_price()
         result = super().save(*args, **kwargs)
-        if self.invoice:
-            self.invoice.save()
+        mark_dirty(Invoice, self.invoice_id, self.get_loaded_value("invoice_id"))
+        self.reset_loaded_values()
         return result
 
-    def delete(self, *args, **kwargs):
-        invoice = self.invoice
-        result = super().delete(*args, **kwargs)
-        if invoice:
-            invoice.save()
-        return result
+    def update_total_price(self):
+        self.total_price = max((self.unit_price * self.quantity) - self.discount + self.vat, 0)
 
 
 TRANSACTION_TYPE_CHOICES = [(1, "دریافت"), (2, "برداشت")]
@@ -148,7 +218,9 @@ TRANSACTION_CATEGORY_CHOICES = [
 ]
 
 
-class Transaction(TimeStampedModel):
+class Transaction(TrackedFieldsMixin, TimeStampedModel):
+    tracked_fields = ["account_id", "transaction_type", "transaction_date", "net_amount"]
+
     invoice = models.ForeignKey(Invoice, null=True, blank=True, on_delete=models.SET_NULL, related_name="transactions")
     account = models.ForeignKey(FinancialAccount, on_delete=models.CASCADE, related_name="transactions")
     course = models.ForeignKey(Course, null=True, blank=True, on_delete=models.SET_NULL)
@@ -166,12 +238,17 @@ class Transaction(TimeStampedModel):
     )
     description = models.TextField(blank=True, default="")
 
+    objects = SignedSumQuerySet.as_manager()
+
     def save(self, *args, **kwargs) -> None:
+        self.update_net_amount()
+        return super().save(*args, **kwargs)
+
+    def update_net_amount(self):
         if self.transaction_type == 1:
             self.net_amount = self.amount - self.fee
         else:
             self.net_amount = self.amount + self.fee
-        return super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.id}-{self.amount}-{self.account.name}-{self.get_transaction_type_display()}-{self.get_transaction_category_display()}"
@@ -208,8 +285,25 @@ COURSE_TRANSACTION_CATEGORY_CHOICES = [
 FIXED_COST_CATEGORY = [1, 2, 3, 4, 5, 6]
 VARIABLE_COST_CATEGORY = [7, 8, 9]
 
+COURSE_TO_TRANSACTION_CATEGORY = {
+    COST_CATEGORY_HOTEL: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_EXECUTIVE_CATERING: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_EXECUTIVE_TRANSPORTATION: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_EQUIPMENT: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_SERVICE_PERSONNEL: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_EXECUTIVE_COMPENSATION: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_STATIONERY: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_CATERING: TRANSACTION_CATEGORY_COURSE_COST,
+    COST_CATEGORY_CHARGING_CREDIT: TRANSACTION_CATEGORY_CREDIT,
+    INCOME_CATEGORY_REGISTRATION: TRANSACTION_CATEGORY_COURSE_REGISTRATION,
+    INCOME_CATEGORY_INSTULLMENT: TRANSACTION_CATEGORY_COURSE_INSTULMENT,
+    COURSE_TRANSACTION_CATEGORY_PETTY_CASH: TRANSACTION_CATEGORY_PETTY_CASH,
+}
+
+
+class CourseTransaction(TrackedFieldsMixin, TimeStampedModel):
+    tracked_fields = ["registration_id", "transaction_type", "amount"]
 
-class CourseTransaction(TimeStampedModel):
     title = models.CharField(max_length=200, blank=True, default="")
     transaction_type = models.IntegerField(choices=TRANSACTION_TYPE_CHOICES, default=1)
     transaction_category = models.IntegerField(choices=COURSE_TRANSACTION_CATEGORY_CHOICES, default=10)
@@ -235,12 +329,17 @@ class CourseTransaction(TimeStampedModel):
     )
     description = models.TextField(blank=True, default="")
 
+    objects = SignedSumQuerySet.as_manager()
+
     def save(self, *args, **kwargs) -> None:
+        self.update_net_amount()
+        return super().save(*args, **kwargs)
+
+    def update_net_amount(self):
         if self.transaction_type == 1:
             self.net_amount = self.amount - self.fee
         else:
             self.net_amount = self.amount + self.fee
-        return super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.id}-{self.amount}-{self.title}-{self.get_transaction_type_display()}-{self.get_transaction_category_display()}-{self.course.course_name}"
@@ -248,34 +347,43 @@ class CourseTransaction(TimeStampedModel):
     def create_transaction(self, entry_user=None) -> Transaction:
         if self.transaction is not None:
             return None
-        transaction_category_mapping = {
-            1: 2,
-            2: 2,
-            3: 2,
-            4: 2,
-            5: 2,
-            6: 2,
-            7: 2,
-            8: 2,
-            9: 4,
-            10: 1,
-            11: 3,
-            12: 9,
-        }
-
-        transaction_category = transaction_category_mapping.get(self.transaction_category, 1)
-        transaction = Transaction.objects.create(
-            account=self.financial_account,
-            course=self.course,
+        transaction = self.build_transaction(entry_user=entry_user)
+        transaction.save()
+        return transaction
+
+    def build_transaction(self, entry_user=None) -> Transaction:
+        transaction_category = COURSE_TO_TRANSACTION_CATEGORY.get(self.transaction_category, 1)
+        transaction = Transaction(
+            account_id=self.financial_account_id,
+            course_id=self.course_id,
             transaction_type=self.transaction_type,
             transaction_category=transaction_category,
             transaction_date=self.transaction_date,
             amount=self.amount,
             fee=self.fee,
-            user_account=self.user_account,
+            user_account_id=self.user_account_id,
             tracking_code=self.tracking_code,
-            entry_user=entry_user or self.entry_user,
+            entry_user_id=entry_user.pk if entry_user else self.entry_user_id,
             description=f"CT #{self.id}",
         )
-
+        transaction.update_net_amount()
         return transaction
+
+
+class PaypingSyncState(models.Model):
+    """High-water mark of the PayPing report sync, per account and report type."""
+
+    account = models.ForeignKey(FinancialAccount, on_delete=models.CASCADE, related_name="payping_sync_states")
+    transaction_type = models.IntegerField(choices=[(6, "دریافت"), (7, "برداشت")], default=6)
+    synced_until = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_fetched = models.PositiveIntegerField(default=0)
+    last_created = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["account", "transaction_type"], name="unique_payping_sync_state"),
+        ]
+
+    def __str__(self):
+        return f"{self.account} ({self.get_transaction_type_display()}) until {self.synced_until}"
@@ -0,0 +1,226 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from commons.utils import normalize_phone
+from users.models import CrmUser, User
+
+from .balances import apply_transactions
+from .models import PaypingSyncState, Transaction
+
+logger = logging.getLogger(__name__)
+
+PAYPING_TRANSACTION_TYPE_RECIEVE = 6
+PAYPING_TRANSACTION_TYPE_SEND = 7
+PAYPING_BATCH_SIZE = 500
+
+PAYPING_REPORT_PATHS = {
+    PAYPING_TRANSACTION_TYPE_RECIEVE: "report/TransactionReport",
+    PAYPING_TRANSACTION_TYPE_SEND: "report/WithdrawTransactions",
+}
+
+
+def _utc(value):
+    return value.astimezone(UTC) if timezone.is_aware(value) else value
+
+
+class PaypingClient:
+    """
+    PayPing report client over one pooled HTTP session. The report API returns plain
+    pages with no total, so pages are requested ``workers`` at a time and yielded in
+    offset order until a short page marks the end.
+    """
+
+    def __init__(self, token=None, base_url=None, page_size=50, workers=4, timeout=30):
+        self.base_url = (base_url or settings.PAYPING_API_URL).rstrip("/")
+        self.page_size = page_size
+        self.workers = workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(
+            {"Authorization": f"Bearer {token or settings.PAYPING_TOKEN}", "Content-Type": "application/json"}
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def fetch_page(self, from_date, to_date, transaction_type, offset):
+        response = self.session.post(
+            f"{self.base_url}/{PAYPING_REPORT_PATHS[transaction_type]}",
+            json={
+                "offset": offset,
+                "limit": self.page_size,
+                "transactionType": 13 - transaction_type,
+                "fromDate": _utc(from_date).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "toDate": _utc(to_date).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            },
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def iter_pages(self, from_date, to_date, transaction_type=PAYPING_TRANSACTION_TYPE_RECIEVE):
+        offset = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                offsets = [offset + index * self.page_size for index in range(self.workers)]
+                futures = [
+                    executor.submit(self.fetch_page, from_date, to_date, transaction_type, page_offset) for page_offset in offsets
+                ]
+                for future in futures:
+                    page = future.result()
+                    if page:
+                        yield page
+                    if len(page) < self.page_size:
+                        for pending in futures:
+                            pending.cancel()
+                        return
+                offset = offsets[-1] + self.page_size
+
+
+def prepare_rows(page, invoice_prefix=None, skip_descriptions=None):
+    """Applies the account conventions (invoice number prefix, ignored descriptions) to a page."""
+    invoice_prefix = settings.PAYPING_INVOICE_PREFIX if invoice_prefix is None else invoice_prefix
+    skip_descriptions = settings.PAYPING_SKIP_DESCRIPTIONS if skip_descriptions is None else skip_descriptions
+    rows = []
+    for row in page:
+        if row.get("description") in skip_descriptions:
+            continue
+        rows.append({**row, "invoiceNo": f"{invoice_prefix}{row['invoiceNo']}"})
+    return rows
+
+
+def parse_row(row):
+    """The transaction fields of one PayPing report row, or None for unpaid/empty rows."""
+    amount = row["amount"]
+    if row["isPaid"] is False or amount <= 0:
+        return None
+    name = row["name"]
+    date = datetime.strptime(row["payDate"], "%Y-%m-%dT%H:%M:%S.%f")
+    return {
+        "amount": amount,
+        "description": f"{name if name else ''}\n{row['description']}\n{row['cardNo']}\n{row['code']}".strip(),
+        "transaction_date": timezone.make_aware(date).replace(microsecond=0),
+        "phone_number": normalize_phone(row["payerIdentity"]),
+        "tracking_code": row["invoiceNo"],
+    }
+
+
+def _resolve_users(phones):
+    """Maps each phone to a user id, creating the missing users (and their CRM records) with bulk inserts."""
+    if not phones:
+        return {}
+    users = {}
+    for user_id, phone_number, username in (
+        User.objects.filter(Q(phone_number__in=phones) | Q(username__in=phones))
+        .order_by("pk")
+        .values_list("id", "phone_number", "username")
+    ):
+        for key in (str(phone_number) if phone_number else None, username):
+            if key in phones:
+                users.setdefault(key, user_id)
+    missing = User.objects.bulk_create(
+        [User(username=phone, phone_number=phone) for phone in sorted(phones - users.keys())], batch_size=PAYPING_BATCH_SIZE
+    )
+    # bulk_create skips User.save(), which is what creates the CRM record
+    CrmUser.objects.bulk_create([CrmUser(user=user) for user in missing], batch_size=PAYPING_BATCH_SIZE)
+    for user in missing:
+        users[user.username] = user.pk
+    return users
+
+
+@transaction.atomic
+def reconcile_page(rows, account, fee, transaction_type=1):
+    """
+    Records a page of PayPing report rows: existing rows (same tracking code and time) are
+    skipped through one indexed lookup, payers are resolved with one query, missing users
+    and the new transactions are each inserted with a single bulk insert.
+    Returns the number of created transactions.
+    """
+    parsed = [data for data in map(parse_row, rows) if data is not None]
+    if not parsed:
+        return 0
+    existing = {
+        (code, timezone.localtime(date.togregorian()).replace(microsecond=0))
+        for code, date in Transaction.objects.filter(
+            account=account, tracking_code__in={data["tracking_code"] for data in parsed}
+        ).values_list("tracking_code", "transaction_date")
+    }
+    new_rows = []
+    for data in parsed:
+        key = (data["tracking_code"], timezone.localtime(data["transaction_date"]))
+        if key not in existing:
+            existing.add(key)
+            new_rows.append(data)
+    if not new_rows:
+        return 0
+
+    users = _resolve_users({data["phone_number"] for data in new_rows if data["phone_number"]})
+    transactions = []
+    for data in new_rows:
+        ledger_transaction = Transaction(
+            account=account,
+            user_account_id=users.get(data["phone_number"]),
+            transaction_date=data["transaction_date"],
+            amount=data["amount"],
+            description=data["description"],
+            tracking_code=data["tracking_code"],
+            transaction_type=transaction_type,
+            transaction_category=1,
+            fee=fee,
+        )
+        ledger_transaction.update_net_amount()
+        transactions.append(ledger_transaction)
+    Transaction.objects.bulk_create(transactions, batch_size=PAYPING_BATCH_SIZE)
+    apply_transactions(transactions)
+    return len(transactions)
+
+
+def sync_payping(account, transaction_type=PAYPING_TRANSACTION_TYPE_RECIEVE, fee=None, from_date=None, to_date=None, client=None):
+    """
+    Fetches PayPing report pages newer than the stored high-water mark of ``account`` and
+    saves each page as it arrives. Returns the number of created transactions.
+
+    An explicit ``from_date`` is a backfill of that range: it leaves the sync state alone.
+    """
+    state, _ = PaypingSyncState.objects.get_or_create(account=account, transaction_type=transaction_type)
+    to_date = to_date or timezone.now()
+    backfill = from_date is not None
+    if not backfill:
+        if state.synced_until is not None:
+            from_date = state.synced_until - timedelta(minutes=settings.PAYPING_SYNC_OVERLAP_MINUTES)
+        else:
+            from_date = to_date - timedelta(days=settings.PAYPING_SYNC_INITIAL_DAYS)
+    fee = settings.PAYPING_FEE if fee is None else fee
+    ledger_type = 1 if transaction_type == PAYPING_TRANSACTION_TYPE_RECIEVE else 2
+
+    own_client = client is None
+    client = client or PaypingClient()
+    created = fetched = 0
+    try:
+        for page in client.iter_pages(from_date, to_date, transaction_type):
+            fetched += len(page)
+            created += reconcile_page(prepare_rows(page), account, fee, ledger_type)
+    finally:
+        if own_client:
+            client.close()
+
+    logger.info("PayPing sync for %s fetched %s rows, created %s transactions", account, fetched, created)
+    if backfill:
+        return created
+    state.synced_until = to_date if state.synced_until is None else max(state.synced_until, to_date)
+    state.last_run_at = timezone.now()
+    state.last_fetched = fetched
+    state.last_created = created
+    state.save(update_fields=["synced_until", "last_run_at", "last_fetched", "last_created"])
+    return created
@@ -1,18 +1,49 @@
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import CourseTransaction
+from commons.recalc import mark_dirty, register_recalculator
+from courses.models import Registration
+
+from .balances import apply_transaction_delete, apply_transaction_save
+from .models import CourseTransaction, Invoice, InvoiceItem, Transaction
+
+register_recalculator(Invoice, Invoice.recalculate_totals)
 
 
 @receiver(post_save, sender=CourseTransaction)
-def course_transaction_post_save(sender, instance, **kwargs):
-    if not instance.pk:
+def course_transaction_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
         return
-    if instance.registration:
-        instance.registration.save()
+    loaded = {field: instance.get_loaded_value(field) for field in instance.tracked_fields}
+    if created or loaded != {field: getattr(instance, field) for field in instance.tracked_fields}:
+        mark_dirty(Registration, instance.registration_id, loaded["registration_id"])
+    instance.reset_loaded_values()
 
 
 @receiver(post_delete, sender=CourseTransaction)
 def course_transaction_post_delete(sender, instance, **kwargs):
-    if instance.registration:
-        instance.registration.save()
+    mark_dirty(Registration, instance.registration_id)
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def invoice_item_post_delete(sender, instance, **kwargs):
+    mark_dirty(Invoice, instance.invoice_id)
+
+
+@receiver(pre_save, sender=Transaction)
+def transaction_pre_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # the balance update subtracts the stored amount, which must be known before it is overwritten
+        instance.load_stored_values()
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    apply_transaction_save(instance, created)
+
+
+@receiver(post_delete, sender=Transaction)
+def transaction_post_delete(sender, instance, **kwargs):
+    apply_transaction_delete(instance)
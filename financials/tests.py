@@ -1 +1,284 @@
-# Create your tests here.
+import json
+import threading
+from datetime import UTC, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from jdatetime import date as jdate
+
+from commons.utils import get_jdatetime_now_with_timezone
+from courses.models import Course, CourseType, Registration
+from users.models import CrmUser, User
+
+from .balances import rebuild_balances, to_jalali_day
+from .invoices import create_course_invoices
+from .models import (
+    AccountDailyBalance,
+    Commodity,
+    CourseTransaction,
+    FinancialAccount,
+    Invoice,
+    InvoiceItem,
+    PaypingSyncState,
+    Transaction,
+)
+from .payping import PaypingClient, prepare_rows, reconcile_page, sync_payping
+
+
+class AccountBalanceTest(TestCase):
+    def setUp(self):
+        self.account = FinancialAccount.objects.create(name="پی‌پینگ")
+        self.other = FinancialAccount.objects.create(name="صندوق")
+        self.today = get_jdatetime_now_with_timezone()
+        self.yesterday = self.today - timedelta(days=1)
+
+    def _transaction(self, amount, transaction_type=1, when=None, account=None, fee=0):
+        return Transaction.objects.create(
+            account=account or self.account,
+            transaction_type=transaction_type,
+            transaction_date=when or self.today,
+            amount=amount,
+            fee=fee,
+        )
+
+    def _snapshots(self, account=None):
+        return list(
+            AccountDailyBalance.objects.filter(account=account or self.account)
+            .order_by("date")
+            .values_list("net_change", "balance")
+        )
+
+    def test_incremental_updates(self):
+        self._transaction(1000, fee=100)
+        self._transaction(300, transaction_type=2)
+        late = self._transaction(500, when=self.yesterday)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance(), 1100)
+        self.assertEqual(self._snapshots(), [(500, 500), (600, 1100)])
+        self.assertEqual(self.account.balance_at(to_jalali_day(self.yesterday)), 500)
+        self.assertEqual(self.account.balance_at(jdate(1300, 1, 1)), 0)
+
+        late = Transaction.objects.get(pk=late.pk)
+        late.amount = 200
+        late.transaction_date = self.today
+        late.save()
+        self.assertEqual(self._snapshots(), [(0, 0), (800, 800)])
+
+        late.account = self.other
+        late.save()
+        late.delete()
+        self.account.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.account.current_balance, self.other.current_balance), (600, 0))
+        self.assertEqual(self._snapshots(), [(0, 0), (600, 600)])
+
+    def test_update_without_loaded_values_replaces_the_stored_amount(self):
+        stored = self._transaction(1000)
+        partial = Transaction.objects.only("pk", "amount", "fee").get(pk=stored.pk)
+        partial.amount = 700
+        partial.save()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.current_balance, 700)
+
+        Transaction(
+            pk=stored.pk, _created_at=stored._created_at, account=self.account, transaction_date=self.today, amount=300
+        ).save()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.current_balance, 300)
+        self.assertEqual(self._snapshots(), [(300, 300)])
+
+    def test_rebuild_corrects_drift(self):
+        self._transaction(1000, when=self.yesterday)
+        self._transaction(400, transaction_type=2)
+        self.assertEqual(rebuild_balances(), {})
+
+        FinancialAccount.objects.filter(pk=self.account.pk).update(current_balance=5)
+        AccountDailyBalance.objects.all().delete()
+        call_command("rebuild_balances", "--account", str(self.account.pk), stdout=StringIO())
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.current_balance, 600)
+        self.assertEqual(self._snapshots(), [(1000, 1000), (-400, 600)])
+
+
+class SignedAggregateTest(TestCase):
+    def setUp(self):
+        self.account = FinancialAccount.objects.create(name="پی‌پینگ")
+        course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        self.course = Course.objects.create(course_type=course_type, course_name="Test Course", number=1)
+        self.registrations = [
+            Registration.objects.create(user=User.objects.create(username=f"user{i}"), course=self.course) for i in range(3)
+        ]
+        for registration in self.registrations:
+            for transaction_type, amount in ((1, 700), (1, 500), (2, 200)):
+                CourseTransaction.objects.create(
+                    course=self.course,
+                    registration=registration,
+                    financial_account=self.account,
+                    transaction_type=transaction_type,
+                    amount=amount,
+                )
+
+    def test_with_paid_amount_single_query(self):
+        with self.assertNumQueries(1):
+            totals = list(Registration.objects.with_paid_amount().values_list("paid_amount_total", flat=True))
+        self.assertEqual(totals, [1000, 1000, 1000])
+        self.assertEqual(self.registrations[0]._paid_amount(), 1000)
+        self.assertEqual(CourseTransaction.objects.filter(transaction_type=2).signed_total(), -600)
+
+    def test_with_balance(self):
+        invoice = Invoice.objects.create(type=2, date=jdate.today())
+        Invoice.objects.filter(pk=invoice.pk).update(total_amount=1000)
+        Transaction.objects.create(account=self.account, invoice=invoice, amount=400, fee=10)
+        Transaction.objects.create(account=self.account, transaction_type=2, amount=100)
+
+        with self.assertNumQueries(1):
+            account = FinancialAccount.objects.with_balance().get(pk=self.account.pk)
+        self.assertEqual(account.computed_balance, account.current_balance)
+        self.assertEqual(account.computed_balance, 290)
+
+        with self.assertNumQueries(1):
+            invoice = Invoice.objects.with_balance().get(pk=invoice.pk)
+            self.assertEqual((invoice.computed_balance, invoice.balance), (-600, -600))
+
+
+class InvoiceTotalsTest(TestCase):
+    def setUp(self):
+        self.commodity = Commodity.objects.create(name="ثبت‌نام دوره")
+        self.invoice = Invoice.objects.create(type=2, date=jdate.today())
+        Invoice.objects.filter(pk=self.invoice.pk).update(discount=100)
+
+    def _item(self, unit_price, quantity=1, invoice=None):
+        return InvoiceItem(invoice=invoice or self.invoice, commodity=self.commodity, unit_price=unit_price, quantity=quantity)
+
+    def test_items_recalculate_invoice_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for price in (100, 200, 300):
+                self._item(price, quantity=2).save()
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.items_amount, self.invoice.total_amount), (1200, 1100))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            InvoiceItem.objects.bulk_create([self._item(50) for _ in range(4)])
+            InvoiceItem.objects.filter(unit_price=300).delete()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.items_amount, 800)
+
+    def test_create_course_invoices(self):
+        course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره تست", category=1)
+        course = Course.objects.create(course_type=course_type, course_name="Test Course", number=1)
+        for i in range(5):
+            Registration.objects.create(
+                user=User.objects.create(username=f"user{i}"), course=course, initial_price=1000, discount=100 * i
+            )
+
+        with self.assertNumQueries(8):
+            invoices = create_course_invoices(course, self.commodity)
+
+        self.assertEqual(len(invoices), 5)
+        totals = sorted(Invoice.objects.filter(course=course).values_list("total_amount", flat=True))
+        self.assertEqual(totals, [600, 700, 800, 900, 1000])
+        self.assertFalse(Registration.objects.filter(course=course, invoice_item__isnull=True).exists())
+        self.assertEqual(create_course_invoices(course, self.commodity), [])
+
+
+class _PaypingStub(BaseHTTPRequestHandler):
+    rows = []
+    requests = []
+
+    def do_POST(self):  # noqa: N802
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).requests.append(body)
+        page = self.rows[body["offset"] : body["offset"] + body["limit"]]
+        payload = json.dumps(page).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class PaypingSyncTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _PaypingStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.account = FinancialAccount.objects.create(name="پی‌پینگ")
+        _PaypingStub.requests = []
+        _PaypingStub.rows = [
+            {
+                "amount": 1000 + i,
+                "isPaid": i != 5,
+                "name": f"payer {i}",
+                "description": "باشگاه امکان" if i == 7 else "",
+                "cardNo": "",
+                "code": str(i),
+                "payDate": f"2025-06-01T10:{i % 60:02d}:00.000",
+                "payerIdentity": f"0912{i % 20:07d}",
+                "invoiceNo": 5000 + i,
+            }
+            for i in range(130)
+        ]
+
+    def _client(self):
+        host, port = self.server.server_address
+        return PaypingClient(base_url=f"http://{host}:{port}/v1", page_size=20, workers=3)
+
+    def test_sync_fetches_all_pages_and_keeps_high_water_mark(self):
+        to_date = timezone.now()
+        created = sync_payping(self.account, fee=100, to_date=to_date, client=self._client())
+
+        self.assertEqual(created, 128)
+        self.assertEqual(sorted(request["offset"] for request in _PaypingStub.requests)[:7], [0, 20, 40, 60, 80, 100, 120])
+        transaction = Transaction.objects.get(tracking_code="PP-5000")
+        self.assertEqual((transaction.amount, transaction.net_amount), (1000, 900))
+        self.assertEqual(User.objects.filter(phone_number="+989120000000").count(), 1)
+        state = PaypingSyncState.objects.get(account=self.account)
+        self.assertEqual((state.synced_until, state.last_fetched, state.last_created), (to_date, 130, 128))
+
+        _PaypingStub.requests = []
+        self.assertEqual(sync_payping(self.account, fee=100, client=self._client()), 0)
+        expected_from = (to_date - timedelta(minutes=60)).astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.assertEqual(_PaypingStub.requests[0]["fromDate"], expected_from)
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 128)
+
+    def test_backfill_and_older_runs_keep_the_high_water_mark(self):
+        to_date = timezone.now()
+        sync_payping(self.account, fee=100, to_date=to_date, client=self._client())
+
+        sync_payping(
+            self.account,
+            fee=100,
+            from_date=to_date - timedelta(days=90),
+            to_date=to_date - timedelta(days=60),
+            client=self._client(),
+        )
+        sync_payping(self.account, fee=100, to_date=to_date - timedelta(days=1), client=self._client())
+        state = PaypingSyncState.objects.get(account=self.account)
+        self.assertEqual((state.synced_until, state.last_created), (to_date, 0))
+
+    def test_reconcile_page_uses_constant_queries(self):
+        User.objects.create(username="+989120000001", phone_number="+989120000001")
+        rows = prepare_rows(_PaypingStub.rows[:40])
+        with self.assertNumQueries(15):
+            created = reconcile_page(rows, self.account, 100)
+        self.assertEqual(created, 38)
+        self.assertEqual(User.objects.filter(phone_number__startswith="+98912").count(), 20)
+        self.assertEqual(CrmUser.objects.filter(user__phone_number__startswith="+98912").count(), 20)
+        with self.assertNumQueries(3):
+            self.assertEqual(reconcile_page(rows, self.account, 100), 0)
@@ -10,6 +10,8 @@ TESTING = "test" in sys.argv or "PYTEST_VERSION" in os.environ
 ALLOWED_HOSTS = []
 
 PAYPING_TOKEN = os.getenv("PAYPING_TOKEN", "")
+PAYPING_API_URL = os.getenv("PAYPING_API_URL", "https://api.payping.ir/v1")
+ELANAK_API_URL = os.getenv("ELANAK_API_URL", "https://payammatni.com/webservice/url/send.php")
 ELANAK_USERNAME = os.getenv("ELANAK_USERNAME", "")
 ELANAK_PASSWORD = os.getenv("ELANAK_PASSWORD", "")
 ELANAK_LINE_NUMBERS = os.getenv("ELANAK_NUMBERS", "").split(",")
@@ -42,6 +44,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "commons.middleware.AuditBufferMiddleware",
 ]
 
 ROOT_URLCONF = "neshaa.urls"
@@ -100,6 +103,9 @@ STATICFILES_DIRS = [
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Generated exports, cached per data version
+EXPORT_CACHE_DIR = BASE_DIR / "export_cache"
+
 # Custom User Model
 AUTH_USER_MODEL = "users.User"
 
@@ -201,3 +207,27 @@ CSRF_TRUSTED_ORIGINS = [
 REGISTRATION_GROUP_NAME = "registration"
 SUPPORT_GROUP_NAME = "supporting"
 MANAGING_GROUP_NAME = "managing"
+
+# Audit log
+AUDIT_FLUSH_SIZE = 500
+AUDIT_LOG_MODE = "compact"  # "compact" keeps only changed keys, "full" keeps whole snapshots
+AUDIT_ARCHIVE_AFTER_DAYS = 180
+
+# Admin changelist counts
+ADMIN_COUNT_CACHE_TIMEOUT = 60  # seconds a filtered count is reused per user and filter set
+ADMIN_COUNT_ESTIMATE_MIN_ROWS = 10000  # smaller tables are counted exactly instead of estimated
+
+# PayPing sync
+PAYPING_FEE = 4500
+PAYPING_INVOICE_PREFIX = "PP-"
+PAYPING_SKIP_DESCRIPTIONS = ["باشگاه امکان"]
+PAYPING_SYNC_OVERLAP_MINUTES = 60
+PAYPING_SYNC_INITIAL_DAYS = 30
+
+# SMS outbox
+SMS_DISPATCH_WORKERS = 8
+SMS_LINE_RATE_PER_SECOND = 5  # provider throttles each sending line separately
+SMS_MAX_ATTEMPTS = 3
+SMS_RETRY_BACKOFF_SECONDS = 2
+SMS_STATUS_BATCH_SIZE = 200
+SMS_SENDING_LEASE_MINUTES = 15  # messages left in "sending" longer than this are claimed again
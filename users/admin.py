@@ -1,20 +1,49 @@
 import pandas as pd
 from dalf.admin import DALFModelAdmin, DALFRelatedFieldAjax
 from django import forms
-from django.conf import settings
 from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
-from django.http import HttpResponse
 from django.shortcuts import redirect, render
 from django.urls import path, reverse
 from django.utils.html import format_html
 from django_jalali.admin.filters import JDateFieldListFilter
 
-from commons.admin import DetailedLogAdminMixin
-from commons.utils import get_jdatetime_now_with_timezone, normalize_phone
+from commons.admin import DetailedLogAdminMixin, EstimatedCountAdminMixin
+from commons.exports import export_response
+from commons.forms import JalaliInitialFormMixin, PreloadedInlineFormSet
+from commons.normalization import normalize_phones
+from commons.permissions import get_permission_resolver
+from commons.utils import get_jdatetime_now_with_timezone
 from courses.admin import CourseTeamInline
 
-from .models import CrmLog, CrmUser, CrmUserLabel, Organization, User
+from .crm import (
+    REGISTERED_COURSE_STATUSES,
+    assign_supporters,
+    follow_up_queue,
+    format_assignment_report,
+    load_crm_details,
+    queue_entry,
+    queue_supporter_id,
+)
+from .dedup import merge_approved_duplicates
+from .exports import CRM_EXPORT
+from .merge import revert_merge
+from .models import (
+    DUPLICATE_STATUS_APPROVED,
+    DUPLICATE_STATUS_MERGED,
+    DUPLICATE_STATUS_REJECTED,
+    SMS_CAMPAIGN_STATUS_DRAFT,
+    SMS_CAMPAIGN_STATUS_PENDING,
+    CrmLog,
+    CrmUser,
+    CrmUserLabel,
+    DuplicateUserCandidate,
+    Organization,
+    SMSCampaign,
+    SMSLog,
+    User,
+    UserMergeLog,
+)
 from .permissions import ManagingGroupPermissionMixin, requires_managing_group_permission
 
 
@@ -132,13 +161,24 @@ class UserAdmin(DetailedLogAdminMixin, DjangoUserAdmin):
         return super().get_model_perms(request)
 
 
+class CrmLogInlineForm(JalaliInitialFormMixin, forms.ModelForm):
+    class Meta:
+        model = CrmLog
+        fields = "__all__"  # noqa
+
+
 class CrmLogInline(DetailedLogAdminMixin, admin.TabularInline):
     model = CrmLog
+    form = CrmLogInlineForm
+    formset = PreloadedInlineFormSet
     extra = 1
     fields = ("id", "description", "action", "date", "user", "_created_at")
     readonly_fields = ("user", "_created_at")
     show_change_link = True
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("user", "crm__user")
+
 
 class CrmUserAdminForm(forms.ModelForm):
     first_name = User._meta.get_field("first_name").formfield()
@@ -190,20 +230,38 @@ class CrmUserAdminForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        if self.instance:
+        self.changed_user_fields = []
+        if self.instance and self.instance.user_id:
+            # attnames, so foreign keys give their id instead of loading the related user
             for new_field in self.new_fields:
-                self.fields[new_field].initial = getattr(self.instance.user, new_field, None)
+                self.fields[new_field].initial = getattr(self.instance.user, User._meta.get_field(new_field).attname, None)
             for read_only_field in self.new_readonly_fields:
-                self.fields[read_only_field].initial = getattr(self.instance.user, read_only_field, None)
+                self.fields[read_only_field].initial = getattr(
+                    self.instance.user, User._meta.get_field(read_only_field).attname, None
+                )
                 self.fields[read_only_field].widget.attrs["readonly"] = True
 
     def save(self, commit=True):
         instance = super().save(commit=commit)
+        user = instance.user
+        self.changed_user_fields = []
         for new_field in self.new_fields:
-            setattr(instance.user, new_field, self.cleaned_data.get(new_field))
-        instance.user.save()
+            attname = User._meta.get_field(new_field).attname
+            value = self.cleaned_data.get(new_field)
+            value = getattr(value, "pk", value) if attname != new_field else value
+            if getattr(user, attname) != value:
+                setattr(user, attname, value)
+                self.changed_user_fields.append(attname)
+        if commit:
+            self.save_user()
         return instance
 
+    def save_user(self):
+        """Writes only the user fields that changed; the admin calls it once the whole form is valid."""
+        if self.changed_user_fields:
+            self.instance.user.save(update_fields=[*self.changed_user_fields, "_updated_at"])
+            self.changed_user_fields = []
+
 
 class CrmUserLabelSetForm(forms.Form):
     excel_file = forms.FileField(
@@ -216,6 +274,22 @@ class CrmUserLabelAdmin(ManagingGroupPermissionMixin, admin.ModelAdmin):
     list_display = ("id", "name")
     search_fields = ("name",)
     ordering = ["id"]
+    actions = ["assign_supporters"]
+
+    @admin.action(description="Assign supporters to unassigned CRM users of selected labels")
+    def assign_supporters(self, request, queryset):
+        if not self.has_managing_group_permission(request):
+            self.message_user(request, "شما اجازه دسترسی به این عملیات را ندارید.", messages.ERROR)
+            return
+        try:
+            report = assign_supporters(CrmUser.objects.filter(crm_label__in=queryset).distinct())
+        except ValueError as e:
+            self.message_user(request, str(e), messages.ERROR)
+            return
+        assigned = sum(row["assigned"] for row in report)
+        self.message_user(
+            request, f"{assigned} CRM users assigned. " + " | ".join(format_assignment_report(report)), messages.SUCCESS
+        )
 
     def change_view(self, request, object_id, form_url="", extra_context=None):
         extra_context = extra_context or {}
@@ -229,7 +303,10 @@ class CrmUserLabelAdmin(ManagingGroupPermissionMixin, admin.ModelAdmin):
                 extra_context["show_export_crms"] = True
                 export_url = reverse("admin:user_export_crm_view", args=[object_id])
                 extra_context["export_button"] = format_html(
-                    '<a class="button" href="{}" style="display:inline-block;">Export CRMs</a>', export_url
+                    '<a class="button" href="{}" style="display:inline-block;">Export CRMs</a> '
+                    '<a class="button" href="{}?format=csv" style="display:inline-block;">CSV</a>',
+                    export_url,
+                    export_url,
                 )
         except CrmUserLabel.DoesNotExist:
             pass
@@ -256,31 +333,9 @@ class CrmUserLabelAdmin(ManagingGroupPermissionMixin, admin.ModelAdmin):
     def export_crms(self, request, label_id):
         try:
             crm_label = CrmUserLabel.objects.get(pk=label_id)
-            crms = CrmUser.objects.filter(crm_label=crm_label).select_related("user")
-            data = []
-            for crm in crms:
-                data.append(
-                    {
-                        "first name": crm.user.first_name,
-                        "last name": crm.user.last_name,
-                        "phone": getattr(crm.user, "phone_number", ""),
-                        "supporting user": crm.supporting_user.phone_number if crm.supporting_user else None,
-                        "supporting user name": f"{crm.supporting_user.first_name} {crm.supporting_user.last_name}"
-                        if crm.supporting_user
-                        else "",
-                    }
-                )
-            df = pd.DataFrame(data)
-            response = HttpResponse(content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            response["Content-Disposition"] = f'attachment; filename="{crm_label.name}.xlsx"'
-            from io import BytesIO
-
-            excel_buffer = BytesIO()
-            with pd.ExcelWriter(excel_buffer, engine="openpyxl") as writer:
-                df.to_excel(writer, index=False, sheet_name="data")
-            excel_buffer.seek(0)
-            response.write(excel_buffer.getvalue())
-
+            response = export_response(
+                CRM_EXPORT, CrmUser.objects.filter(crm_label=crm_label), crm_label.name, request.GET.get("format", "xlsx")
+            )
             messages.success(request, f"فایل اکسل یوزرهای  {crm_label.name} با موفقیت ایجاد شد.")
             return response
 
@@ -324,15 +379,18 @@ class CrmUserLabelAdmin(ManagingGroupPermissionMixin, admin.ModelAdmin):
                         return redirect(request.path)
                 support_map = {}
                 phones = []
-                for _, row in df.iterrows():
-                    user_phone = normalize_phone(row["user phone"])
+                user_phones = normalize_phones(df["user phone"])
+                support_phones = normalize_phones(df["support phone"])
+                for index, row in df.iterrows():
+                    user_phone = user_phones[index]
                     first_name = row.get("first name", "").strip()
                     last_name = row.get("last name", "").strip()
-                    support_phone = normalize_phone(row["support phone"])
+                    support_phone = support_phones[index]
                     support_map[user_phone] = {"support": support_phone, "first_name": first_name, "last_name": last_name}
                     phones.append(user_phone)
                     phones.append(support_phone)
                 phones = list(set(phones))
+                assigned = []
                 crm_map = {
                     c.user.phone_number: c for c in CrmUser.objects.filter(user__phone_number__in=phones).select_related("user")
                 }
@@ -353,7 +411,9 @@ class CrmUserLabelAdmin(ManagingGroupPermissionMixin, admin.ModelAdmin):
                         if crm_user.supporting_user is None:
                             crm_user.supporting_user = crm_support.user
                             crm_user.status = 1
-                            crm_user.save()
+                            crm_user._updated_at = get_jdatetime_now_with_timezone()
+                            assigned.append(crm_user)
+                CrmUser.objects.bulk_update(assigned, ["supporting_user", "status", "_updated_at"], batch_size=1000)
                 crm_label.crm_users.add(*[crm_map.get(phone) for phone in support_map.keys()])
                 self.message_user(request, f"# {len(support_map)} updated with label {crm_label.name}")
                 return redirect("..")
@@ -367,7 +427,7 @@ class CrmUserLabelAdmin(ManagingGroupPermissionMixin, admin.ModelAdmin):
 
 
 @admin.register(CrmUser)
-class CrmUserAdmin(DetailedLogAdminMixin, DALFModelAdmin):
+class CrmUserAdmin(EstimatedCountAdminMixin, DetailedLogAdminMixin, DALFModelAdmin):
     form = CrmUserAdminForm
     autocomplete_fields = ("supporting_user", "crm_label")
     list_display = ("user", "supporting_user", "status", "last_follow_up", "next_follow_up", "joined_main_group")
@@ -421,10 +481,20 @@ class CrmUserAdmin(DetailedLogAdminMixin, DALFModelAdmin):
     )
 
     def get_readonly_fields(self, request, obj=None):
-        if request.user.is_superuser or request.user.groups.filter(name=settings.MANAGING_GROUP_NAME).exists():
+        if get_permission_resolver(request).is_managing:
             return super().get_readonly_fields(request, obj)
         return (*self.readonly_fields, "supporting_user")
 
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            load_crm_details([obj])
+        return obj
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        form.save_user()
+
     def save_formset(self, request, form, formset, change):
         crm_user = form.instance
         last_follow_up_updated = False
@@ -444,17 +514,54 @@ class CrmUserAdmin(DetailedLogAdminMixin, DALFModelAdmin):
         super().save_formset(request, form, formset, change)
 
         if last_follow_up_updated:
-            crm_user.save()
+            crm_user.save(update_fields=["last_follow_up", "_updated_at"])
 
     def get_queryset(self, request):
         qs = super().get_queryset(request).select_related("user")
-        if request.user.is_superuser or request.user.groups.filter(name=settings.MANAGING_GROUP_NAME).exists():
+        if get_permission_resolver(request).is_managing:
             return qs
         return qs.filter(supporting_user=request.user)
 
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "follow-up-queue/",
+                self.admin_site.admin_view(self.follow_up_queue_view),
+                name="users_crmuser_follow_up_queue",
+            ),
+        ]
+        return custom_urls + urls
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        queue_url = reverse("admin:users_crmuser_follow_up_queue")
+        extra_context["follow_up_queue_button"] = format_html(
+            '<a class="button" href="{}" style="display:inline-block;">My Queue</a>', queue_url
+        )
+        return super().changelist_view(request, extra_context)
+
+    def follow_up_queue_view(self, request):
+        try:
+            crm_users, next_cursor = follow_up_queue(queue_supporter_id(request), request.GET.get("cursor"))
+        except ValueError:
+            self.message_user(request, "Invalid queue page.", level="error")
+            return redirect(request.path)
+        context = {
+            **self.admin_site.each_context(request),
+            "entries": [queue_entry(crm) for crm in crm_users],
+            "next_cursor": next_cursor,
+            "supporter": request.GET.get("supporter", ""),
+        }
+        return render(request, "admin/users/crmuser/follow_up_queue.html", context)
+
     @admin.display(description="Registered Courses")
     def registered_courses_list(self, obj):
-        registrations = obj.user.registrations.select_related("course__course_type").filter(status__in=[3, 4, 5, 7, 8, 9])
+        registrations = getattr(obj.user, "registered_courses", None)
+        if registrations is None:
+            registrations = obj.user.registrations.select_related("course__course_type").filter(
+                status__in=REGISTERED_COURSE_STATUSES
+            )
         return (
             ", ".join(
                 [
@@ -498,3 +605,195 @@ class CrmLogAdmin(DetailedLogAdminMixin, DALFModelAdmin):
         if not request.user.is_superuser:
             return {}
         return super().get_model_perms(request)
+
+
+@admin.register(SMSCampaign)
+class SMSCampaignAdmin(DetailedLogAdminMixin, ManagingGroupPermissionMixin, DALFModelAdmin):
+    list_display = [
+        "id",
+        "name",
+        "status",
+        "total_recipients",
+        "sent_count",
+        "failed_count",
+        "messages_per_second",
+        "_created_at",
+    ]
+    list_filter = ["status", ("course", DALFRelatedFieldAjax), ("crm_label", DALFRelatedFieldAjax)]
+    search_fields = ["name", "text"]
+    autocomplete_fields = ["crm_label", "course", "supporting_user"]
+    readonly_fields = [
+        "status",
+        "total_recipients",
+        "sent_count",
+        "failed_count",
+        "messages_per_second",
+        "line_stats",
+        "error",
+        "created_by",
+        "started_at",
+        "finished_at",
+        "_created_at",
+        "_updated_at",
+    ]
+    fieldsets = (
+        ("Message", {"fields": ("name", "text")}),
+        (
+            "Recipients",
+            {
+                "fields": (
+                    "crm_label",
+                    ("course", "registration_status", "payment_status"),
+                    "supporting_user",
+                    "include_more_phone_numbers",
+                )
+            },
+        ),
+        (
+            "Delivery",
+            {
+                "fields": (
+                    ("status", "total_recipients", "sent_count", "failed_count", "messages_per_second"),
+                    "line_stats",
+                    ("started_at", "finished_at"),
+                    "error",
+                    "created_by",
+                )
+            },
+        ),
+        ("Timestamps", {"fields": ("_created_at", "_updated_at")}),
+    )
+    actions = ["queue_campaigns"]
+
+    @admin.display(description="messages/s")
+    def messages_per_second(self, obj):
+        return obj.messages_per_second
+
+    def has_module_permission(self, request):
+        return self.has_managing_group_permission(request)
+
+    def has_view_permission(self, request, obj=None):
+        return self.has_managing_group_permission(request)
+
+    def has_add_permission(self, request):
+        return self.has_managing_group_permission(request)
+
+    def has_change_permission(self, request, obj=None):
+        if obj is not None and obj.status != SMS_CAMPAIGN_STATUS_DRAFT:
+            return False
+        return self.has_managing_group_permission(request)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description="Send selected draft campaigns")
+    def queue_campaigns(self, request, queryset):
+        queued = queryset.filter(status=SMS_CAMPAIGN_STATUS_DRAFT).update(status=SMS_CAMPAIGN_STATUS_PENDING)
+        self.message_user(request, f"{queued} campaigns queued for sending.", messages.SUCCESS)
+
+
+@admin.register(SMSLog)
+class SMSLogAdmin(EstimatedCountAdminMixin, DALFModelAdmin):
+    list_display = ["id", "phone_number", "user", "line_number", "status", "attempts", "campaign", "date"]
+    list_filter = ["status", ("campaign", DALFRelatedFieldAjax), ("date", JDateFieldListFilter)]
+    search_fields = ["=phone_number", "text"]
+    readonly_fields = ["line_number", "user", "phone_number", "text", "status", "response", "attempts", "campaign", "date"]
+    list_select_related = ["user", "line_number", "campaign"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DuplicateUserCandidate)
+class DuplicateUserCandidateAdmin(DALFModelAdmin):
+    list_display = ["id", "source", "target", "score", "reasons", "status", "reviewed_by"]
+    list_filter = ["status"]
+    search_fields = ["source__username", "source__phone_number", "target__username", "target__phone_number"]
+    readonly_fields = ["source", "target", "cluster", "score", "reasons", "status", "reviewed_by", "_created_at", "_updated_at"]
+    list_select_related = ["source", "target", "reviewed_by"]
+    actions = ["approve", "reject", "merge_approved"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_model_perms(self, request):
+        if not request.user.is_superuser:
+            return {}
+        return super().get_model_perms(request)
+
+    # Merging and reverting rewrite users across every relation, so only superusers may run them.
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_change_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def _review(self, request, queryset, status):
+        return queryset.exclude(status=DUPLICATE_STATUS_MERGED).update(status=status, reviewed_by=request.user)
+
+    @admin.action(description="Approve selected merges")
+    def approve(self, request, queryset):
+        self.message_user(request, f"{self._review(request, queryset, DUPLICATE_STATUS_APPROVED)} merges approved.")
+
+    @admin.action(description="Reject selected merges")
+    def reject(self, request, queryset):
+        self.message_user(request, f"{self._review(request, queryset, DUPLICATE_STATUS_REJECTED)} merges rejected.")
+
+    @admin.action(description="Merge approved entries of the selection")
+    def merge_approved(self, request, queryset):
+        merged = merge_approved_duplicates(queryset, created_by=request.user)
+        self.message_user(request, f"{merged} users merged.", messages.SUCCESS)
+
+
+@admin.register(UserMergeLog)
+class UserMergeLogAdmin(DALFModelAdmin):
+    list_display = ["id", "source", "target", "created_by", "_created_at", "reverted_at"]
+    list_filter = [("created_by", DALFRelatedFieldAjax), "reverted_at"]
+    search_fields = ["source__username", "target__username", "target__phone_number"]
+    readonly_fields = [
+        "source",
+        "target",
+        "moved",
+        "conflicts",
+        "source_values",
+        "target_values",
+        "created_by",
+        "reverted_at",
+        "_created_at",
+        "_updated_at",
+    ]
+    list_select_related = ["source", "target", "created_by"]
+    actions = ["revert"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_model_perms(self, request):
+        if not request.user.is_superuser:
+            return {}
+        return super().get_model_perms(request)
+
+    # Merging and reverting rewrite users across every relation, so only superusers may run them.
+    def has_view_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_change_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+    @admin.action(description="Revert selected merges (newest first)")
+    def revert(self, request, queryset):
+        logs = list(queryset.filter(reverted_at__isnull=True).order_by("-pk"))
+        for log in logs:
+            revert_merge(log)
+        self.message_user(request, f"{len(logs)} merges reverted.", messages.SUCCESS)
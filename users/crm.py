@@ -0,0 +1,196 @@
+import heapq
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Prefetch, Q, Subquery, prefetch_related_objects
+
+from commons.permissions import get_permission_resolver
+from commons.utils import get_jdatetime_now_with_timezone
+
+from .models import CRM_LOG_ACTION_CHOICES, CRM_USER_STATUS_CHOICES, CrmLog, CrmUser, User
+
+FOLLOW_UP_QUEUE_STATUSES = (1, 2)
+OPEN_CRM_STATUSES = FOLLOW_UP_QUEUE_STATUSES
+ASSIGNED_CRM_STATUS = 1
+FOLLOW_UP_QUEUE_SIZE = 50
+REGISTERED_COURSE_STATUSES = [3, 4, 5, 7, 8, 9]
+
+
+def encode_queue_cursor(crm):
+    """The keyset position of ``crm`` in its queue: ``<next follow up ISO time or empty>,<id>``."""
+    follow_up = crm.next_follow_up.togregorian().isoformat() if crm.next_follow_up else ""
+    return f"{follow_up},{crm.pk}"
+
+
+def decode_queue_cursor(cursor):
+    """The (next_follow_up, id) of an ``encode_queue_cursor`` value; raises ValueError when malformed."""
+    follow_up, _, pk = cursor.rpartition(",")
+    return (datetime.fromisoformat(follow_up) if follow_up else None), int(pk)
+
+
+def queue_supporter_id(request):
+    """The supporter whose queue ``request`` asks for: managers may pick one with ``?supporter=``."""
+    supporter = request.GET.get("supporter")
+    if supporter and get_permission_resolver(request).is_managing:
+        return int(supporter)
+    return request.user.pk
+
+
+def registered_courses_prefetch(lookup="user__registrations"):
+    """Prefetches the registrations that count as taken courses, with their course, into ``registered_courses``."""
+    from courses.models import Registration
+
+    return Prefetch(
+        lookup,
+        queryset=Registration.objects.filter(status__in=REGISTERED_COURSE_STATUSES)
+        .select_related("course__course_type")
+        .order_by("pk"),
+        to_attr="registered_courses",
+    )
+
+
+def load_crm_details(crm_users):
+    """
+    Loads what the CRM user page shows for every CRM user in ``crm_users`` in a fixed number of
+    queries whatever their count: users and supporters, labels, and registered courses.
+    """
+    prefetch_related_objects(crm_users, "user", "supporting_user", "crm_label", registered_courses_prefetch())
+    return crm_users
+
+
+def follow_up_queue(supporter, cursor=None, limit=FOLLOW_UP_QUEUE_SIZE, statuses=FOLLOW_UP_QUEUE_STATUSES):
+    """
+    The next ``limit`` CRM users ``supporter`` should call, earliest follow-up first and never
+    scheduled ones last, after ``cursor``. The page is read with keyset pagination over the
+    (supporting_user, status, next_follow_up, id) index, so later pages cost the same as the
+    first. The user and the last CRM log come with the rows in one query, registered courses
+    with one more for the whole page. Returns (crm_users, next_cursor or None).
+    """
+    last_log = CrmLog.objects.filter(crm=OuterRef("pk")).order_by("-date", "-pk")
+    queue = (
+        CrmUser.objects.filter(supporting_user=supporter, status__in=statuses)
+        .select_related("user")
+        .annotate(
+            last_log_date=Subquery(last_log.values("date")[:1]),
+            last_log_action=Subquery(last_log.values("action")[:1]),
+            last_log_description=Subquery(last_log.values("description")[:1]),
+        )
+        .prefetch_related(registered_courses_prefetch())
+        .order_by(F("next_follow_up").asc(nulls_last=True), "pk")
+    )
+    if cursor:
+        follow_up, pk = decode_queue_cursor(cursor)
+        if follow_up is None:
+            queue = queue.filter(next_follow_up__isnull=True, pk__gt=pk)
+        else:
+            queue = queue.filter(
+                Q(next_follow_up__gt=follow_up) | Q(next_follow_up=follow_up, pk__gt=pk) | Q(next_follow_up__isnull=True)
+            )
+    page = list(queue[: limit + 1])
+    if len(page) > limit:
+        page = page[:limit]
+        return page, encode_queue_cursor(page[-1])
+    return page, None
+
+
+def queue_entry(crm):
+    """The JSON-ready form of one ``follow_up_queue`` row."""
+    user = crm.user
+    return {
+        "id": crm.pk,
+        "user_id": user.pk,
+        "name": f"{user.first_name} {user.last_name}".strip(),
+        "phone_number": str(user.phone_number) if user.phone_number else None,
+        "status": dict(CRM_USER_STATUS_CHOICES).get(crm.status),
+        "next_follow_up": crm.next_follow_up.isoformat() if crm.next_follow_up else None,
+        "last_follow_up": crm.last_follow_up.isoformat() if crm.last_follow_up else None,
+        "last_log": {
+            "date": crm.last_log_date.isoformat(),
+            "action": dict(CRM_LOG_ACTION_CHOICES).get(crm.last_log_action),
+            "description": crm.last_log_description,
+        }
+        if crm.last_log_date
+        else None,
+        "courses": [
+            f"{registration.course.course_type.name_fa or registration.course.course_type.name} {registration.course.number}"
+            for registration in user.registered_courses
+        ],
+    }
+
+
+def default_supporters():
+    """Active members of the support group."""
+    return User.objects.filter(groups__name=settings.SUPPORT_GROUP_NAME, is_active=True).distinct()
+
+
+def open_workloads(supporter_ids):
+    """The number of open (status 1 or 2) CRM users per supporter id, with one grouped query."""
+    loads = dict.fromkeys(supporter_ids, 0)
+    loads.update(
+        CrmUser.objects.filter(supporting_user__in=supporter_ids, status__in=OPEN_CRM_STATUSES)
+        .values_list("supporting_user")
+        .annotate(open=Count("pk"))
+        .order_by()
+    )
+    return loads
+
+
+def assign_supporters(crm_users, supporters=None, reassign=False, dry_run=False):
+    """
+    Spreads ``crm_users`` over ``supporters`` (default: the support group; every one must be an
+    active user, otherwise ValueError is raised before anything is written) so that open workloads
+    end up as even as possible: each CRM user goes to the supporter with the fewest open CRM users
+    at that moment. CRM users that already have a supporter keep it unless ``reassign`` is set, and
+    even then closed ones (not in ``OPEN_CRM_STATUSES``) are left alone rather than reopened.
+    Assigned CRM users are marked as needing follow-up and written with one bulk update.
+    Returns one report row per supporter: ``{"supporter", "before", "assigned", "after"}``.
+    """
+    supporters = list(default_supporters() if supporters is None else supporters)
+    if not supporters:
+        raise ValueError("No supporter to assign to")
+    supporter_ids = list(dict.fromkeys(getattr(supporter, "pk", supporter) for supporter in supporters))
+    unknown = set(supporter_ids) - set(User.objects.filter(pk__in=supporter_ids, is_active=True).values_list("pk", flat=True))
+    if unknown:
+        raise ValueError(f"Unknown or inactive supporters: {', '.join(map(str, sorted(unknown)))}")
+    unassigned = Q(supporting_user__isnull=True)
+    pending = crm_users.filter(unassigned | Q(status__in=OPEN_CRM_STATUSES) if reassign else unassigned)
+    pending = list(pending.order_by("pk").only("pk", "supporting_user", "status"))
+
+    before = open_workloads(supporter_ids)
+    loads = dict(before)
+    for crm in pending:
+        # reassigned CRM users stop counting against their previous supporter
+        if crm.supporting_user_id in loads and crm.status in OPEN_CRM_STATUSES:
+            loads[crm.supporting_user_id] -= 1
+    heap = [(load, supporter_id) for supporter_id, load in loads.items()]
+    heapq.heapify(heap)
+    assigned = dict.fromkeys(supporter_ids, 0)
+    now = get_jdatetime_now_with_timezone()
+    for crm in pending:
+        load, supporter_id = heapq.heappop(heap)
+        crm.supporting_user_id, crm.status, crm._updated_at = supporter_id, ASSIGNED_CRM_STATUS, now
+        assigned[supporter_id] += 1
+        loads[supporter_id] = load + 1
+        heapq.heappush(heap, (load + 1, supporter_id))
+
+    if pending and not dry_run:
+        CrmUser.objects.bulk_update(pending, ["supporting_user", "status", "_updated_at"], batch_size=1000)
+    return [
+        {
+            "supporter": supporter_id,
+            "before": before[supporter_id],
+            "assigned": assigned[supporter_id],
+            "after": loads[supporter_id],
+        }
+        for supporter_id in supporter_ids
+    ]
+
+
+def format_assignment_report(report):
+    """One ``name: before -> after (+assigned)`` line per supporter of an ``assign_supporters`` report."""
+    users = User.objects.in_bulk([row["supporter"] for row in report])
+    return [
+        f"{users[row['supporter']].full_name or users[row['supporter']].username}: "
+        f"{row['before']} -> {row['after']} (+{row['assigned']})"
+        for row in report
+    ]
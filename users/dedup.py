@@ -0,0 +1,173 @@
+import re
+from collections import defaultdict
+
+from django.db import transaction
+
+from commons.utils import (
+    arabic_to_persian_characters,
+    normalize_national_id,
+    normalize_phone,
+    split_phone_numbers,
+)
+
+from .merge import merge_users
+from .models import (
+    DUPLICATE_STATUS_APPROVED,
+    DUPLICATE_STATUS_MERGED,
+    DUPLICATE_STATUS_SKIPPED,
+    DuplicateUserCandidate,
+    User,
+)
+
+BLOCKING_KEYS = ("name", "phone", "national_id", "email")
+KEY_WEIGHTS = {"phone": 0.6, "national_id": 0.6, "email": 0.4, "name": 0.3}
+CONFLICT_PENALTY = 0.3
+MAX_BLOCK_SIZE = 50
+USER_FIELDS = ["id", "first_name", "last_name", "phone_number", "more_phone_numbers", "national_id", "email"]
+
+
+def normalize_name(first_name, last_name):
+    name = arabic_to_persian_characters(f"{first_name or ''}{last_name or ''}")
+    return re.sub(r"[\s‌]+", "", name).lower()
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[max(first, second)] = min(first, second)
+
+
+def blocking_keys(user, keys=BLOCKING_KEYS):
+    """The (kind, value) blocking keys of one user row (a dict of USER_FIELDS)."""
+    result = set()
+    if "name" in keys and user["last_name"]:
+        result.add(("name", normalize_name(user["first_name"], user["last_name"])))
+    if "phone" in keys:
+        phones = [normalize_phone(user["phone_number"]), *split_phone_numbers(user["more_phone_numbers"])]
+        result.update(("phone", phone) for phone in phones if phone)
+    if "national_id" in keys and (national_id := normalize_national_id(user["national_id"])):
+        result.add(("national_id", national_id))
+    if "email" in keys and user["email"]:
+        result.add(("email", user["email"].strip().lower()))
+    return result
+
+
+def score_pair(target, source, target_keys, source_keys):
+    """Scores how likely ``source`` is ``target``. Returns (score, reasons)."""
+    shared = {kind for kind, _ in target_keys & source_keys}
+    score = sum(KEY_WEIGHTS[kind] for kind in shared)
+    reasons = sorted(shared)
+    if target["phone_number"] and source["phone_number"] and "phone" not in shared:
+        score -= CONFLICT_PENALTY
+        reasons.append("different_phone")
+    target_nid, source_nid = normalize_national_id(target["national_id"]), normalize_national_id(source["national_id"])
+    if target_nid and source_nid and target_nid != source_nid:
+        score -= CONFLICT_PENALTY
+        reasons.append("different_national_id")
+    return round(min(max(score, 0), 1), 2), reasons
+
+
+def _target_rank(user):
+    return (not user["phone_number"], not user["national_id"], user["id"])
+
+
+def find_duplicate_users(queryset=None, keys=BLOCKING_KEYS, max_block_size=MAX_BLOCK_SIZE):
+    """
+    Clusters probable duplicate users. Each user is indexed under its blocking keys (normalized
+    name, every phone, national id, email) in one streaming pass; users sharing a key are joined
+    with union-find, so the work stays linear in the number of users. Keys shared by more than
+    ``max_block_size`` users (placeholder emails, very common names) are ignored.
+    Yields (users, keys_by_id) per cluster of two or more users.
+    """
+    queryset = User.objects.filter(is_active=True, main_user__isnull=True) if queryset is None else queryset
+    users = {}
+    user_keys = {}
+    blocks = defaultdict(list)
+    for user in queryset.order_by("pk").values(*USER_FIELDS).iterator(chunk_size=5000):
+        users[user["id"]] = user
+        user_keys[user["id"]] = blocking_keys(user, keys)
+        for key in user_keys[user["id"]]:
+            blocks[key].append(user["id"])
+
+    clusters = UnionFind()
+    for ids in blocks.values():
+        if len(ids) > 1 and (max_block_size is None or len(ids) <= max_block_size):
+            for user_id in ids[1:]:
+                clusters.union(ids[0], user_id)
+
+    members = defaultdict(list)
+    for user_id in list(clusters.parent):
+        members[clusters.find(user_id)].append(users[user_id])
+    for cluster in members.values():
+        if len(cluster) > 1:
+            yield cluster, {user["id"]: user_keys[user["id"]] for user in cluster}
+
+
+def build_merge_plan(queryset=None, keys=BLOCKING_KEYS, min_score=0.3, max_block_size=MAX_BLOCK_SIZE, batch_size=1000):
+    """
+    Writes a DuplicateUserCandidate for every member of every cluster, pointing at the cluster's
+    best target (has a phone, then a national id, then the oldest). Entries already in the plan
+    keep their review status. Returns the number of candidates found.
+    """
+    created = 0
+    batch = []
+    for cluster, keys_by_id in find_duplicate_users(queryset, keys, max_block_size):
+        target = min(cluster, key=_target_rank)
+        for source in cluster:
+            if source is target:
+                continue
+            score, reasons = score_pair(target, source, keys_by_id[target["id"]], keys_by_id[source["id"]])
+            if score < min_score:
+                continue
+            batch.append(
+                DuplicateUserCandidate(
+                    target_id=target["id"], source_id=source["id"], cluster=target["id"], score=score, reasons=reasons
+                )
+            )
+        if len(batch) >= batch_size:
+            DuplicateUserCandidate.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+            batch = []
+    if batch:
+        DuplicateUserCandidate.objects.bulk_create(batch, ignore_conflicts=True)
+        created += len(batch)
+    return created
+
+
+def merge_user_pairs(pairs, created_by=None):
+    """Merges (source_id, target_id) pairs in one set-based batch. Returns the number merged."""
+    return len(merge_users(pairs, created_by=created_by))
+
+
+def merge_approved_duplicates(queryset=None, batch_size=1000, created_by=None):
+    """
+    Merges approved plan entries batch by batch, one transaction per batch. Entries that were
+    merged are marked MERGED; those ``merge_users`` skipped (a user already merged away or
+    missing) are marked SKIPPED. Returns the number merged.
+    """
+    queryset = DuplicateUserCandidate.objects.all() if queryset is None else queryset
+    merged = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.filter(status=DUPLICATE_STATUS_APPROVED).order_by("pk")[:batch_size])
+            if not batch:
+                return merged
+            logs = merge_users([(candidate.source_id, candidate.target_id) for candidate in batch], created_by=created_by)
+            merged += len(logs)
+            merged_sources = {log.source_id for log in logs}
+            done = [candidate.pk for candidate in batch if candidate.source_id in merged_sources]
+            skipped = [candidate.pk for candidate in batch if candidate.source_id not in merged_sources]
+            DuplicateUserCandidate.objects.filter(pk__in=done).update(status=DUPLICATE_STATUS_MERGED)
+            DuplicateUserCandidate.objects.filter(pk__in=skipped).update(status=DUPLICATE_STATUS_SKIPPED)
@@ -0,0 +1,17 @@
+from commons.exports import Column, ExportSpec, name_column, register_export
+
+from .models import CrmUser
+
+CRM_EXPORT = register_export(
+    ExportSpec(
+        "crm_users",
+        CrmUser,
+        [
+            Column("first name", "user__first_name"),
+            Column("last name", "user__last_name"),
+            Column("phone", "user__phone_number", formatter=str),
+            Column("supporting user", "supporting_user__phone_number", formatter=str, default=None),
+            name_column("supporting user name", "supporting_user"),
+        ],
+    )
+)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.crm import assign_supporters, format_assignment_report
+from users.models import CrmUser
+
+
+class Command(BaseCommand):
+    help = "Assign CRM users without a supporter, balancing the supporters' open workload"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--label", type=int, action="append", help="Only CRM users with this label id (repeatable)")
+        parser.add_argument("--all", action="store_true", help="Every CRM user instead of the --label ones")
+        parser.add_argument("--supporter", type=int, action="append", help="Supporter user id (default: the support group)")
+        parser.add_argument("--reassign", action="store_true", help="Also move open CRM users that already have a supporter")
+        parser.add_argument("--dry-run", action="store_true", help="Only print the resulting workloads")
+
+    def handle(self, *args, **options):
+        # assigned CRM users are reopened, so the whole CRM base is only taken when asked for explicitly
+        if bool(options["label"]) == options["all"]:
+            raise CommandError("Pass either --label or --all")
+        crm_users = CrmUser.objects.all()
+        if options["label"]:
+            crm_users = crm_users.filter(crm_label__in=options["label"]).distinct()
+        try:
+            report = assign_supporters(
+                crm_users, supporters=options["supporter"], reassign=options["reassign"], dry_run=options["dry_run"]
+            )
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        for line in format_assignment_report(report):
+            self.stdout.write(line)
+        assigned = sum(row["assigned"] for row in report)
+        self.stdout.write(self.style.SUCCESS(f"{'Would assign' if options['dry_run'] else 'Assigned'} {assigned} CRM users"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from users.dedup import BLOCKING_KEYS, MAX_BLOCK_SIZE, build_merge_plan, merge_approved_duplicates
+
+
+class Command(BaseCommand):
+    help = "Build the reviewable duplicate-user merge plan, or merge its approved entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keys", nargs="+", choices=BLOCKING_KEYS, default=list(BLOCKING_KEYS), help="Blocking keys to use")
+        parser.add_argument("--min-score", type=float, default=0.3)
+        parser.add_argument("--max-block-size", type=int, default=MAX_BLOCK_SIZE, help="Ignore keys shared by more users")
+        parser.add_argument("--merge-approved", action="store_true", help="Merge the approved plan entries instead")
+
+    def handle(self, *args, **options):
+        if options["merge_approved"]:
+            merged = merge_approved_duplicates()
+            self.stdout.write(self.style.SUCCESS(f"Merged {merged} users"))
+            return
+        created = build_merge_plan(keys=options["keys"], min_score=options["min_score"], max_block_size=options["max_block_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {created} duplicate candidates for review"))
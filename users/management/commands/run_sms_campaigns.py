@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.models import SMSCampaign
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Send queued SMS campaigns"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Process the queue once and exit")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--workers", type=int, help="Concurrent provider requests")
+
+    def handle(self, *args, **options):
+        while True:
+            campaign = SMSCampaign.claim_next()
+            if campaign is not None:
+                logger.info("Running SMS campaign %s", campaign.pk)
+                campaign.run(workers=options["workers"])
+                logger.info(
+                    "SMS campaign %s finished: %s, %s sent, %s failed",
+                    campaign.pk,
+                    campaign.get_status_display(),
+                    campaign.sent_count,
+                    campaign.failed_count,
+                )
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from users.sms import dispatch_pending_sms
+
+
+class Command(BaseCommand):
+    help = "Send the pending SMS outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Send at most this many messages")
+        parser.add_argument("--workers", type=int, help="Concurrent provider requests")
+        parser.add_argument("--rate", type=float, help="Messages per second for each line")
+
+    def handle(self, *args, **options):
+        sent, failed = dispatch_pending_sms(limit=options["limit"], workers=options["workers"], rate=options["rate"])
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} messages, {failed} failed"))
@@ -0,0 +1,252 @@
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Case, Value, When
+
+from commons.utils import get_jdatetime_now_with_timezone
+
+from .models import User, UserMergeLog
+
+# Audit rows, merge bookkeeping and permissions stay with the user they were recorded for.
+MERGE_EXCLUDED_MODELS = {
+    "admin.LogEntry",
+    "users.DuplicateUserCandidate",
+    "users.UserMergeLog",
+    "users.User_groups",
+    "users.User_user_permissions",
+}
+MERGE_FILL_FIELDS = [
+    "telegram_id",
+    "profession",
+    "email",
+    "national_id",
+    "english_first_name",
+    "english_last_name",
+    "referer_name",
+]
+MERGED_SOURCE_FIELDS = ["first_name", "last_name", "username", "is_active", "main_user_id", "description"]
+UPDATE_CHUNK_SIZE = 500
+
+
+def _touched(model, now):
+    """``{"_updated_at": now}`` for timestamped models, so caches keyed on it (exports) see the move."""
+    return {"_updated_at": now} if any(field.name == "_updated_at" for field in model._meta.concrete_fields) else {}
+
+
+def related_relations(model):
+    """(model, field) for every foreign key, including many-to-many through tables, pointing at ``model``."""
+    relations = {}
+    for rel in model._meta.related_objects:
+        if rel.many_to_many:
+            through = rel.through
+            field = through._meta.get_field(rel.field.m2m_reverse_field_name())
+        else:
+            through, field = rel.related_model, rel.field
+        relations[(through._meta.label, field.name)] = (through, field)
+    for m2m_field in model._meta.many_to_many:
+        through = m2m_field.remote_field.through
+        field = through._meta.get_field(m2m_field.m2m_field_name())
+        relations[(through._meta.label, field.name)] = (through, field)
+    return [relation for (label, _), relation in relations.items() if label not in MERGE_EXCLUDED_MODELS]
+
+
+def _unique_sets(model, field):
+    """The other columns of every unique constraint that includes ``field``; ``()`` if ``field`` itself is unique."""
+    groups = [tuple(group) for group in model._meta.unique_together]
+    groups += [
+        tuple(constraint.fields)
+        for constraint in model._meta.constraints
+        if isinstance(constraint, models.UniqueConstraint) and constraint.fields and constraint.condition is None
+    ]
+    unique_sets = [()] if field.unique else []
+    for group in groups:
+        if field.name in group:
+            unique_sets.append(tuple(model._meta.get_field(name).attname for name in group if name != field.name))
+    return unique_sets
+
+
+class _MergeRecorder:
+    """Collects moved and colliding row ids per merged source user."""
+
+    def __init__(self):
+        self.moved = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        self.conflicts = defaultdict(lambda: defaultdict(list))
+
+    def log_values(self, source_id):
+        moved = {key: dict(by_owner) for key, by_owner in self.moved[source_id].items()}
+        return moved, dict(self.conflicts[source_id])
+
+
+def _move_relation(model, field, mapping, owners, recorder):
+    """
+    Re-points the rows of ``model`` whose ``field`` is a key of ``mapping`` to the mapped value
+    with one UPDATE (per chunk). Rows that would break a unique constraint stay where they are;
+    for one-to-one rows, the relations of the colliding row are merged into the kept row instead.
+    """
+    attname = field.attname
+    unique_sets = _unique_sets(model, field)
+    columns = sorted({name for group in unique_sets for name in group})
+    owned_by = set(mapping) | set(mapping.values()) if unique_sets else set(mapping)
+    rows = list(model._base_manager.filter(**{f"{attname}__in": owned_by}).order_by("pk").values_list("pk", attname, *columns))
+
+    def unique_keys(row, owner):
+        values = dict(zip(columns, row[2:], strict=True))
+        keys = [(index, owner, tuple(values[name] for name in group)) for index, group in enumerate(unique_sets)]
+        return [key for key in keys if None not in key[2]]
+
+    occupants = {}
+    for row in rows:
+        if row[1] not in mapping:
+            occupants.update(dict.fromkeys(unique_keys(row, row[1]), row[0]))
+
+    key = f"{model._meta.label}.{attname}"
+    touched = _touched(model, get_jdatetime_now_with_timezone())
+    moved = []
+    nested_mapping, nested_owners = {}, {}
+    for row in rows:
+        pk, old = row[0], row[1]
+        if old not in mapping:
+            continue
+        new, source_id = mapping[old], owners[old]
+        keys = unique_keys(row, new)
+        taken = [occupants[unique_key] for unique_key in keys if unique_key in occupants]
+        if taken or (model is field.related_model and pk == new):
+            recorder.conflicts[source_id][key].append(pk)
+            if field.unique and taken:
+                nested_mapping[pk], nested_owners[pk] = taken[0], source_id
+            continue
+        occupants.update(dict.fromkeys(keys, pk))
+        recorder.moved[source_id][key][str(old)].append(pk)
+        moved.append((pk, old))
+
+    for start in range(0, len(moved), UPDATE_CHUNK_SIZE):
+        chunk = moved[start : start + UPDATE_CHUNK_SIZE]
+        new_value = Case(
+            *[When(**{attname: old}, then=Value(mapping[old])) for old in {old for _, old in chunk}],
+            output_field=field.target_field,
+        )
+        model._base_manager.filter(pk__in=[pk for pk, _ in chunk]).update(**{attname: new_value}, **touched)
+
+    if nested_mapping:
+        _merge_relations(model, nested_mapping, nested_owners, recorder)
+
+
+def _merge_relations(model, mapping, owners, recorder):
+    for related_model, field in related_relations(model):
+        _move_relation(related_model, field, mapping, owners, recorder)
+
+
+def _resolve_targets(pairs):
+    """Maps every source to its final target, following chains such as a -> b, b -> c."""
+    targets = dict(pairs)
+    mapping = {}
+    for source_id in targets:
+        target_id, seen = targets[source_id], {source_id}
+        while target_id in targets and target_id not in seen:
+            seen.add(target_id)
+            target_id = targets[target_id]
+        if target_id != source_id:
+            mapping[source_id] = target_id
+    return mapping
+
+
+def _fill_target(source, target):
+    """Copies what the target lacks from the source. Returns the target's previous values."""
+    previous = {}
+
+    def fill(field, value):
+        previous.setdefault(field, getattr(target, field))
+        setattr(target, field, value)
+
+    for field in MERGE_FILL_FIELDS:
+        if getattr(source, field) and not getattr(target, field):
+            fill(field, getattr(source, field))
+    if target.gender is None and source.gender is not None:
+        fill("gender", source.gender)
+    if target.age in [None, 0] and source.age not in [None, 0]:
+        fill("age", source.age)
+    if source.more_phone_numbers:
+        fill("more_phone_numbers", (target.more_phone_numbers + "\n" + source.more_phone_numbers).strip())
+    return previous
+
+
+def _retire_source(source, target):
+    """Marks the source as merged into the target. Returns its previous values."""
+    previous = {field: getattr(source, field) for field in MERGED_SOURCE_FIELDS}
+    source.description = f"{source.first_name} {source.last_name} has been merged into {target.id}\n{source.username}"
+    source.first_name = "merged_user"
+    source.last_name = f"{source.id}"
+    source.username = f"merged_user_{source.id}"
+    source.is_active = False
+    source.main_user_id = target.id
+    return previous
+
+
+@transaction.atomic
+def merge_users(pairs, created_by=None):
+    """
+    Merges every (source_id, target_id) pair in one transaction. Each relation pointing at the
+    sources is re-pointed with one UPDATE for the whole batch, unique collisions (a second
+    registration for the same course, a second CRM record, ...) are left on the source and
+    recorded, and a UserMergeLog is written per pair so the merge can be reverted.
+    Pairs whose users are missing or already merged are skipped. Returns the merge logs.
+    """
+    mapping = _resolve_targets(pairs)
+    users = User.objects.in_bulk(set(mapping) | set(mapping.values()))
+    mapping = {
+        source_id: target_id
+        for source_id, target_id in mapping.items()
+        if source_id in users
+        and target_id in users
+        and users[source_id].main_user_id is None
+        and users[target_id].main_user_id is None
+    }
+    if not mapping:
+        return []
+
+    recorder = _MergeRecorder()
+    _merge_relations(User, mapping, {source_id: source_id for source_id in mapping}, recorder)
+
+    logs = []
+    for source_id, target_id in mapping.items():
+        source, target = users[source_id], users[target_id]
+        target_values = _fill_target(source, target)
+        source_values = _retire_source(source, target)
+        moved, conflicts = recorder.log_values(source_id)
+        logs.append(
+            UserMergeLog(
+                source=source,
+                target=target,
+                moved=moved,
+                conflicts=conflicts,
+                source_values=source_values,
+                target_values=target_values,
+                created_by=created_by,
+            )
+        )
+    now = get_jdatetime_now_with_timezone()
+    for user_id in set(mapping) | set(mapping.values()):
+        users[user_id]._updated_at = now
+    User.objects.bulk_update([users[source_id] for source_id in mapping], [*MERGED_SOURCE_FIELDS, "_updated_at"])
+    User.objects.bulk_update(
+        [users[target_id] for target_id in set(mapping.values())],
+        [*MERGE_FILL_FIELDS, "gender", "age", "more_phone_numbers", "_updated_at"],
+    )
+    return UserMergeLog.objects.bulk_create(logs)
+
+
+@transaction.atomic
+def revert_merge(log):
+    """Moves the rows recorded in ``log`` back to the source and restores both users' fields."""
+    now = get_jdatetime_now_with_timezone()
+    for key, by_owner in log.moved.items():
+        label, attname = key.rsplit(".", 1)
+        model = apps.get_model(label)
+        for old, pks in by_owner.items():
+            model._base_manager.filter(pk__in=pks).update(**{attname: int(old)}, **_touched(model, now))
+    User.objects.filter(pk=log.source_id).update(**log.source_values, _updated_at=now)
+    if log.target_values:
+        User.objects.filter(pk=log.target_id).update(**log.target_values, _updated_at=now)
+    log.reverted_at = now
+    log.save(update_fields=["reverted_at", "_updated_at"])
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:11
+
+import django.db.models.deletion
+import django_jalali.db.models
+import users.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0013_courseaccess'),
+        ('users', '0016_smslog_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMSCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('_created_at', django_jalali.db.models.jDateTimeField(auto_now_add=True)),
+                ('_updated_at', django_jalali.db.models.jDateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=100)),
+                ('text', models.TextField(help_text='Placeholders: {first_name}, {last_name}, {full_name}, {phone_number}')),
+                ('registration_status', models.IntegerField(blank=True, choices=users.models._registration_status_choices, null=True)),
+                ('payment_status', models.IntegerField(blank=True, choices=users.models._registration_payment_status_choices, null=True)),
+                ('include_more_phone_numbers', models.BooleanField(default=True)),
+                ('status', models.IntegerField(choices=[(0, 'پیش\u200cنویس'), (1, 'در صف'), (2, 'در حال ارسال'), (3, 'ارسال شد'), (4, 'خطا')], db_index=True, default=0)),
+                ('total_recipients', models.PositiveIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('line_stats', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+                ('started_at', django_jalali.db.models.jDateTimeField(blank=True, null=True)),
+                ('finished_at', django_jalali.db.models.jDateTimeField(blank=True, null=True)),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_campaigns', to='courses.course')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_campaigns', to=settings.AUTH_USER_MODEL)),
+                ('crm_label', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_campaigns', to='users.crmuserlabel')),
+                ('supporting_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='supported_sms_campaigns', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-_created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='smslog',
+            name='campaign',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_logs', to='users.smscampaign'),
+        ),
+    ]
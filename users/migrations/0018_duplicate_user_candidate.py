@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:13
+
+import django.db.models.deletion
+import django_jalali.db.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_sms_campaign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateUserCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('_created_at', django_jalali.db.models.jDateTimeField(auto_now_add=True)),
+                ('_updated_at', django_jalali.db.models.jDateTimeField(auto_now=True)),
+                ('cluster', models.PositiveIntegerField(db_index=True)),
+                ('score', models.FloatField(db_index=True)),
+                ('reasons', models.JSONField(blank=True, default=list)),
+                ('status', models.IntegerField(choices=[(1, 'در انتظار بررسی'), (2, 'تایید شده'), (3, 'رد شده'), (4, 'ادغام شده')], db_index=True, default=1)),
+                ('reviewed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reviewed_duplicates', to=settings.AUTH_USER_MODEL)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_targets', to=settings.AUTH_USER_MODEL)),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_sources', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score', 'cluster'],
+                'constraints': [models.UniqueConstraint(fields=('target', 'source'), name='unique_duplicate_user_candidate')],
+            },
+        ),
+    ]
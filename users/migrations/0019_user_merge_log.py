@@ -0,0 +1,60 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:16
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django_jalali.db.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0018_duplicate_user_candidate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserMergeLog",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("_created_at", django_jalali.db.models.jDateTimeField(auto_now_add=True)),
+                ("_updated_at", django_jalali.db.models.jDateTimeField(auto_now=True)),
+                ("moved", models.JSONField(blank=True, default=dict)),
+                ("conflicts", models.JSONField(blank=True, default=dict)),
+                (
+                    "source_values",
+                    models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+                ),
+                (
+                    "target_values",
+                    models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+                ),
+                ("reverted_at", django_jalali.db.models.jDateTimeField(blank=True, null=True)),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="user_merges",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "source",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="merges_as_source", to=settings.AUTH_USER_MODEL
+                    ),
+                ),
+                (
+                    "target",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="merges_as_target", to=settings.AUTH_USER_MODEL
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-_created_at"],
+            },
+        ),
+    ]
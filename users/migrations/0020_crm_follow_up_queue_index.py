@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_user_merge_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='crmlog',
+            index=models.Index(fields=['crm', 'date'], name='crm_log_crm_date'),
+        ),
+        migrations.AddIndex(
+            model_name='crmuser',
+            index=models.Index(fields=['supporting_user', 'status', 'next_follow_up', 'id'], name='crm_follow_up_queue'),
+        ),
+    ]
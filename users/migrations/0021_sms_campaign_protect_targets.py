@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("courses", "0013_courseaccess"),
+        ("users", "0020_crm_follow_up_queue_index"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="smscampaign",
+            name="course",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="sms_campaigns",
+                to="courses.course",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="smscampaign",
+            name="crm_label",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="sms_campaigns",
+                to="users.crmuserlabel",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="smscampaign",
+            name="supporting_user",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="supported_sms_campaigns",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0021_sms_campaign_protect_targets"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="smslog",
+            name="status",
+            field=models.IntegerField(
+                choices=[(0, "Pending"), (1, "Sent"), (2, "Failed"), (3, "Sending")], db_index=True, default=0
+            ),
+        ),
+    ]
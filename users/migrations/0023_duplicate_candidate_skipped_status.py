@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("users", "0022_sms_log_sending_status"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="duplicateusercandidate",
+            name="status",
+            field=models.IntegerField(
+                choices=[(1, "در انتظار بررسی"), (2, "تایید شده"), (3, "رد شده"), (4, "ادغام شده"), (5, "ادغام نشد")],
+                db_index=True,
+                default=1,
+            ),
+        ),
+    ]
@@ -1,14 +1,17 @@
 import abc
+import logging
 
 import requests
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
 from django_jalali.db import models as jmodels
 from phonenumber_field.modelfields import PhoneNumberField
 
-from commons.models import TimeStampedModel
+from commons.models import TimeStampedModel, TrackedFieldsMixin
 from commons.utils import get_jdatetime_now_with_timezone
 
 GENDER_CHOICES = [
@@ -157,12 +160,18 @@ class CrmUser(TimeStampedModel):
 
     class Meta:
         ordering = ["-_created_at"]
+        indexes = [
+            # serves each supporter's follow-up queue in (next_follow_up, id) keyset order
+            models.Index(fields=["supporting_user", "status", "next_follow_up", "id"], name="crm_follow_up_queue"),
+        ]
 
     def __str__(self):
         return f"{self.user.full_name} - {self.pk}"
 
 
-class CrmLog(TimeStampedModel):
+class CrmLog(TrackedFieldsMixin, TimeStampedModel):
+    tracked_fields = ["description", "action", "user_id", "date"]
+
     crm = models.ForeignKey(CrmUser, on_delete=models.CASCADE, related_name="logs")
     description = models.TextField(blank=True, null=True)
     action = models.IntegerField(choices=CRM_LOG_ACTION_CHOICES, default=1, db_index=True)
@@ -171,11 +180,68 @@ class CrmLog(TimeStampedModel):
 
     class Meta:
         ordering = ["-date"]
+        indexes = [models.Index(fields=["crm", "date"], name="crm_log_crm_date")]
 
     def __str__(self):
         return f"{self.pk} - {self.crm.user.full_name} - {self.get_action_display()} - {self.date}"
 
 
+DUPLICATE_STATUS_PENDING = 1
+DUPLICATE_STATUS_APPROVED = 2
+DUPLICATE_STATUS_REJECTED = 3
+DUPLICATE_STATUS_MERGED = 4
+DUPLICATE_STATUS_SKIPPED = 5
+
+DUPLICATE_STATUS_CHOICES = [
+    (DUPLICATE_STATUS_PENDING, "در انتظار بررسی"),
+    (DUPLICATE_STATUS_APPROVED, "تایید شده"),
+    (DUPLICATE_STATUS_REJECTED, "رد شده"),
+    (DUPLICATE_STATUS_MERGED, "ادغام شده"),
+    (DUPLICATE_STATUS_SKIPPED, "ادغام نشد"),
+]
+
+
+class DuplicateUserCandidate(TimeStampedModel):
+    """One reviewable entry of the duplicate-user merge plan: merge ``source`` into ``target``."""
+
+    target = models.ForeignKey(User, on_delete=models.CASCADE, related_name="duplicate_sources")
+    source = models.ForeignKey(User, on_delete=models.CASCADE, related_name="duplicate_targets")
+    cluster = models.PositiveIntegerField(db_index=True)
+    score = models.FloatField(db_index=True)
+    reasons = models.JSONField(default=list, blank=True)
+    status = models.IntegerField(choices=DUPLICATE_STATUS_CHOICES, default=DUPLICATE_STATUS_PENDING, db_index=True)
+    reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="reviewed_duplicates")
+
+    class Meta:
+        ordering = ["-score", "cluster"]
+        constraints = [models.UniqueConstraint(fields=["target", "source"], name="unique_duplicate_user_candidate")]
+
+    def __str__(self):
+        return f"{self.source_id} -> {self.target_id} ({self.score})"
+
+
+class UserMergeLog(TimeStampedModel):
+    """
+    What merging ``source`` into ``target`` changed: the re-pointed rows per relation, the
+    rows left behind because of unique collisions and the previous field values of both users.
+    """
+
+    source = models.ForeignKey(User, on_delete=models.CASCADE, related_name="merges_as_source")
+    target = models.ForeignKey(User, on_delete=models.CASCADE, related_name="merges_as_target")
+    moved = models.JSONField(default=dict, blank=True)
+    conflicts = models.JSONField(default=dict, blank=True)
+    source_values = models.JSONField(encoder=DjangoJSONEncoder, default=dict, blank=True)
+    target_values = models.JSONField(encoder=DjangoJSONEncoder, default=dict, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="user_merges")
+    reverted_at = jmodels.jDateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-_created_at"]
+
+    def __str__(self):
+        return f"{self.source_id} -> {self.target_id}"
+
+
 ELANAK_SMS_PROVIDER = 0
 KAVENEGAR_SMS_PROVIDER = 1
 SMS_LINE_PROVIDERS = [(ELANAK_SMS_PROVIDER, "Elanak"), (KAVENEGAR_SMS_PROVIDER, "Kavenegar")]
@@ -201,8 +267,9 @@ class SMSLineHandler:
 
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, sms_line):
+    def __init__(self, sms_line, session=None):
         self.sms_line = sms_line
+        self.session = session or requests.Session()
 
     def _log_sms(self, text, recieve_number, result_json):
         SMSLog.objects.create(
@@ -224,24 +291,28 @@ class SMSLineHandler:
 
 
 class ElanakSMSHandler(SMSLineHandler):
-    url_template = (
-        "https://payammatni.com/webservice/url/send.php?method=sendsms&format=json"
-        "&from={line_number}&to={recieve_number}&text={text}&type=0"
-        "&username={username}&password={password}"
-    )
-
     def _send(self, text, recieve_number):
-        url = self.url_template.format(
-            line_number=self.sms_line.line_number,
-            recieve_number=recieve_number,
-            text=text + "\nلغو۱۱",  # noqa
-            username=settings.ELANAK_USERNAME,
-            password=settings.ELANAK_PASSWORD,
+        result = self.session.get(
+            settings.ELANAK_API_URL,
+            params={
+                "method": "sendsms",
+                "format": "json",
+                "from": self.sms_line.line_number,
+                "to": str(recieve_number),
+                "text": text + "\nلغو۱۱",  # noqa
+                "type": 0,
+                "username": settings.ELANAK_USERNAME,
+                "password": settings.ELANAK_PASSWORD,
+            },
+            timeout=30,
         )
-        result = requests.get(url, timeout=30)
+        result.raise_for_status()
         return result.json()
 
 
+SMS_LINE_HANDLERS = {ELANAK_SMS_PROVIDER: ElanakSMSHandler}
+
+
 class SMSLogManager(models.Manager):
     global SMS_LINES
 
@@ -257,6 +328,19 @@ class SMSLogManager(models.Manager):
             }
         return self.SMS_LINES
 
+    def enqueue(self, phone_numbers, text, line_number=None):
+        """Adds pending outbox rows for ``phone_numbers``; users are resolved with one query."""
+        phone_numbers = list(dict.fromkeys(str(phone_number) for phone_number in phone_numbers if phone_number))
+        line_number = line_number or SMSLine.get_available_line()
+        users = dict(User.objects.filter(phone_number__in=phone_numbers).order_by("-pk").values_list("phone_number", "pk"))
+        return self.bulk_create(
+            [
+                self.model(line_number=line_number, phone_number=phone_number, text=text, user_id=users.get(phone_number))
+                for phone_number in phone_numbers
+            ],
+            batch_size=500,
+        )
+
     def create_log(self, phone_number, text, line_number, status=0, response=None, user=None):
         return self.create(
             phone_number=phone_number,
@@ -275,12 +359,161 @@ class SMSLog(TimeStampedModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sms_logs", null=True, blank=True, db_index=True)
     phone_number = PhoneNumberField(db_index=True)
     text = models.TextField()
-    status = models.IntegerField(choices=[(0, "Pending"), (1, "Sent"), (2, "Failed")], default=0, db_index=True)
+    status = models.IntegerField(choices=[(0, "Pending"), (1, "Sent"), (2, "Failed"), (3, "Sending")], default=0, db_index=True)
     response = models.JSONField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    campaign = models.ForeignKey(
+        "SMSCampaign", on_delete=models.SET_NULL, related_name="sms_logs", null=True, blank=True, editable=False
+    )
     date = jmodels.jDateTimeField(blank=True, default=get_jdatetime_now_with_timezone, db_index=True)
 
+    objects = SMSLogManager()
+
     class Meta:
         ordering = ["-_created_at"]
 
     def __str__(self):
         return f"{self.phone_number} - {self.text[:30]} - {self.status} - {self.date}"
+
+
+SMS_CAMPAIGN_STATUS_DRAFT = 0
+SMS_CAMPAIGN_STATUS_PENDING = 1
+SMS_CAMPAIGN_STATUS_RUNNING = 2
+SMS_CAMPAIGN_STATUS_DONE = 3
+SMS_CAMPAIGN_STATUS_FAILED = 4
+
+SMS_CAMPAIGN_STATUS_CHOICES = [
+    (SMS_CAMPAIGN_STATUS_DRAFT, "پیش‌نویس"),
+    (SMS_CAMPAIGN_STATUS_PENDING, "در صف"),
+    (SMS_CAMPAIGN_STATUS_RUNNING, "در حال ارسال"),
+    (SMS_CAMPAIGN_STATUS_DONE, "ارسال شد"),
+    (SMS_CAMPAIGN_STATUS_FAILED, "خطا"),
+]
+
+SMS_CAMPAIGN_PLACEHOLDERS = ["first_name", "last_name", "full_name", "phone_number"]
+
+
+def _registration_status_choices():
+    from courses.models import STATUS_CHOICES
+
+    return STATUS_CHOICES
+
+
+def _registration_payment_status_choices():
+    from courses.models import PAYMENT_STATUS_CHOICES
+
+    return PAYMENT_STATUS_CHOICES
+
+
+class SMSCampaign(TimeStampedModel):
+    name = models.CharField(max_length=100)
+    text = models.TextField(help_text="Placeholders: " + ", ".join(f"{{{name}}}" for name in SMS_CAMPAIGN_PLACEHOLDERS))
+    crm_label = models.ForeignKey(CrmUserLabel, on_delete=models.PROTECT, null=True, blank=True, related_name="sms_campaigns")
+    course = models.ForeignKey("courses.Course", on_delete=models.PROTECT, null=True, blank=True, related_name="sms_campaigns")
+    registration_status = models.IntegerField(choices=_registration_status_choices, null=True, blank=True)
+    payment_status = models.IntegerField(choices=_registration_payment_status_choices, null=True, blank=True)
+    supporting_user = models.ForeignKey(
+        User, on_delete=models.PROTECT, null=True, blank=True, related_name="supported_sms_campaigns"
+    )
+    include_more_phone_numbers = models.BooleanField(default=True)
+    status = models.IntegerField(choices=SMS_CAMPAIGN_STATUS_CHOICES, default=SMS_CAMPAIGN_STATUS_DRAFT, db_index=True)
+    total_recipients = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    line_stats = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="sms_campaigns")
+    started_at = jmodels.jDateTimeField(blank=True, null=True)
+    finished_at = jmodels.jDateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ["-_created_at"]
+
+    def __str__(self):
+        return f"{self.name} - {self.get_status_display()}"
+
+    @property
+    def has_target(self):
+        return bool(self.crm_label_id or self.course_id or self.supporting_user_id)
+
+    def clean(self):
+        if not self.has_target:
+            raise ValidationError("Choose a CRM label, a course or a supporting user to target.")
+        if (self.registration_status or self.payment_status) and not self.course_id:
+            raise ValidationError("Registration filters need a course.")
+        try:
+            self.text.format_map(dict.fromkeys(SMS_CAMPAIGN_PLACEHOLDERS, ""))
+        except (KeyError, ValueError, IndexError) as e:
+            raise ValidationError({"text": f"Invalid placeholder: {e}"}) from e
+
+    def render(self, **values):
+        return self.text.format_map(values)
+
+    @classmethod
+    def claim_next(cls):
+        with transaction.atomic():
+            campaign = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status=SMS_CAMPAIGN_STATUS_PENDING)
+                .order_by("_created_at")
+                .first()
+            )
+            if campaign is None:
+                return None
+            campaign.status = SMS_CAMPAIGN_STATUS_RUNNING
+            campaign.started_at = get_jdatetime_now_with_timezone()
+            campaign.save(update_fields=["status", "started_at", "_updated_at"])
+        return campaign
+
+    @property
+    def elapsed_seconds(self):
+        if self.started_at is None:
+            return 0
+        end = self.finished_at or get_jdatetime_now_with_timezone()
+        return max((end - self.started_at).total_seconds(), 0)
+
+    @property
+    def messages_per_second(self):
+        elapsed = self.elapsed_seconds
+        if not elapsed:
+            return 0
+        return round((self.sent_count + self.failed_count) / elapsed, 1)
+
+    def run(self, **dispatcher_options):
+        from .sms import dispatch_pending_sms, queue_campaign
+
+        try:
+            if not self.sms_logs.exists():
+                self.total_recipients = queue_campaign(self)
+            dispatch_pending_sms(self.sms_logs.all(), **dispatcher_options)
+        except Exception as e:
+            logging.getLogger(__name__).exception("Error running SMS campaign %s", self.pk)
+            self.status = SMS_CAMPAIGN_STATUS_FAILED
+            self.error = str(e)
+        else:
+            self.status = SMS_CAMPAIGN_STATUS_DONE
+        self.update_stats()
+        self.finished_at = get_jdatetime_now_with_timezone()
+        self.save(
+            update_fields=[
+                "status",
+                "error",
+                "total_recipients",
+                "sent_count",
+                "failed_count",
+                "line_stats",
+                "finished_at",
+                "_updated_at",
+            ]
+        )
+
+    def update_stats(self):
+        """Recounts sent/failed messages overall and per sending line from the campaign's logs."""
+        self.line_stats = {}
+        for line_number, status, count in (
+            self.sms_logs.order_by().values_list("line_number__line_number", "status").annotate(count=models.Count("pk"))
+        ):
+            stats = self.line_stats.setdefault(line_number, {"pending": 0, "sent": 0, "failed": 0, "sending": 0})
+            stats[{0: "pending", 1: "sent", 2: "failed", 3: "sending"}[status]] = count
+        self.sent_count = sum(stats["sent"] for stats in self.line_stats.values())
+        self.failed_count = sum(stats["failed"] for stats in self.line_stats.values())
@@ -1,12 +1,11 @@
 from django.contrib.admin.models import ADDITION, CHANGE
-from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import m2m_changed, post_save, pre_save
 from django.dispatch import receiver
 
-from commons.models import DetailedLog
+from commons import audit
 from commons.utils import arabic_to_persian_characters, get_jdatetime_now_with_timezone
 
-from .models import CrmLog, User
+from .models import CrmLog, CrmUser, User
 
 
 @receiver(pre_save, sender=User)
@@ -14,48 +13,52 @@ def user_pre_save_fix_name(sender, instance, **kwargs):
     instance.first_name = arabic_to_persian_characters(instance.first_name) or ""
     instance.last_name = arabic_to_persian_characters(instance.last_name) or ""
 
+
+def _crm_log_values(values):
+    """Audit values of a CrmLog: the author is stored as a model reference, which needs no user query."""
+    values = dict(values)
+    user_id = values.pop("user_id")
+    values["user"] = User(pk=user_id) if user_id is not None else None
+    return values
+
+
 @receiver(pre_save, sender=CrmLog)
-def crm_log_pre_save(sender, instance, **kwargs):
+def crm_log_pre_save(sender, instance, raw=False, **kwargs):
     if instance.date is None:
         instance.date = get_jdatetime_now_with_timezone()
-    if not instance.pk:
+    if not instance.pk or raw:
         return
-    old_instance = CrmLog.objects.get(pk=instance.pk)
-    changing_user = instance.user
-    if instance.user.id != old_instance.user.id:
-        instance.user = old_instance.user
-    old_values = {}
-    changes = {}
-    for field in ["description", "action", "user", "date"]:
-        old_value = getattr(old_instance, field)
-        new_value = getattr(instance, field)
-        old_values[field] = old_value
-        if old_value != new_value:
-            changes[field] = new_value
+    if instance.has_loaded_values:
+        loaded = {field: instance.get_loaded_value(field) for field in instance.tracked_fields}
+    else:
+        loaded = CrmLog.objects.filter(pk=instance.pk).values(*instance.tracked_fields).first()
+        if loaded is None:
+            return
+    # the log keeps its author; whoever edits it is recorded as the audit user
+    changing_user_id = instance.user_id
+    instance.user_id = loaded["user_id"]
+    current = {field: getattr(instance, field) for field in instance.tracked_fields}
+    old_values, new_values = _crm_log_values(loaded), _crm_log_values(current)
+    changes = {field: value for field, value in new_values.items() if value != old_values[field]}
     if changes:
-        DetailedLog.objects.create(
-            user=changing_user,
-            content_type=ContentType.objects.get_for_model(CrmLog),
-            object_id=instance.pk,
-            object_repr=str(instance)[:200],
-            action_flag=CHANGE,
-            change_message="",
-            old_values=old_values,
-            changed_values=changes,
-        )
+        audit.record(changing_user_id, instance, CHANGE, old_values=old_values, changed_values=changes)
 
 
 @receiver(post_save, sender=CrmLog)
-def crm_log_post_save(sender, instance, created, **kwargs):
-    if created:
-        changed_values = {field: getattr(instance, field) for field in ["description", "action", "user", "date"]}
-        DetailedLog.objects.create(
-            user=instance.user,
-            content_type=ContentType.objects.get_for_model(CrmLog),
-            object_id=instance.pk,
-            object_repr=str(instance)[:200],
-            action_flag=ADDITION,
-            change_message="",
-            old_values={},
-            changed_values=changed_values,
-        )
+def crm_log_post_save(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        values = {field: getattr(instance, field) for field in instance.tracked_fields}
+        audit.record(instance.user_id, instance, ADDITION, changed_values=_crm_log_values(values))
+    instance.reset_loaded_values()
+
+
+@receiver(m2m_changed, sender=CrmUser.crm_label.through)
+def crm_user_labels_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Label changes touch the CRM users, so data versions keyed on ``_updated_at`` (exports) move."""
+    if action in ("post_add", "post_remove"):
+        crm_users = CrmUser.objects.filter(pk__in=pk_set) if reverse else CrmUser.objects.filter(pk=instance.pk)
+    elif action == "pre_clear":
+        crm_users = CrmUser.objects.filter(crm_label=instance) if reverse else CrmUser.objects.filter(pk=instance.pk)
+    else:
+        return
+    crm_users.update(_updated_at=get_jdatetime_now_with_timezone())
@@ -0,0 +1,254 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from requests.adapters import HTTPAdapter
+
+from commons.utils import get_jdatetime_now_with_timezone, normalize_phone, split_phone_numbers
+
+from .models import SMS_LINE_HANDLERS, SMSLine, SMSLog, User
+
+logger = logging.getLogger(__name__)
+
+SMS_STATUS_PENDING = 0
+SMS_STATUS_SENT = 1
+SMS_STATUS_FAILED = 2
+SMS_STATUS_SENDING = 3
+
+SMS_CAMPAIGN_BATCH_SIZE = 500
+
+
+def _describe_error(error):
+    """Error text without the request URL, which carries the provider credentials."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        return f"HTTP {response.status_code}"
+    return type(error).__name__
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``rate`` acquisitions per second on average."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SMSDispatcher:
+    """
+    Sends the pending SMSLog outbox over one pooled HTTP session. Messages go out from a
+    thread pool, each line is throttled by its own token bucket, failed requests are retried
+    with exponential backoff and the resulting statuses are written back in bulk batches.
+    """
+
+    def __init__(self, workers=None, rate=None, max_attempts=None, backoff=None, batch_size=None, lease=None):
+        self.workers = workers or settings.SMS_DISPATCH_WORKERS
+        self.rate = rate or settings.SMS_LINE_RATE_PER_SECOND
+        self.max_attempts = max_attempts or settings.SMS_MAX_ATTEMPTS
+        self.backoff = settings.SMS_RETRY_BACKOFF_SECONDS if backoff is None else backoff
+        self.batch_size = batch_size or settings.SMS_STATUS_BATCH_SIZE
+        self.lease = lease or timedelta(minutes=settings.SMS_SENDING_LEASE_MINUTES)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._handlers = {}
+        self._buckets = {}
+
+    def close(self):
+        self.session.close()
+
+    def _handler(self, line):
+        if line.pk not in self._handlers:
+            handler_class = SMS_LINE_HANDLERS.get(line.provider)
+            self._handlers[line.pk] = handler_class(line, session=self.session) if handler_class else None
+            self._buckets[line.pk] = TokenBucket(self.rate)
+        return self._handlers[line.pk]
+
+    def _deliver(self, log, handler):
+        """Sends one message, retrying with backoff. Returns (status, response, attempts)."""
+        bucket = self._buckets[log.line_number_id]
+        attempts = log.attempts
+        error = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            bucket.acquire()
+            attempts += 1
+            try:
+                return SMS_STATUS_SENT, handler._send(log.text, log.phone_number), attempts
+            except (requests.RequestException, ValueError) as e:
+                error = _describe_error(e)
+                logger.warning("SMS to %s failed (attempt %s): %s", log.phone_number, attempts, error)
+        return SMS_STATUS_FAILED, {"error": error}, attempts
+
+    def _save(self, logs):
+        """Writes the batch back with one bulk update and returns its (sent, failed) counts."""
+        now = get_jdatetime_now_with_timezone()
+        for log in logs:
+            log._updated_at = now
+        SMSLog.objects.bulk_update(logs, ["status", "response", "attempts", "_updated_at"])
+        sent = sum(log.status == SMS_STATUS_SENT for log in logs)
+        return sent, len(logs) - sent
+
+    def _claim(self, queryset, size):
+        """
+        Moves up to ``size`` pending messages to sending and returns them. Rows locked by a
+        concurrent dispatcher are skipped, so no message is handed to two of them. Messages whose
+        lease has run out (their dispatcher died before saving them) are claimed again.
+        """
+        now = get_jdatetime_now_with_timezone()
+        with transaction.atomic():
+            logs = list(
+                queryset.filter(Q(status=SMS_STATUS_PENDING) | Q(status=SMS_STATUS_SENDING, _updated_at__lt=now - self.lease))
+                .select_for_update(skip_locked=True, of=("self",))
+                .select_related("line_number")
+                .order_by("pk")[:size]
+            )
+            if logs:
+                SMSLog.objects.filter(pk__in=[log.pk for log in logs]).update(status=SMS_STATUS_SENDING, _updated_at=now)
+        return logs
+
+    def _send(self, executor, logs):
+        futures = {}
+        for log in logs:
+            handler = self._handler(log.line_number)
+            if handler is None:
+                log.status, log.response = SMS_STATUS_FAILED, {"error": "line provider has no handler"}
+                continue
+            futures[executor.submit(self._deliver, log, handler)] = log
+        for future in as_completed(futures):
+            log = futures[future]
+            try:
+                log.status, log.response, log.attempts = future.result()
+            except Exception as e:
+                logger.exception("SMS to %s could not be delivered", log.phone_number)
+                log.status, log.response = SMS_STATUS_FAILED, {"error": _describe_error(e)}
+        return self._save(logs)
+
+    def dispatch(self, queryset=None, limit=None):
+        """
+        Sends pending messages (optionally of ``queryset``), at most ``limit`` of them, claiming
+        one batch at a time before delivering it. Returns (sent, failed).
+        """
+        queryset = SMSLog.objects.all() if queryset is None else queryset
+        sent = failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while limit is None or sent + failed < limit:
+                size = self.batch_size if limit is None else min(self.batch_size, limit - sent - failed)
+                logs = self._claim(queryset, size)
+                if not logs:
+                    break
+                batch_sent, batch_failed = self._send(executor, logs)
+                sent, failed = sent + batch_sent, failed + batch_failed
+        return sent, failed
+
+
+def dispatch_pending_sms(queryset=None, limit=None, **options):
+    dispatcher = SMSDispatcher(**options)
+    try:
+        return dispatcher.dispatch(queryset, limit=limit)
+    finally:
+        dispatcher.close()
+
+
+def campaign_recipients(campaign):
+    """
+    Streams (id, first_name, last_name, phone_number, more_phone_numbers) of the targeted users.
+    Raises ValueError for a campaign without a target rather than sending to every user.
+    """
+    if not campaign.has_target:
+        raise ValueError(f"SMS campaign {campaign.pk} has no CRM label, course or supporting user to target")
+    users = User.objects.all()
+    if campaign.crm_label_id:
+        users = users.filter(crm_user__crm_label=campaign.crm_label_id)
+    if campaign.supporting_user_id:
+        users = users.filter(crm_user__supporting_user=campaign.supporting_user_id)
+    if campaign.course_id:
+        from courses.models import Registration
+
+        registrations = Registration.objects.filter(course_id=campaign.course_id)
+        if campaign.registration_status:
+            registrations = registrations.filter(status=campaign.registration_status)
+        if campaign.payment_status:
+            registrations = registrations.filter(payment_status=campaign.payment_status)
+        users = users.filter(pk__in=registrations.values("user_id"))
+    return (
+        users.order_by("pk")
+        .values_list("pk", "first_name", "last_name", "phone_number", "more_phone_numbers")
+        .iterator(chunk_size=2000)
+    )
+
+
+def campaign_messages(campaign):
+    """Yields (user_id, phone_number, text) once per distinct normalized phone number."""
+    seen = set()
+    for user_id, first_name, last_name, phone_number, more_phone_numbers in campaign_recipients(campaign):
+        phones = [normalize_phone(phone_number)]
+        if campaign.include_more_phone_numbers:
+            phones += split_phone_numbers(more_phone_numbers)
+        for phone in phones:
+            if phone is None or phone in seen:
+                continue
+            seen.add(phone)
+            text = campaign.render(
+                first_name=first_name,
+                last_name=last_name,
+                full_name=f"{first_name} {last_name}".strip(),
+                phone_number=phone,
+            )
+            yield user_id, phone, text
+
+
+@transaction.atomic
+def queue_campaign(campaign, lines=None, batch_size=SMS_CAMPAIGN_BATCH_SIZE):
+    """
+    Adds the campaign's messages to the outbox, spreading them round-robin over every line
+    that has a provider handler so the dispatcher can send on all lines in parallel. The whole
+    campaign is queued in one transaction, so an interrupted run leaves nothing half queued.
+    Returns the number of queued messages.
+    """
+    lines = lines or list(SMSLine.objects.filter(provider__in=SMS_LINE_HANDLERS).order_by("pk"))
+    if not lines:
+        raise ValueError("No SMS line with a supported provider is available")
+    queued = 0
+    batch = []
+    for index, (user_id, phone_number, text) in enumerate(campaign_messages(campaign)):
+        batch.append(
+            SMSLog(
+                line_number=lines[index % len(lines)],
+                user_id=user_id,
+                phone_number=phone_number,
+                text=text,
+                campaign=campaign,
+            )
+        )
+        if len(batch) >= batch_size:
+            SMSLog.objects.bulk_create(batch)
+            queued += len(batch)
+            batch = []
+    if batch:
+        SMSLog.objects.bulk_create(batch)
+        queued += len(batch)
+    return queued
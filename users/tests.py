@@ -1,5 +1,52 @@
-from django.test import TestCase
-from commons.utils import arabic_to_persian_characters
+import json
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.models import ADDITION, CHANGE
+from django.contrib.auth.models import Permission
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import ProtectedError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from commons import audit
+from commons.exports import export_file
+from commons.models import DetailedLog
+from commons.utils import arabic_to_persian_characters, get_jdatetime_now_with_timezone
+from commons.utils import find_and_merge_duplicate_users
+from courses.models import Course, CourseType, Registration
+from users.crm import assign_supporters, follow_up_queue, queue_entry
+from users.exports import CRM_EXPORT
+from users.dedup import build_merge_plan, find_duplicate_users, merge_approved_duplicates
+from users.merge import merge_users, revert_merge
+from users.models import (
+    ELANAK_SMS_PROVIDER,
+    KAVENEGAR_SMS_PROVIDER,
+    SMS_CAMPAIGN_STATUS_DONE,
+    SMS_CAMPAIGN_STATUS_FAILED,
+    SMS_CAMPAIGN_STATUS_PENDING,
+    DUPLICATE_STATUS_APPROVED,
+    DUPLICATE_STATUS_MERGED,
+    DUPLICATE_STATUS_SKIPPED,
+    CrmLog,
+    CrmUser,
+    CrmUserLabel,
+    DuplicateUserCandidate,
+    SMSCampaign,
+    SMSLine,
+    SMSLog,
+    User,
+    UserMergeLog,
+)
+from users.sms import SMS_STATUS_FAILED, SMS_STATUS_SENDING, SMS_STATUS_SENT, SMSDispatcher, dispatch_pending_sms
+
 
 class CoursePermissionTest(TestCase):
     def setUp(self):
@@ -8,4 +55,507 @@ class CoursePermissionTest(TestCase):
     def test_user_name_convert(self):
         assert arabic_to_persian_characters("كلمه") == "کلمه"
         assert arabic_to_persian_characters("نيما") == "نیما"
-        
\ No newline at end of file
+
+
+class _SMSProviderStub(BaseHTTPRequestHandler):
+    requests = []
+    failing = set()
+
+    def do_GET(self):  # noqa: N802
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        type(self).requests.append(params)
+        if params["to"] in self.failing:
+            self.failing.discard(params["to"])
+            self.send_response(503)
+            self.end_headers()
+            return
+        payload = json.dumps({"status": "ok", "to": params["to"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class SMSOutboxTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _SMSProviderStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        _SMSProviderStub.requests = []
+        self.line = SMSLine.objects.create(provider=ELANAK_SMS_PROVIDER, line_number="10001")
+        self.user = User.objects.create(username="user", phone_number="+989120000001")
+        host, port = self.server.server_address
+        self.settings_override = override_settings(ELANAK_API_URL=f"http://{host}:{port}/send.php")
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_dispatch_sends_retries_and_updates_in_batches(self):
+        phones = [f"+98912{i:07d}" for i in range(1, 31)]
+        with self.assertNumQueries(2):
+            logs = SMSLog.objects.enqueue(phones + phones[:1], "hello", line_number=self.line)
+        self.assertEqual(len(logs), 30)
+        self.assertEqual(logs[0].user_id, self.user.pk)
+        _SMSProviderStub.failing = {phones[3]}
+
+        # per batch of 10: claim (savepoint, select, update, release) and status update; then an empty claim
+        with self.assertNumQueries(3 * (4 + 1) + 3):
+            sent, failed = dispatch_pending_sms(workers=4, rate=1000, backoff=0, batch_size=10)
+
+        self.assertEqual((sent, failed), (30, 0))
+        self.assertEqual(len(_SMSProviderStub.requests), 31)
+        self.assertEqual(_SMSProviderStub.requests[0]["from"], "10001")
+        retried = SMSLog.objects.get(phone_number=phones[3])
+        self.assertEqual((retried.status, retried.attempts, retried.response["to"]), (1, 2, phones[3]))
+        self.assertEqual(dispatch_pending_sms(), (0, 0))
+
+    def test_claimed_messages_are_not_sent_again(self):
+        claimed, pending = SMSLog.objects.enqueue(["+989120000001", "+989120000002"], "hello", line_number=self.line)
+        SMSLog.objects.filter(pk=claimed.pk).update(status=SMS_STATUS_SENDING)
+        self.assertEqual(dispatch_pending_sms(), (1, 0))
+        self.assertEqual([request["to"] for request in _SMSProviderStub.requests], ["+989120000002"])
+
+    def test_expired_claims_are_sent_again(self):
+        (stranded,) = SMSLog.objects.enqueue(["+989120000001"], "hello", line_number=self.line)
+        SMSLog.objects.filter(pk=stranded.pk).update(
+            status=SMS_STATUS_SENDING, _updated_at=get_jdatetime_now_with_timezone() - timedelta(hours=1)
+        )
+        self.assertEqual(dispatch_pending_sms(), (1, 0))
+        self.assertEqual(SMSLog.objects.get(pk=stranded.pk).status, SMS_STATUS_SENT)
+
+    def test_unexpected_delivery_error_fails_only_its_message(self):
+        broken, sent = SMSLog.objects.enqueue(["+989120000001", "+989120000002"], "hello", line_number=self.line)
+        deliver = SMSDispatcher._deliver
+
+        def flaky_deliver(dispatcher, log, handler):
+            if log.pk == broken.pk:
+                raise KeyError("boom")
+            return deliver(dispatcher, log, handler)
+
+        with mock.patch.object(SMSDispatcher, "_deliver", flaky_deliver), self.assertLogs("users.sms", "ERROR"):
+            self.assertEqual(dispatch_pending_sms(), (1, 1))
+        broken.refresh_from_db()
+        self.assertEqual((broken.status, broken.response), (SMS_STATUS_FAILED, {"error": "KeyError"}))
+        self.assertEqual(SMSLog.objects.get(pk=sent.pk).status, SMS_STATUS_SENT)
+
+    def test_line_without_handler_fails_without_request(self):
+        line = SMSLine.objects.create(provider=KAVENEGAR_SMS_PROVIDER, line_number="20002")
+        SMSLog.objects.enqueue(["+989120000009"], "hello", line_number=line)
+        self.assertEqual(dispatch_pending_sms(), (0, 1))
+        self.assertEqual(_SMSProviderStub.requests, [])
+
+    def test_campaign_targets_label_and_course_and_spreads_over_lines(self):
+        SMSLine.objects.create(provider=ELANAK_SMS_PROVIDER, line_number="10002")
+        SMSLine.objects.create(provider=KAVENEGAR_SMS_PROVIDER, line_number="20002")
+        label = CrmUserLabel.objects.create(name="vip")
+        course_type = CourseType.objects.create(name="type", name_fa="نوع", category=1)
+        course = Course.objects.create(course_type=course_type, course_name="course", number=1)
+        users = [self.user] + [
+            User.objects.create(username=f"user{i}", first_name=f"name{i}", phone_number=f"+98912000000{i}") for i in range(2, 6)
+        ]
+        users[1].more_phone_numbers = "09120000001\n09350000000, 0935"
+        users[1].save()
+        for user in users[:4]:
+            user.crm_user.crm_label.add(label)
+        for user, status in zip(users, [5, 5, 5, 2, 5], strict=True):
+            Registration.objects.create(user=user, course=course, status=status)
+
+        campaign = SMSCampaign.objects.create(
+            name="reminder", text="سلام {first_name}", crm_label=label, course=course, registration_status=5
+        )
+        campaign.status = SMS_CAMPAIGN_STATUS_PENDING
+        campaign.save()
+        claimed = SMSCampaign.claim_next()
+        claimed.run(workers=4, rate=1000, backoff=0)
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, SMS_CAMPAIGN_STATUS_DONE)
+        self.assertEqual((campaign.total_recipients, campaign.sent_count, campaign.failed_count), (4, 4, 0))
+        sent_to = sorted(request["to"] for request in _SMSProviderStub.requests)
+        self.assertEqual(sent_to, ["+989120000001", "+989120000002", "+989120000003", "+989350000000"])
+        self.assertEqual({line: stats["sent"] for line, stats in campaign.line_stats.items()}, {"10001": 2, "10002": 2})
+        self.assertEqual(SMSLog.objects.get(phone_number="+989350000000").text, "سلام name2")
+
+    def test_campaign_without_target_sends_nothing(self):
+        label = CrmUserLabel.objects.create(name="vip")
+        campaign = SMSCampaign.objects.create(name="reminder", text="hello", crm_label=label)
+        with self.assertRaises(ProtectedError):
+            label.delete()
+        SMSCampaign.objects.filter(pk=campaign.pk).update(crm_label=None)
+        campaign.refresh_from_db()
+        campaign.run(workers=1, rate=1000, backoff=0)
+        self.assertEqual(campaign.status, SMS_CAMPAIGN_STATUS_FAILED)
+        self.assertFalse(SMSLog.objects.exists())
+        self.assertEqual(_SMSProviderStub.requests, [])
+
+
+class DuplicateUserTest(TestCase):
+    def setUp(self):
+        self.ali = User.objects.create(username="ali", first_name="علی", last_name="رضایی", phone_number="+989120000001")
+        self.ali_arabic = User.objects.create(username="ali2", first_name="علي", last_name="رضايي")
+        self.ali_other_phone = User.objects.create(username="ali3", first_name="A", last_name="R", more_phone_numbers="09120000001")
+        self.sara = User.objects.create(username="sara", first_name="سارا", last_name="", national_id="12345678")
+        self.sara_nid = User.objects.create(username="sara2", first_name="Sara", last_name="", national_id="0012345678")
+        User.objects.create(username="other", first_name="دیگر", last_name="کاربر", phone_number="+989120000009")
+        User.objects.create(username="mail1", first_name="x", last_name="", email="test@test.com")
+        User.objects.create(username="mail2", first_name="y", last_name="", email="TEST@test.com ")
+
+    def test_clusters_by_blocking_keys(self):
+        clusters = sorted(sorted(user["id"] for user in cluster) for cluster, _ in find_duplicate_users(max_block_size=2))
+        expected = [
+            sorted([self.ali.pk, self.ali_arabic.pk, self.ali_other_phone.pk]),
+            [self.sara.pk, self.sara_nid.pk],
+            sorted(User.objects.filter(username__startswith="mail").values_list("pk", flat=True)),
+        ]
+        self.assertEqual(clusters, sorted(expected))
+        self.assertEqual(len(list(find_duplicate_users(keys=("email",), max_block_size=1))), 0)
+
+    def test_plan_review_and_batched_merge(self):
+        build_merge_plan(keys=("name", "phone", "national_id"))
+        plan = {candidate.source_id: candidate for candidate in DuplicateUserCandidate.objects.all()}
+        self.assertEqual(set(plan), {self.ali_arabic.pk, self.ali_other_phone.pk, self.sara_nid.pk})
+        self.assertEqual(plan[self.ali_arabic.pk].target_id, self.ali.pk)
+        self.assertEqual(plan[self.ali_other_phone.pk].reasons, ["phone"])
+        self.assertEqual(plan[self.sara_nid.pk].target_id, self.sara.pk)
+
+        DuplicateUserCandidate.objects.exclude(source=self.sara_nid).update(status=DUPLICATE_STATUS_APPROVED)
+        self.assertEqual(merge_approved_duplicates(batch_size=1), 2)
+        self.ali_arabic.refresh_from_db()
+        self.assertEqual((self.ali_arabic.main_user_id, self.ali_arabic.is_active), (self.ali.pk, False))
+        self.assertEqual(DuplicateUserCandidate.objects.filter(status=DUPLICATE_STATUS_MERGED).count(), 2)
+        self.assertEqual(build_merge_plan(keys=("name", "phone", "national_id")), 1)
+
+        User.objects.filter(pk=self.sara.pk).update(main_user=self.ali)  # the target was merged away meanwhile
+        DuplicateUserCandidate.objects.filter(source=self.sara_nid).update(status=DUPLICATE_STATUS_APPROVED)
+        self.assertEqual(merge_approved_duplicates(), 0)
+        self.assertEqual(DuplicateUserCandidate.objects.get(source=self.sara_nid).status, DUPLICATE_STATUS_SKIPPED)
+
+    def test_merge_and_revert_actions_require_a_superuser(self):
+        build_merge_plan(keys=("name", "phone", "national_id"))
+        DuplicateUserCandidate.objects.update(status=DUPLICATE_STATUS_APPROVED)
+        staff = User.objects.create_user(username="staff", is_staff=True)
+        staff.user_permissions.set(
+            Permission.objects.filter(
+                codename__in=[
+                    "view_duplicateusercandidate",
+                    "change_duplicateusercandidate",
+                    "view_usermergelog",
+                    "change_usermergelog",
+                ]
+            )
+        )
+        self.client.force_login(staff)
+        candidates = list(DuplicateUserCandidate.objects.values_list("pk", flat=True))
+        response = self.client.post(
+            reverse("admin:users_duplicateusercandidate_changelist"),
+            {"action": "merge_approved", ACTION_CHECKBOX_NAME: candidates},
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(UserMergeLog.objects.exists())
+
+        self.client.force_login(User.objects.create_superuser(username="admin"))
+        self.client.post(
+            reverse("admin:users_duplicateusercandidate_changelist"),
+            {"action": "merge_approved", ACTION_CHECKBOX_NAME: candidates},
+        )
+        logs = list(UserMergeLog.objects.values_list("pk", flat=True))
+        self.assertEqual(len(logs), 3)
+
+        self.client.force_login(staff)
+        response = self.client.post(
+            reverse("admin:users_usermergelog_changelist"), {"action": "revert", ACTION_CHECKBOX_NAME: logs}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(UserMergeLog.objects.filter(reverted_at__isnull=False).exists())
+
+    def test_find_and_merge_duplicate_users_merges_phoneless_namesakes(self):
+        find_and_merge_duplicate_users()
+        self.ali_arabic.refresh_from_db()
+        self.ali_other_phone.refresh_from_db()
+        self.assertEqual(self.ali_arabic.main_user_id, self.ali.pk)
+        self.assertIsNone(self.ali_other_phone.main_user_id)
+
+
+class MergeUsersTest(TestCase):
+    def setUp(self):
+        course_type = CourseType.objects.create(name="type", name_fa="نوع", category=1)
+        self.first_course = Course.objects.create(course_type=course_type, course_name="first", number=1)
+        self.second_course = Course.objects.create(course_type=course_type, course_name="second", number=2)
+        self.target = User.objects.create(username="target", first_name="علی", phone_number="+989120000001")
+        self.source = User.objects.create(username="source", first_name="علی", email="ali@example.com", more_phone_numbers="0935")
+        self.label = CrmUserLabel.objects.create(name="vip")
+        self.source.crm_user.crm_label.add(self.label)
+        CrmLog.objects.create(
+            crm=self.source.crm_user, user=self.target, description="called", date=get_jdatetime_now_with_timezone()
+        )
+        Registration.objects.create(user=self.target, course=self.first_course)
+        self.duplicate_registration = Registration.objects.create(user=self.source, course=self.first_course)
+        self.moved_registration = Registration.objects.create(user=self.source, course=self.second_course)
+        self.referral = User.objects.create(username="referral", referer=self.source)
+        self.second_course.managing_users.add(self.source)
+
+    def test_merge_repoints_relations_and_reverts(self):
+        (log,) = merge_users([(self.source.pk, self.target.pk)])
+
+        self.assertEqual(Registration.objects.get(pk=self.moved_registration.pk).user_id, self.target.pk)
+        self.assertEqual(Registration.objects.get(pk=self.duplicate_registration.pk).user_id, self.source.pk)
+        self.assertEqual(log.conflicts["courses.Registration.user_id"], [self.duplicate_registration.pk])
+        self.assertEqual(self.target.crm_user.logs.count(), 1)
+        self.assertEqual(list(self.target.crm_user.crm_label.all()), [self.label])
+        self.assertEqual(User.objects.get(pk=self.referral.pk).referer_id, self.target.pk)
+        self.assertEqual(list(self.second_course.managing_users.all()), [self.target])
+        self.target.refresh_from_db()
+        self.source.refresh_from_db()
+        self.assertEqual((self.target.email, self.target.more_phone_numbers), ("ali@example.com", "0935"))
+        self.assertEqual((self.source.main_user_id, self.source.is_active), (self.target.pk, False))
+
+        revert_merge(log)
+        self.source.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual((self.source.username, self.source.main_user_id, self.source.is_active), ("source", None, True))
+        self.assertEqual(self.target.email, "")
+        self.assertEqual(Registration.objects.get(pk=self.moved_registration.pk).user_id, self.source.pk)
+        self.assertEqual(self.source.crm_user.logs.count(), 1)
+        self.assertEqual(list(self.source.crm_user.crm_label.all()), [self.label])
+        self.assertEqual(list(self.second_course.managing_users.all()), [self.source])
+
+    def test_batch_merge_follows_chains_with_constant_queries(self):
+        others = [User.objects.create(username=f"other{i}") for i in range(3)]
+        for other in others:
+            Registration.objects.create(user=other, course=self.second_course)
+        pairs = [(self.source.pk, self.target.pk), (others[0].pk, others[1].pk), (others[1].pk, self.target.pk)]
+        pairs.append((others[2].pk, self.target.pk))
+        with CaptureQueriesContext(connection) as queries:
+            logs = merge_users(pairs)
+        self.assertEqual(len(logs), 4)
+        self.assertEqual(User.objects.filter(main_user=self.target).count(), 4)
+        self.assertEqual(Registration.objects.filter(user=self.target, course=self.second_course).count(), 1)
+        updates = [query for query in queries if query["sql"].startswith('UPDATE "courses_registration"')]
+        self.assertEqual(len(updates), 1)
+
+
+class FollowUpQueueTest(TestCase):
+    def setUp(self):
+        self.supporter = User.objects.create(username="supporter", is_staff=True)
+        course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره", category=1)
+        course = Course.objects.create(course_type=course_type, course_name="Test Course", number=3)
+        now = get_jdatetime_now_with_timezone()
+        self.expected = []
+        for index in range(7):
+            user = User.objects.create(username=f"user{index}", first_name=f"U{index}")
+            crm = user.crm_user
+            crm.supporting_user = self.supporter
+            crm.status = 1
+            # two share a follow-up time, two were never scheduled
+            crm.next_follow_up = None if index >= 5 else now + timedelta(days=min(index, 3))
+            crm.save()
+            Registration.objects.create(user=user, course=course, status=5)
+            CrmLog.objects.create(crm=crm, user=self.supporter, description=f"call {index}", date=now)
+            self.expected.append(crm.pk)
+        done = User.objects.create(username="done").crm_user
+        done.supporting_user, done.status = self.supporter, 3
+        done.save()
+
+    def test_keyset_pages(self):
+        seen = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(2):
+                crm_users, cursor = follow_up_queue(self.supporter.pk, cursor, limit=3)
+                entries = [queue_entry(crm) for crm in crm_users]
+            seen += [entry["id"] for entry in entries]
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(entries[-1]["courses"], ["نوع دوره 3"])
+        self.assertEqual(entries[-1]["last_log"]["description"], "call 6")
+
+    def test_api(self):
+        self.client.force_login(self.supporter)
+        response = self.client.get("/users/crm/queue/", {"limit": 5})
+        self.assertEqual(len(response.json()["results"]), 5)
+        response = self.client.get("/users/crm/queue/", {"cursor": response.json()["next"]})
+        self.assertEqual([entry["id"] for entry in response.json()["results"]], self.expected[5:])
+        self.assertIsNone(response.json()["next"])
+        self.assertEqual(self.client.get("/users/crm/queue/", {"cursor": "bad"}).status_code, 400)
+
+
+class AssignSupportersTest(TestCase):
+    def setUp(self):
+        self.busy = User.objects.create(username="busy")
+        self.free = User.objects.create(username="free")
+        self.label = CrmUserLabel.objects.create(name="campaign")
+        for index in range(4):
+            crm = User.objects.create(username=f"open{index}").crm_user
+            crm.supporting_user, crm.status = self.busy, 1
+            crm.save()
+        self.kept = User.objects.create(username="kept").crm_user
+        self.kept.supporting_user = self.free
+        self.kept.save()
+        self.kept.crm_label.add(self.label)
+        for index in range(6):
+            User.objects.create(username=f"new{index}").crm_user.crm_label.add(self.label)
+        self.outside = User.objects.create(username="outside").crm_user
+
+    def test_balances_open_workload(self):
+        crm_users = CrmUser.objects.filter(crm_label=self.label)
+        with self.assertNumQueries(4):
+            report = assign_supporters(crm_users, [self.busy, self.free])
+        self.assertEqual(
+            report,
+            [
+                {"supporter": self.busy.pk, "before": 4, "assigned": 1, "after": 5},
+                {"supporter": self.free.pk, "before": 0, "assigned": 5, "after": 5},
+            ],
+        )
+        self.kept.refresh_from_db()
+        self.outside.refresh_from_db()
+        self.assertEqual(self.kept.supporting_user, self.free)
+        self.assertIsNone(self.outside.supporting_user)
+        self.assertFalse(crm_users.filter(supporting_user__isnull=True).exists())
+        self.assertEqual(crm_users.filter(status=1).count(), 6)
+
+    def test_reassign_keeps_closed_crm_users(self):
+        report = assign_supporters(CrmUser.objects.filter(crm_label=self.label), [self.busy, self.free], reassign=True)
+        self.assertEqual(sum(row["assigned"] for row in report), 6)
+        self.kept.refresh_from_db()
+        self.assertEqual((self.kept.supporting_user, self.kept.status), (self.free, 3))
+
+    def test_unknown_supporter_and_unscoped_command_write_nothing(self):
+        with self.assertRaisesMessage(ValueError, f"Unknown or inactive supporters: {self.free.pk + 1000}"):
+            assign_supporters(CrmUser.objects.filter(crm_label=self.label), [self.busy.pk, self.free.pk + 1000])
+        with self.assertRaisesMessage(CommandError, "Pass either --label or --all"):
+            call_command("assign_supporters", supporter=[self.busy.pk])
+        self.assertEqual(CrmUser.objects.filter(supporting_user__isnull=False).count(), 5)
+
+    def test_dry_run_writes_nothing(self):
+        report = assign_supporters(CrmUser.objects.filter(crm_label=self.label), [self.busy, self.free], dry_run=True)
+        self.assertEqual(sum(row["assigned"] for row in report), 6)
+        self.assertEqual(CrmUser.objects.filter(crm_label=self.label, supporting_user__isnull=True).count(), 6)
+
+
+class CrmUserAdminQueriesTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        self.client.force_login(self.admin)
+        self.course_type = CourseType.objects.create(name="Test Course Type", name_fa="نوع دوره", category=1)
+
+    def _crm(self, size):
+        user = User.objects.create(username=f"user{size}", first_name="Ali", last_name="Rezaei", referer=self.admin)
+        crm = user.crm_user
+        for index in range(size):
+            course = Course.objects.create(course_type=self.course_type, course_name=f"C{size}-{index}", number=size * 10 + index)
+            Registration.objects.create(user=user, course=course, status=5)
+            crm.crm_label.add(CrmUserLabel.objects.create(name=f"L{size}-{index}"))
+            CrmLog.objects.create(crm=crm, user=self.admin, description=f"call {index}", date=get_jdatetime_now_with_timezone())
+        return crm
+
+    def _count(self, method, *args):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(*args)
+        return response, queries
+
+    def _post_data(self, response):
+        data = {}
+        forms = [response.context["adminform"].form]
+        forms += response.context["inline_admin_formsets"][0].formset.initial_forms
+        for form in forms:
+            for field in form:
+                rendered = str(field)
+                for name, value in re.findall(r'name="([^"]+)"[^>]*? value="([^"]*)"', rendered):
+                    data[name] = value
+                for name in re.findall(r'<select name="([^"]+)"', rendered):
+                    data[name] = re.findall(r'<option value="([^"]+)" selected', rendered)
+                for name, text in re.findall(r'<textarea name="([^"]+)"[^>]*>\s*([^<]*)</textarea>', rendered):
+                    data[name] = text
+        management = response.context["inline_admin_formsets"][0].formset.management_form
+        data.update({field.html_name: field.value() for field in management})
+        data["logs-TOTAL_FORMS"] = data["logs-INITIAL_FORMS"]
+        return data
+
+    def test_change_view_query_count_is_constant(self):
+        small, large = self._crm(1), self._crm(6)
+        url = "/ndash/users/crmuser/{}/change/"
+        self.client.get(url.format(small.pk))  # warms the content type cache
+        response, small_get = self._count(self.client.get, url.format(small.pk))
+        response, large_get = self._count(self.client.get, url.format(large.pk))
+        self.assertEqual(len(small_get), len(large_get))
+
+        data = self._post_data(response)
+        response, unchanged = self._count(self.client.post, url.format(large.pk), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(any(query["sql"].startswith('UPDATE "users_user"') for query in unchanged))
+        self.assertFalse(any(query["sql"].startswith('UPDATE "users_crmlog"') for query in unchanged))
+
+        data["first_name"] = "Reza"
+        response, changed = self._count(self.client.post, url.format(large.pk), data)
+        self.assertEqual(response.status_code, 302)
+        updates = [query["sql"] for query in changed if query["sql"].startswith('UPDATE "users_user"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"email"', updates[0])
+        large.user.refresh_from_db()
+        self.assertEqual(large.user.first_name, "Reza")
+
+    def test_crm_log_change_is_audited_without_reloading_it(self):
+        crm = self._crm(1)
+        log = CrmLog.objects.select_related("crm__user").get(crm=crm)
+        self.assertTrue(DetailedLog.objects.filter(object_id=str(log.pk), action_flag=ADDITION).exists())
+        editor = User.objects.create(username="editor")
+        log.description, log.user = "answered", editor
+        with CaptureQueriesContext(connection) as queries:
+            log.save()
+        self.assertFalse(any(query["sql"].startswith("SELECT") for query in queries))
+        entry = DetailedLog.objects.get(object_id=str(log.pk), action_flag=CHANGE)
+        self.assertEqual(entry.user_id, editor.pk)
+        self.assertEqual(entry.old_values["description"], "call 0")
+        self.assertEqual(entry.old_values["user"], self.admin)
+        self.assertEqual(entry.changed_values, {"description": "answered"})
+        log.refresh_from_db()
+        self.assertEqual(log.user_id, self.admin.pk)
+
+    def test_inline_log_audits_are_written_in_one_batch(self):
+        crm = self._crm(4)
+        url = f"/ndash/users/crmuser/{crm.pk}/change/"
+        data = self._post_data(self.client.get(url))
+        for index in range(4):
+            data[f"logs-{index}-description"] = f"called back {index}"
+        # the request's audit buffer is drained once the admin's transaction has committed
+        with CaptureQueriesContext(connection) as queries, audit.buffered_audit(), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        crm_log_selects = [query for query in queries if query["sql"].startswith('SELECT "users_crmlog"')]
+        self.assertEqual(len(crm_log_selects), 1)
+        inserts = [query for query in queries if query["sql"].startswith('INSERT INTO "commons_detailedlog"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(DetailedLog.objects.filter(action_flag=CHANGE, change_message="").count(), 4)
+
+
+class CrmExportTest(TestCase):
+    def test_label_changes_invalidate_the_cache(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        label = CrmUserLabel.objects.create(name="vip")
+        first, second = (User.objects.create(username=name, first_name=name).crm_user for name in ("first", "second"))
+        first.crm_label.add(label)
+        # same timestamps everywhere, so only the label change can move the data version
+        CrmUser.objects.update(_updated_at=first._updated_at)
+        User.objects.update(_updated_at=first._updated_at)
+        crm_users = CrmUser.objects.filter(crm_label=label)
+        path = export_file(CRM_EXPORT, crm_users, "csv", cache_dir=cache_dir.name)
+        label.crm_users.remove(first)
+        label.crm_users.add(second)
+        changed = export_file(CRM_EXPORT, crm_users, "csv", cache_dir=cache_dir.name)
+        self.assertNotEqual(changed, path)
+        self.assertIn("second", changed.read_text(encoding="utf-8-sig"))
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .views import FollowUpQueueView
+
+urlpatterns = [
+    path("crm/queue/", FollowUpQueueView.as_view(), name="crm-follow-up-queue"),
+]
@@ -1 +1,20 @@
-# Create your views here.
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.http import JsonResponse
+from django.views import View
+
+from .crm import FOLLOW_UP_QUEUE_SIZE, follow_up_queue, queue_entry, queue_supporter_id
+
+
+class FollowUpQueueView(UserPassesTestMixin, View):
+    """The requesting supporter's next CRM users to call, paginated with ``?cursor=``."""
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        try:
+            limit = max(1, min(int(request.GET.get("limit", FOLLOW_UP_QUEUE_SIZE)), 200))
+            crm_users, next_cursor = follow_up_queue(queue_supporter_id(request), request.GET.get("cursor"), limit)
+        except ValueError:
+            return JsonResponse({"error": "invalid cursor, supporter or limit"}, status=400)
+        return JsonResponse({"results": [queue_entry(crm) for crm in crm_users], "next": next_cursor})